@@ -1,15 +1,29 @@
-import ngrok
+import asyncio
 import logging
+import os
+import uvicorn
+from typing import Optional
+from urllib.parse import quote
 
 from const import AppConfig
 from fastapi import FastAPI, Request, Response, WebSocket
 from fastapi.logger import logger
 from fastapi.websockets import WebSocketState
 
-from processing.telephony import VonageTel
-from processing.texttospeech import ElevenLabsTTS
-from processing.speechtotext import DeepgramSTT
-from processing.generate_response import OpenAIGPT
+from processing.telephony import OutboundScheduler
+from processing.telephony.abstract import Telephony
+from processing.texttospeech import CachedTTS, HedgedTTS, LimitedTTS, TTSCache
+from processing.generate_response import ResponseCache
+from processing.speechtotext import HedgedSTT
+from processing.pool import ConnectionPool
+from processing import admission, logs, providers
+from processing.prewarm import Prewarmer, WarmCall
+from processing.recorder import CallRecorder
+from processing.session import CallSession
+from processing.metrics import Metrics, render
+from processing.signals import SignalHandler
+from processing.store import SharedStore
+from processing.supervisor import DrainingServer, Supervisor
 
 
 # ----------------------------------------------------------------------------#
@@ -24,18 +38,54 @@ class APISettings:
     NGROK_TOKEN: str = AppConfig.NGROK_AUTHTOKEN
     USE_NGROK: bool = AppConfig.ENV == "development"
 
-    Telephony: VonageTel = VonageTel.create()
+    Outbound: OutboundScheduler = OutboundScheduler()
+    TTSCache: Optional[TTSCache] = None
+    ResponseCache: Optional[ResponseCache] = None
+    Prewarm: Optional[Prewarmer] = None
+
+    # shared with the other workers, when there are any
+    Store: Optional[SharedStore] = None
+    Publisher: Optional[asyncio.Task] = None
+
+    # created on first use (see `Telephony`), importing the app opens nothing
+    _telephony: Optional[Telephony] = None
+
+    @property
+    def Telephony(self) -> Telephony:
+        if self._telephony is None:
+            self._telephony = providers.load("telephony", AppConfig.TELEPHONY).create()
+        return self._telephony
+
+    def _tts(self, name: str):
+        tts = LimitedTTS(providers.load("tts", name).create(), name)
+        if self.TTSCache is not None:
+            return CachedTTS(tts, self.TTSCache)
+        return tts
 
     def get_tts(self):
-        """ we want to renew the lease on the clients """
-        return ElevenLabsTTS.create()
+        """ cheap, the http client, websocket pool and audio cache are shared """
+        if AppConfig.TTS_FALLBACK:
+            return HedgedTTS(self._tts(AppConfig.TTS), self._tts(AppConfig.TTS_FALLBACK),
+                             AppConfig.TTS, AppConfig.TTS_FALLBACK)
+        return self._tts(AppConfig.TTS)
 
     def get_stt(self):
-        """ we want to renew the lease on the clients """
-        return DeepgramSTT.create()
+        """ cheap, the client is shared """
+        stt = providers.load("stt", AppConfig.STT).create()
+        if AppConfig.STT_FALLBACK:
+            fallback = providers.load("stt", AppConfig.STT_FALLBACK).create()
+            return HedgedSTT(stt, fallback, AppConfig.STT, AppConfig.STT_FALLBACK)
+        return stt
 
     def get_gpt(self):
-        return OpenAIGPT.create()
+        """ cheap, the client and response cache are shared """
+        gpt = providers.load("gpt", AppConfig.GPT).create()
+        gpt.cache = self.ResponseCache
+        return gpt
+
+    def get_pools(self) -> list[ConnectionPool]:
+        """ every connection pool in use by this process """
+        return [tts.pool for tts in providers.tts_classes() if tts.pool is not None]
 
     @property
     def WEBSOCKET_URL(self):
@@ -56,6 +106,9 @@ class APISettings:
 # ----------------------------------------------------------------------------#
 logger.setLevel(logging.INFO)
 
+# json lines through a queue, see processing/logs.py
+LOG_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_conf.yaml")
+
 # ----------------------------------------------------------------------------#
 # API Configuration
 # ----------------------------------------------------------------------------#
@@ -63,20 +116,107 @@ logger.setLevel(logging.INFO)
 app = FastAPI()
 API = APISettings()
 
-if API.USE_NGROK:
-    listener = ngrok.connect(
-        addr=f"{API.BASE_URL}:{API.PORT}",
-        authtoken=API.NGROK_TOKEN
-    )
 
-    # get listener url to update the base url
-
-    print('\n' + ('=' * 80))
-    print(f"Tunneled localhost:{API.PORT} -> {API.BASE_URL}")
-    print(f"Connected to +{API.Telephony.get_phone_number()}")
-    API.update_url(listener.url())
-    API.Telephony.update_app_urls(listener.url())
-    print(('=' * 80) + '\n')
+async def synthesize(text: str) -> list[bytes]:
+    """ the audio of `text`, in frames (from the cache, if it has been said before) """
+    tts = API.get_tts()
+    try:
+        return [frame async for frame in await tts.speak(text)]
+    finally:
+        await tts.close()
+
+
+async def warm_call(call: WarmCall):
+    """ open the providers for a call that is being answered """
+    call.gpt = API.get_gpt()
+    call.stt = API.get_stt()
+    call.tts = API.get_tts()
+
+    async def greeting():
+        # the websocket synthesizes it again if this fails, no need to go cold
+        if AppConfig.GREETING:
+            try:
+                call.greeting = await synthesize(AppConfig.GREETING)
+            except Exception as e:
+                logger.warning(f"{call.call_id}: could not synthesize the greeting: {e!r}")
+
+    await asyncio.gather(call.stt.open(), call.tts.prepare(), greeting())
+
+
+async def publish_metrics():
+    """ share this worker's metrics, so /metrics on any worker covers the host """
+    assert API.Store is not None
+    while True:
+        API.Store.publish(Metrics.families())
+        await asyncio.sleep(SharedStore.PUBLISH_INTERVAL)
+
+
+active_calls = Metrics.gauge("active_calls", "calls currently connected to /ws")
+turned_away = {
+    reason: Metrics.counter("calls_turned_away_total", "calls turned away at /answer", {"reason": reason})
+    for reason in ("draining", "max_calls", "overloaded")
+}
+
+
+@Metrics.collector
+def collect_metrics():
+    for pool in API.get_pools():
+        for stat, value in pool.metrics.as_dict().items():
+            Metrics.gauge(f"pool_{stat}", f"connection pool {stat}", {"pool": pool.name}).set(value)
+
+    Metrics.gauge("outbound_late_ticks", "outbound pacer ticks that ran late and were skipped").set(API.Outbound.late_ticks)
+    Metrics.gauge("draining", "1 while new calls are turned away, before shutting down").set(float(SignalHandler.DRAINING))
+
+
+@app.on_event("startup")
+async def startup():
+    # open the provider connections before the first call needs them
+    for tts in providers.tts_classes():
+        pool = tts.create_pool(
+            size=AppConfig.TTS_POOL_SIZE,
+            max_idle=AppConfig.TTS_POOL_MAX_IDLE
+        )
+        if pool is not None:
+            pool.start()
+
+    if AppConfig.TTS_CACHE:
+        API.TTSCache = TTSCache(
+            memory_bytes=AppConfig.TTS_CACHE_MEMORY_MB * 1024 * 1024,
+            disk_path=AppConfig.TTS_CACHE_DIR,
+            disk_bytes=AppConfig.TTS_CACHE_DISK_MB * 1024 * 1024
+        )
+
+    if AppConfig.RESPONSE_CACHE:
+        API.ResponseCache = ResponseCache(
+            max_entries=AppConfig.RESPONSE_CACHE_SIZE,
+            ttl=AppConfig.RESPONSE_CACHE_TTL,
+            threshold=AppConfig.RESPONSE_CACHE_THRESHOLD,
+            min_words=AppConfig.RESPONSE_CACHE_MIN_WORDS
+        )
+
+    if AppConfig.WORKERS > 1:
+        API.Store = SharedStore(AppConfig.STATE_DB)
+        API.Publisher = asyncio.create_task(publish_metrics())
+
+    if AppConfig.PREWARM:
+        # the websocket may land on another worker, which starts it cold
+        released = API.Store.connected_elsewhere if API.Store else None
+        API.Prewarm = Prewarmer(warm_call, timeout=AppConfig.PREWARM_TIMEOUT, released=released)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if API.Prewarm is not None:
+        await API.Prewarm.close()
+
+    if API.Store is not None:
+        if API.Publisher is not None:
+            API.Publisher.cancel()
+        API.Store.publish(Metrics.families())
+        API.Store.close()
+
+    for pool in API.get_pools():
+        await pool.close()
 
 
 # ----------------------------------------------------------------------------#
@@ -86,43 +226,57 @@ if API.USE_NGROK:
 @app.websocket('/ws')
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    active_calls.inc()
 
     data = API.Telephony.websocket(
         ws=websocket,
         on_event=lambda e: logger.info(f"Dial : {e}")
     )
 
-    # create the gpt class (for context reset)
-    gpt = API.get_gpt()
-    stt = API.get_stt()
+    # the providers opened when the call was answered, if it was warmed up
+    call_id = websocket.query_params.get("uuid")
+    if API.Store is not None and call_id:
+        API.Store.connected(call_id)
 
-    async def register_word(word: str):
-        await gpt.append(word)
+    # a drain waits for this call to end
+    session_id = call_id or str(id(websocket))
+    SignalHandler.open(session_id)
 
-    # create the next step (when user stops speaking)
-    async def process_transcript():
-        await stt.pause()
+    # every record logged for this call (and the tasks it starts) carries its id
+    logs.call_id.set(session_id)
 
-        # get the tts client
-        tts = API.get_tts()
+    warm = await API.Prewarm.claim(call_id) if API.Prewarm else None
+    warm = warm or WarmCall(call_id or "")
 
-        # generate response & reset transcript
-        response_stream = gpt.generate()
+    async def send_frame(frame: bytes):
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            await websocket.send_bytes(frame)
 
-        response_media = await tts.speak_stream(response_stream)
+    session = CallSession(
+        call_id=session_id,
+        audio=data,
+        stt=warm.stt or API.get_stt(),
+        gpt=warm.gpt or API.get_gpt(),
+        new_tts=API.get_tts,
+        scheduler=API.Outbound,
+        send=send_frame,
+        clear=lambda: API.Telephony.clear(websocket),
+        synthesize=synthesize,
+        next_tts=warm.tts,
+        greeting=warm.greeting,
+        # everything that goes in and out of the call, to replay it later
+        recorder=CallRecorder.create(session_id) if AppConfig.RECORD_DIR else None,
+    )
 
-        async for chunk in response_media:
-            if not websocket.client_state == WebSocketState.DISCONNECTED:
-                await websocket.send_bytes(chunk)
+    try:
+        await session.run()
 
-        await stt.resume()
+    finally:
+        if API.Store is not None and call_id:
+            API.Store.ended(call_id)
 
-    # start the speech-to-text service
-    await stt.transcribe(
-        audio=data,
-        callback=register_word,
-        finish=process_transcript
-    )
+        SignalHandler.close(session_id)
+        active_calls.dec()
 
     if websocket.client_state != WebSocketState.DISCONNECTED:
         await websocket.close()
@@ -132,12 +286,45 @@ async def websocket_endpoint(websocket: WebSocket):
 # Webhooks
 # ----------------------------------------------------------------------------#
 
+def turn_away() -> Optional[str]:
+    """ why a new call should not be taken now, if it should not """
+    if SignalHandler.DRAINING:
+        return "draining"
+
+    if AppConfig.MAX_CALLS is not None:
+        calls = API.Store.active_calls() if API.Store is not None else active_calls.value
+        if calls >= AppConfig.MAX_CALLS:
+            return "max_calls"
+
+    wait = admission.projected_wait(admission.FIRST_TURN)
+    if wait > AppConfig.SHED_WAIT:
+        logger.warning(f"Turning a call away, its first turn would queue for {wait:.1f}s")
+        return "overloaded"
+
+    return None
+
+
 @app.post('/answer')
 async def answer(request: Request):
-    return await API.Telephony.answer(
-        request,
-        ws_url=f"wss://{API.BASE_URL}/ws"
-    )
+    # shutting down (don't start a call we might have to cut short), or too
+    # busy to give another caller a timely first reply
+    if reason := turn_away():
+        turned_away[reason].inc()
+        if AppConfig.DRAIN_TRANSFER_URL:
+            return await API.Telephony.answer(request, ws_url=AppConfig.DRAIN_TRANSFER_URL)
+        return await API.Telephony.busy(request, AppConfig.DRAIN_MESSAGE)
+
+    ws_url = f"wss://{API.BASE_URL}/ws"
+
+    # start opening the providers now, the websocket connects in a moment
+    if call_id := await API.Telephony.call_id(request):
+        ws_url += f"?uuid={quote(call_id)}"
+        if API.Store is not None:
+            API.Store.answered(call_id)
+        if API.Prewarm is not None:
+            API.Prewarm.start(call_id)
+
+    return await API.Telephony.answer(request, ws_url=ws_url)
 
 
 @app.post('/event')
@@ -145,18 +332,65 @@ async def event(request: Request):
     return Response(status_code=200)
 
 
+@app.get('/metrics')
+async def metrics():
+    if API.Store is None:
+        return Response(Metrics.render(), media_type="text/plain; version=0.0.4")
+
+    # every worker's, with this one's up to date
+    API.Store.publish(Metrics.families())
+    return Response(render(API.Store.metrics()), media_type="text/plain; version=0.0.4")
+
+
 # ----------------------------------------------------------------------------#
 # Main
 # ----------------------------------------------------------------------------#
-if __name__ == "__main__":
+def tunnel():
+    """ expose the app through ngrok, and point the vonage application at it """
+    import ngrok
 
-    import uvicorn
+    listener = ngrok.connect(
+        addr=f"{API.BASE_URL}:{API.PORT}",
+        authtoken=API.NGROK_TOKEN
+    )
+
+    # get listener url to update the base url
+
+    print('\n' + ('=' * 80))
+    print(f"Tunneled localhost:{API.PORT} -> {API.BASE_URL}")
+    print(f"Connected to +{API.Telephony.get_phone_number()}")
+    API.update_url(listener.url())
+    API.Telephony.update_app_urls(listener.url())
+    print(('=' * 80) + '\n')
+
+
+def serve(host: str = "localhost", **kwargs):
+    """ run the app, in AppConfig.WORKERS processes if there is more than one """
+    kwargs.setdefault("log_config", LOG_CONFIG)
+    config = uvicorn.Config(app=app, host=host, port=API.PORT, ws="websockets", **kwargs)
+
+    # import the providers now rather than on the first call (before forking,
+    # so the workers share them) and fail early if one is misconfigured
+    providers.selected()
+    assert API.Telephony is not None
+
+    if AppConfig.WORKERS > 1:
+        Supervisor(
+            config,
+            workers=AppConfig.WORKERS,
+            store=SharedStore(AppConfig.STATE_DB),
+            drain_timeout=AppConfig.DRAIN_TIMEOUT,
+            turn_timeout=AppConfig.DRAIN_TURN_TIMEOUT
+        ).run()
+    else:
+        DrainingServer(config, AppConfig.DRAIN_TIMEOUT, AppConfig.DRAIN_TURN_TIMEOUT).run()
+
+
+if __name__ == "__main__":
     logger.debug("Starting server...")
 
-    uvicorn.run(
-        app=app,
-        host="localhost",
-        port=API.PORT,
-        ws="websockets",
-        log_config="log_conf.yaml",
-    )
+    # once for the whole host, before any workers start
+    if API.USE_NGROK:
+        tunnel()
+
+    serve()
@@ -0,0 +1,130 @@
+"""
+Turn latency through a spike of calls, against a simulated provider with a
+quota of --quota requests at once: past it, requests get a 429 and are
+retried with backoff (twice, as the provider SDKs do), then fail.
+
+    none      no limiter, every turn goes straight to the provider
+    limit     processing/admission.py's limiter at the quota, first come first served
+    priority  the same, with first turns ahead of later ones
+    shed      priority, and /answer turns calls away past AppConfig.SHED_WAIT
+
+Each call takes --turns turns, a request of --service seconds each, with
+--think seconds of the caller talking in between.
+
+    python -m benchmarks.admission --calls 200 --spike 2
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Optional
+
+from const import AppConfig
+from processing import admission
+
+from .probes import format_ms, percentiles
+
+
+class Provider:
+    """ serves `quota` requests at once, and 429s the rest """
+
+    def __init__(self, quota: int, service: float) -> None:
+        self.quota = quota
+        self.service = service
+        self.open = 0
+        self.rejected = 0
+
+    async def request(self) -> bool:
+        if self.open >= self.quota:
+            self.rejected += 1
+            await asyncio.sleep(0.05)
+            return False
+
+        self.open += 1
+        try:
+            await asyncio.sleep(self.service * random.uniform(0.8, 1.2))
+            return True
+        finally:
+            self.open -= 1
+
+
+async def with_retries(provider: Provider, retries: int = 2) -> bool:
+    for attempt in range(retries + 1):
+        if await provider.request():
+            return True
+        if attempt < retries:
+            await asyncio.sleep(0.5 * 2 ** attempt * random.uniform(0.75, 1.0))
+    return False
+
+
+async def run(mode: str, args) -> None:
+    random.seed(1)
+    admission._limiters.clear()
+    AppConfig.GPT_CONCURRENCY = args.quota if mode != "none" else None
+    AppConfig.GPT_RATE = None
+
+    provider = Provider(args.quota, args.service)
+    limiter = admission.limiter("gpt", "benchmark")
+    first: list[float] = []
+    later: list[float] = []
+    failed = 0
+    shed = 0
+
+    async def turn(number: int) -> None:
+        nonlocal failed
+        urgency = admission.LATER_TURN if mode in ("priority", "shed") and number > 1 else admission.FIRST_TURN
+        started = time.monotonic()
+
+        if mode == "none":
+            ok = await with_retries(provider)
+        else:
+            async with limiter.slot(urgency):
+                ok = await with_retries(provider)
+
+        if not ok:
+            failed += 1
+        else:
+            (first if number == 1 else later).append(time.monotonic() - started)
+
+    async def call() -> None:
+        nonlocal shed
+        if mode == "shed" and admission.projected_wait(admission.FIRST_TURN) > args.shed_wait:
+            shed += 1
+            return
+
+        for number in range(1, args.turns + 1):
+            await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+            await turn(number)
+
+    calls = []
+    for _ in range(args.calls):
+        calls.append(asyncio.create_task(call()))
+        await asyncio.sleep(args.spike / args.calls)
+    await asyncio.gather(*calls)
+
+    print(
+        f"{mode:>8} calls={args.calls:<4} shed={shed:<4} failed turns={failed:<4} 429s={provider.rejected:<5}\n"
+        f"         first turn: {format_ms(percentiles(first))}\n"
+        f"         later turns: {format_ms(percentiles(later))}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--spike", type=float, default=2, help="seconds over which the calls arrive")
+    parser.add_argument("--quota", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--service", type=float, default=0.5)
+    parser.add_argument("--think", type=float, default=1.0)
+    parser.add_argument("--shed-wait", type=float, default=AppConfig.SHED_WAIT)
+    parser.add_argument("--mode", nargs="+", choices=["none", "limit", "priority", "shed"],
+                        default=["none", "limit", "priority", "shed"])
+    args = parser.parse_args()
+
+    for mode in args.mode:
+        asyncio.run(run(mode, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Time to first audio, playback stalls and chunk shape for different ways of
+cutting an LLM stream into TTS requests.
+
+This is a simulation on a virtual clock, so it is deterministic and fast:
+tokens arrive at a fixed rate, each chunk is synthesized in order with a
+fixed latency plus a per-character cost, and playback starts with the first
+audio. A stall is time the caller spends listening to silence because the
+next chunk was not ready. Short chunks start quickly but sound choppy (they
+rarely end on a sentence); long chunks sound natural but start late.
+
+    python -m benchmarks.chunk_policy --token-interval 0.03 --tts-latency 0.25
+"""
+import argparse
+import asyncio
+import re
+from typing import AsyncGenerator, Callable
+
+from processing.texttospeech.chunker import ChunkPolicy, chunk_text
+
+from .probes import format_ms, percentiles
+
+
+REPLIES = [
+    "Sure, Dr. Smith. Pancakes are better than waffles, and here's why. They are fluffier, "
+    "they soak up syrup evenly, and a stack of three costs about $4.50 at most diners. "
+    "You can make them in any pan, no special iron needed. Would you like a recipe?",
+    "Great question! The St. Louis diner on 5th Ave. serves both, but their pancakes sell "
+    "about 2.5 times as well. Honestly, once you try them with blueberries, you won't go back.",
+    "I hear you. Waffles have their fans, e.g. people who like a crunch. But pancakes are "
+    "quicker, they take about ten minutes from bowl to plate, and kids love them. "
+    "Shall I tell you how to make them extra fluffy?",
+]
+
+
+def tokenize(text: str) -> list[str]:
+    """ roughly how an LLM streams text: words with their leading space """
+    return re.findall(r"\s?\S+", text)
+
+
+async def legacy_chunker(chunks: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """ the chunker ElevenLabsTTS used to have inline, it cuts at any punctuation or space """
+    splitters = (".", ",", "?", "!", ";", ":", "—", "-", "(", ")", "[", "]", "}", " ")
+    buffer = ""
+    async for text in chunks:
+        if buffer.endswith(splitters):
+            yield buffer + " "
+            buffer = text
+        elif text.startswith(splitters):
+            yield buffer + text[0] + " "
+            buffer = text[1:]
+        else:
+            buffer += text
+    if buffer:
+        yield buffer + " "
+
+
+async def raw_tokens(chunks: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """ what PlayHTTTS used to send: every token on its own """
+    async for text in chunks:
+        yield text
+
+
+async def simulate(reply: str, chunker: Callable, token_interval: float,
+                   tts_latency: float, tts_per_char: float, speech_per_char: float) -> dict:
+    now = 0.0
+
+    async def tokens():
+        nonlocal now
+        for i, token in enumerate(tokenize(reply)):
+            now = i * token_interval
+            yield token
+
+    sent: list[tuple[float, str]] = []
+    async for chunk in chunker(tokens()):
+        sent.append((now, chunk))
+
+    # synthesize in order, then play back to back
+    tts_free = 0.0
+    playing_until = None
+    stall = 0.0
+    first_audio = None
+
+    for at, chunk in sent:
+        ready = max(at, tts_free) + tts_latency + tts_per_char * len(chunk)
+        tts_free = ready
+
+        if playing_until is None:
+            first_audio = ready
+            playing_until = ready
+        elif ready > playing_until:
+            stall += ready - playing_until
+            playing_until = ready
+
+        playing_until += speech_per_char * len(chunk.strip())
+
+    sentence_ends = sum(1 for _, chunk in sent if chunk.rstrip().endswith((".", "!", "?")))
+    return {
+        "first_audio": first_audio or 0.0,
+        "stall": stall,
+        "chunks": len(sent),
+        "mean_chars": sum(len(c) for _, c in sent) / max(1, len(sent)),
+        "sentence_ends": sentence_ends / max(1, len(sent)),
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    policies: list[tuple[str, Callable]] = [
+        ("raw tokens", raw_tokens),
+        ("legacy splitter", legacy_chunker),
+    ]
+    for first_min, min_chars, max_chars in ((0, 40, 200), (5, 40, 200), (12, 40, 200), (30, 40, 200), (5, 60, 250)):
+        policy = ChunkPolicy(first_min, min_chars, max_chars)
+        policies.append((f"first={first_min} min={min_chars} max={max_chars}",
+                         lambda stream, policy=policy: chunk_text(stream, policy)))
+
+    print(f"token every {args.token_interval * 1000:.0f}ms, tts {args.tts_latency * 1000:.0f}ms "
+          f"+ {args.tts_per_char * 1000:.1f}ms/char, speech {args.speech_per_char * 1000:.0f}ms/char\n")
+    print(f"{'policy':<30} {'first audio':>28} {'stall':>10} {'chunks':>7} {'chars':>6} {'sentences':>10}")
+
+    for name, chunker in policies:
+        results = [
+            await simulate(reply, chunker, args.token_interval, args.tts_latency,
+                           args.tts_per_char, args.speech_per_char)
+            for reply in REPLIES
+        ]
+        first = percentiles([r["first_audio"] for r in results], points=(50,))
+        stall = sum(r["stall"] for r in results) / len(results)
+        chunks = sum(r["chunks"] for r in results) / len(results)
+        chars = sum(r["mean_chars"] for r in results) / len(results)
+        sentences = sum(r["sentence_ends"] for r in results) / len(results)
+        print(f"{name:<30} {format_ms(first):>28} {stall * 1000:>8.0f}ms {chunks:>7.1f} {chars:>6.0f} {sentences:>10.0%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token-interval", type=float, default=0.03, help="seconds between LLM tokens")
+    parser.add_argument("--tts-latency", type=float, default=0.25, help="fixed seconds per tts request")
+    parser.add_argument("--tts-per-char", type=float, default=0.002, help="tts seconds per character")
+    parser.add_argument("--speech-per-char", type=float, default=0.065, help="playback seconds per character")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
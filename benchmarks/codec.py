@@ -0,0 +1,105 @@
+"""
+CPU cost of converting text-to-speech audio to the call's format, with one
+`codec.Converter` per stream, fed 20ms frames round-robin as they would be
+with many calls on one worker. Compared against the stdlib `audioop`
+(ratecv / lin2ulaw / ulaw2lin) where it has an equivalent.
+
+    python -m benchmarks.codec --streams 500 --seconds 2
+"""
+import argparse
+import time
+import warnings
+from typing import Callable, Optional
+
+import numpy as np
+
+from processing.codec import AudioFormat, Converter, encode
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:  # removed in python 3.13
+        audioop = None
+
+
+CASES = [
+    ("pcm 16k -> 8k", AudioFormat("linear16", 16000), AudioFormat("linear16", 8000)),
+    ("pcm 24k -> 16k", AudioFormat("linear16", 24000), AudioFormat("linear16", 16000)),
+    ("pcm 22.05k -> 16k", AudioFormat("linear16", 22050), AudioFormat("linear16", 16000)),
+    ("pcm 44.1k stereo -> 16k", AudioFormat("linear16", 44100, channels=2), AudioFormat("linear16", 16000)),
+    ("pcm 16k -> mulaw 8k", AudioFormat("linear16", 16000), AudioFormat("mulaw", 8000)),
+    ("mulaw 8k -> pcm 16k", AudioFormat("mulaw", 8000), AudioFormat("linear16", 16000)),
+]
+
+
+def frames(source: AudioFormat, seconds: float, frame: float = 0.02) -> list[bytes]:
+    """ a 220Hz tone with some noise, cut into `frame` second chunks """
+    rate = source.sample_rate
+    t = np.arange(int(rate * seconds)) / rate
+    samples = np.sin(2 * np.pi * 220 * t) * 8000 + np.random.default_rng(0).normal(0, 500, len(t))
+    samples = np.repeat(samples.astype("<i2"), source.channels)
+    data = encode(samples, source.encoding)
+
+    size = source.size(frame)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def audioop_converter(source: AudioFormat, target: AudioFormat) -> Optional[Callable[[bytes], bytes]]:
+    """ the closest audioop pipeline, with its own state per stream """
+    if audioop is None:
+        return None
+
+    state = None
+
+    def convert(data: bytes) -> bytes:
+        nonlocal state
+        if source.encoding == "mulaw":
+            data = audioop.ulaw2lin(data, 2)
+        if source.channels == 2:
+            data = audioop.tomono(data, 2, 0.5, 0.5)
+        data, state = audioop.ratecv(data, 2, 1, source.sample_rate, target.sample_rate, state)
+        if target.encoding == "mulaw":
+            data = audioop.lin2ulaw(data, 2)
+        return data
+
+    return convert
+
+
+def run(converters: list[Callable[[bytes], bytes]], chunks: list[bytes]) -> float:
+    """ µs per frame, feeding every stream one frame at a time """
+    started = time.process_time()
+    for chunk in chunks:
+        for convert in converters:
+            convert(chunk)
+    elapsed = time.process_time() - started
+    return elapsed / (len(chunks) * len(converters)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    # each stream gets a frame every 20ms, so a core has 20ms / streams per frame
+    budget = 20_000 / args.streams
+
+    print(f"{args.streams} streams of 20ms frames, {budget:.1f}µs per frame is one whole core\n")
+    print(f"{'conversion':<26} {'codec µs':>9} {'core':>7} {'audioop µs':>11} {'core':>7}")
+
+    for name, source, target in CASES:
+        chunks = frames(source, args.seconds)
+
+        ours = run([Converter(source, target).convert for _ in range(args.streams)], chunks)
+        line = f"{name:<26} {ours:>9.1f} {ours / budget:>7.1%}"
+
+        if audioop_converter(source, target) is not None:
+            theirs = run([audioop_converter(source, target) for _ in range(args.streams)], chunks)
+            line += f" {theirs:>11.1f} {theirs / budget:>7.1%}"
+
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
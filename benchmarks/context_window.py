@@ -0,0 +1,131 @@
+"""
+Prompt size per turn over long scripted calls, for the bounded history
+(rolling window plus background summary) against the previous flat history,
+which re-sent the whole conversation as one system message every turn.
+
+Token counts use tiktoken when it is installed, otherwise the estimate in
+processing/generate_response/history.py.
+
+    python -m benchmarks.context_window --turns 50 --calls 3
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+
+from const import AppConfig
+from processing.generate_response import OpenAIGPT
+from processing.generate_response.history import MESSAGE_OVERHEAD, count_tokens
+
+from .fakes import FakeOpenAI
+from .probes import percentiles
+
+
+SCRIPT = [
+    "Hi, who am I speaking with?",
+    "I was calling to ask about breakfast options, what would you recommend?",
+    "Honestly I have always preferred waffles, they are crispier.",
+    "But pancakes get soggy so quickly once you add syrup to them.",
+    "What about toppings, can you put fruit on both of them?",
+    "My kids like chocolate chips, does that change anything?",
+    "Okay, and how long does it take to make a batch of pancakes?",
+    "Do I need any special equipment, like a waffle iron?",
+    "Can you remind me what you said about the syrup earlier?",
+    "Alright, I think you might have convinced me. Anything else I should know?",
+]
+
+REPLY = (
+    "Pancakes really are the better choice here. They are soft and fluffy, they "
+    "soak up syrup evenly, you can make them in any pan you already own, and they "
+    "are ready in about ten minutes, so the whole family can eat together."
+)
+
+
+def legacy_prompt_tokens(history: list[str], text: str) -> int:
+    """ the previous prompt: system prompt, the whole history in one message, the caller """
+    return (
+        count_tokens(AppConfig.GPT_PROMPT) + MESSAGE_OVERHEAD
+        + count_tokens("Conversation Context: " + "".join(history)) + MESSAGE_OVERHEAD
+        + count_tokens(text) + MESSAGE_OVERHEAD
+    )
+
+
+def sent_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+async def call(server: FakeOpenAI, turns: int) -> tuple[list[int], list[int], int, int]:
+    gpt = OpenAIGPT.create()
+    first_request = len(server.requests)
+    legacy_history: list[str] = []
+
+    bounded, legacy = [], []
+    reused = 0
+    previous: list[dict] = []
+
+    for turn in range(turns):
+        text = SCRIPT[turn % len(SCRIPT)]
+        legacy.append(legacy_prompt_tokens(legacy_history, text))
+
+        await gpt.append(text)
+        start = len(server.requests)
+        with contextlib.redirect_stdout(io.StringIO()):
+            reply = "".join([token async for token in gpt.generate()])
+
+        messages = next(m for m in server.requests[start:] if m[-1]["content"] == text)
+        bounded.append(sent_tokens(messages))
+
+        # prompt caching applies when this prompt starts with the last one
+        if previous and messages[:len(previous)] == previous:
+            reused += 1
+        previous = messages + [{"role": "assistant", "content": reply}]
+
+        legacy_history += [f"User: {text}", f"GPT: {reply}"]
+
+        # the caller listens to the reply for a few seconds, the summary
+        # (if one was started) finishes in that time
+        if gpt._summarising is not None:
+            await gpt._summarising
+
+    summaries = sum(1 for m in server.requests[first_request:] if m[0]["content"] == OpenAIGPT.SUMMARY_PROMPT)
+    return bounded, legacy, reused, summaries
+
+
+async def run(turns: int, calls: int) -> None:
+    server = FakeOpenAI(reply=REPLY, first_token_delay=0, token_delay=0).start()
+    AppConfig.OPENAI_BASE_URL = server.base_url
+
+    try:
+        results = [await call(server, turns) for _ in range(calls)]
+    finally:
+        server.stop()
+
+    bounded = [sum(r[0][i] for r in results) / calls for i in range(turns)]
+    legacy = [sum(r[1][i] for r in results) / calls for i in range(turns)]
+
+    print(f"{turns} turns, {calls} calls, window {AppConfig.GPT_CONTEXT_TOKENS} tokens, "
+          f"{AppConfig.GPT_RECENT_TURNS} recent turns kept verbatim\n")
+    print(f"{'turn':>5} {'legacy':>8} {'bounded':>8}")
+    for i in sorted({0, 4, 9, 19, 29, 39, turns - 1} & set(range(turns))):
+        print(f"{i + 1:>5} {legacy[i]:>8.0f} {bounded[i]:>8.0f}")
+
+    stats = percentiles(bounded)
+    print(f"\ntotal prompt tokens per call: legacy {sum(legacy):,.0f}, bounded {sum(bounded):,.0f} "
+          f"({1 - sum(bounded) / sum(legacy):.0%} fewer)")
+    print(f"bounded prompt size p50={stats['p50']:.0f} max={stats['max']:.0f} tokens")
+    print(f"summaries per call: {sum(r[3] for r in results) / calls:.1f}, "
+          f"prompts extending the previous one (cacheable prefix): "
+          f"{sum(r[2] for r in results) / calls:.0f}/{turns - 1}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--calls", type=int, default=3)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.turns, args.calls))
+
+
+if __name__ == "__main__":
+    main()
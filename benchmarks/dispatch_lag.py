@@ -0,0 +1,223 @@
+"""
+How late speech-to-text events are handled while the bot is replying.
+
+A scripted speech-to-text provider dispatches its events from one task,
+awaiting each callback before the next as the Deepgram SDK does: for every
+caller turn, two interim transcripts, a final one, the end of the utterance
+and, a second later, the caller talking over the reply (a barge-in). The
+replies come from the local OpenAI and ElevenLabs stand-ins (fakes.py).
+
+    inline    the callbacks do the work: the end of an utterance awaits the
+              whole reply, as `process_transcript` used to
+    session   processing/session.py: callbacks only queue events, the reply
+              runs in the call's turn task
+
+For each we report how late events were dispatched against the script, and
+how long barge-ins took to cut the reply off (or how many never did).
+
+    python -m benchmarks.dispatch_lag --calls 1 20 --turns 5
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from const import AppConfig, StreamingConfig
+from processing import providers
+from processing.session import CallSession
+from processing.speechtotext.abstract import SpeechToText
+from processing.telephony import OutboundScheduler
+from processing.texttospeech.framebuffer import FrameBuffer
+
+from .fakes import FakeElevenLabs, FakeOpenAI
+from .probes import format_ms, percentiles
+
+
+class ScriptedSTT(SpeechToText):
+    """ dispatches `script` ((seconds, event, text) in order) from one task """
+
+    def __init__(self, script: list[tuple[float, str, str]]) -> None:
+        self.script = script
+        self.opened = asyncio.Event()
+        self.speech_ended_at: Optional[float] = None
+        self.PAUSE = False
+
+        # how late each event was dispatched, and when each barge-in was due
+        self.lags: list[float] = []
+        self.barge_ins: list[float] = []
+
+    async def open(self):
+        self.opened.set()
+
+    async def pause(self):
+        self.PAUSE = True
+
+    async def resume(self):
+        self.PAUSE = False
+
+    async def close(self):
+        self.opened.clear()
+
+    async def transcribe(self, audio: AsyncGenerator[bytes, None], callback: Callable, finish: Callable,
+                         interrupt: Optional[Callable] = None, interim: Optional[Callable] = None) -> None:
+        await self.open()
+
+        async def drain():
+            async for _ in audio:
+                pass
+
+        drainer = asyncio.create_task(drain())
+        started = time.monotonic()
+        try:
+            for at, event, text in self.script:
+                due = started + at
+                await asyncio.sleep(max(0, due - time.monotonic()))
+                self.lags.append(time.monotonic() - due)
+
+                if event == "interim" and interim:
+                    await interim(text)
+                elif event == "final":
+                    await callback(text)
+                elif event == "end":
+                    self.speech_ended_at = due
+                    await finish()
+                elif event == "speech" and interrupt:
+                    self.barge_ins.append(due)
+                    await interrupt()
+        finally:
+            drainer.cancel()
+
+
+def script(turns: int) -> list[tuple[float, str, str]]:
+    events = []
+    for turn in range(turns):
+        base = turn * 1.6
+        events += [
+            (base, "interim", "are pancakes"),
+            (base + 0.2, "interim", "are pancakes better"),
+            (base + 0.4, "final", "Are pancakes better than waffles?"),
+            (base + 0.5, "end", ""),
+            (base + 1.5, "speech", ""),
+        ]
+    return events
+
+
+async def silence(seconds: float) -> AsyncGenerator[bytes, None]:
+    frame = bytes(StreamingConfig.CHUNK_SIZE)
+    for _ in range(int(seconds / StreamingConfig.BUFFER_DURATION)):
+        await asyncio.sleep(StreamingConfig.BUFFER_DURATION)
+        yield frame
+
+
+async def inline_call(stt: ScriptedSTT, gpt: Any, new_tts: Callable, scheduler: OutboundScheduler,
+                      seconds: float, cleared: list[float]) -> None:
+    async def send(frame: bytes):
+        pass
+
+    outbound = scheduler.register(send)
+    speaking = False
+
+    async def on_final(text: str):
+        await gpt.append(text)
+
+    async def on_end():
+        nonlocal speaking
+        await stt.pause()
+        tts = new_tts()
+        speaking = True
+        try:
+            frames = FrameBuffer()
+            async for chunk in await tts.speak_stream(gpt.generate()):
+                for frame in frames.feed(chunk):
+                    await outbound.put(frame)
+            await outbound.drain()
+        finally:
+            speaking = False
+            await tts.close()
+            await stt.resume()
+
+    async def on_speech():
+        if speaking:
+            outbound.clear()
+            cleared.append(time.monotonic())
+
+    try:
+        await stt.transcribe(audio=silence(seconds), callback=on_final, finish=on_end, interrupt=on_speech)
+    finally:
+        scheduler.unregister(outbound)
+
+
+async def session_call(stt: ScriptedSTT, gpt: Any, new_tts: Callable, scheduler: OutboundScheduler,
+                       seconds: float, cleared: list[float]) -> None:
+    async def send(frame: bytes):
+        pass
+
+    async def clear():
+        cleared.append(time.monotonic())
+
+    async def synthesize(text: str) -> list[bytes]:
+        return []
+
+    session = CallSession(
+        call_id=f"call-{id(stt)}", audio=silence(seconds), stt=stt, gpt=gpt, new_tts=new_tts,
+        scheduler=scheduler, send=send, clear=clear, synthesize=synthesize,
+    )
+    await session.run()
+
+
+async def run(mode: str, calls: int, turns: int) -> None:
+    GPT = providers.load("gpt", "openai")
+    TTS = providers.load("tts", "elevenlabs")
+    scheduler = OutboundScheduler()
+    events = script(turns)
+    seconds = events[-1][0] + 1
+
+    stts = [ScriptedSTT(events) for _ in range(calls)]
+    cleared: list[list[float]] = [[] for _ in range(calls)]
+    call = inline_call if mode == "inline" else session_call
+
+    await asyncio.gather(*(
+        call(stt, GPT.create(), TTS.create, scheduler, seconds, done)
+        for stt, done in zip(stts, cleared)
+    ))
+
+    lags = [lag for stt in stts for lag in stt.lags]
+    cut_off: list[float] = []
+    missed = 0
+    for stt, done in zip(stts, cleared):
+        for due in stt.barge_ins:
+            after = [at for at in done if at >= due]
+            if after:
+                cut_off.append(after[0] - due)
+            else:
+                missed += 1
+
+    print(f"{mode:>8} calls={calls:<4} event dispatch lag: {format_ms(percentiles(lags))}")
+    cut_off_after = format_ms(percentiles(cut_off)) if cut_off else "-"
+    print(f"{'':>8} barge-ins={sum(len(s.barge_ins) for s in stts):<4} missed={missed:<4} cut off after: {cut_off_after}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 20])
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--mode", nargs="+", choices=["inline", "session"], default=["inline", "session"])
+    args = parser.parse_args()
+
+    openai = FakeOpenAI().start()
+    elevenlabs = FakeElevenLabs().start()
+    AppConfig.OPENAI_BASE_URL = openai.base_url
+    AppConfig.ELEVENLABS_URL = elevenlabs.ws_url
+    AppConfig.GREETING = None
+
+    try:
+        for mode in args.mode:
+            for calls in args.calls:
+                asyncio.run(run(mode, calls, args.turns))
+    finally:
+        openai.stop()
+        elevenlabs.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from aiohttp import WSMsgType, web
+
+from const import StreamingConfig
+from processing import codec
+
+
+# ----------------------------------------------------------------------------#
+# Local stand-in servers for the providers. These return canned data with a
+# configurable latency, so the pipeline can be benchmarked without touching
+# the real (metered) APIs.
+# ----------------------------------------------------------------------------#
+
+
+class FakeServer:
+    """ base class, runs an aiohttp app on its own thread and event loop """
+    host: str = "127.0.0.1"
+    port: int = 0
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+
+    def routes(self) -> list[web.RouteDef]:
+        raise NotImplementedError("FakeServer > Routes")
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _serve(self) -> None:
+        app = web.Application()
+        app.add_routes(self.routes())
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+
+        # resolve the ephemeral port we were given
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        self._ready.set()
+
+    def start(self) -> "FakeServer":
+        """ start the server on a background thread, so it never shares a loop with the app """
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._serve())
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None or self._runner is None:
+            return
+
+        fut = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        fut.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class FakeOpenAI(FakeServer):
+    """
+    Streams a canned chat completion as server sent events, or returns it
+    whole when the request does not ask for a stream. The messages of every
+    request are kept in `requests`.
+    """
+
+    def __init__(self, reply: str = "Pancakes are better than waffles, because they are fluffier.",
+                 first_token_delay: float = 0.3, token_delay: float = 0.02) -> None:
+        super().__init__()
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.requests: list[list[dict]] = []
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.post("/v1/chat/completions", self.completions)]
+
+    def _chunk(self, content: Optional[str], finish_reason: Optional[str] = None) -> bytes:
+        data = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "gpt-3.5-turbo",
+            "choices": [{
+                "index": 0,
+                "delta": {"content": content} if content is not None else {},
+                "finish_reason": finish_reason,
+            }],
+        }
+        return f"data: {json.dumps(data)}\n\n".encode()
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests.append(body["messages"])
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.first_token_delay)
+            return web.json_response({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-3.5-turbo",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        await asyncio.sleep(self.first_token_delay)
+        try:
+            for token in self.reply.split(" "):
+                await response.write(self._chunk(token + " "))
+                await asyncio.sleep(self.token_delay)
+
+            await response.write(self._chunk(None, "stop"))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # the reply was cancelled (a barge-in) and the client hung up
+            pass
+        return response
+
+
+class FakeDeepgram(FakeServer):
+    """
+    A live transcription socket. It listens for loud frames the same way the
+    simulated callers produce them, and answers every utterance with a
+    canned final transcript followed by an UtteranceEnd.
+    """
+
+    def __init__(self, transcript: str = "Are pancakes better than waffles?",
+                 latency: float = 0.15, endpointing: float = 0.3, connect_delay: float = 0) -> None:
+        super().__init__()
+        self.transcript = transcript
+        self.latency = latency
+        self.endpointing = endpointing
+        self.connect_delay = connect_delay
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.get("/v1/listen", self.listen)]
+
+    async def _results(self, ws: web.WebSocketResponse, start: float, end: float) -> None:
+        await asyncio.sleep(self.latency)
+        if ws.closed:
+            return
+
+        await ws.send_json({
+            "type": "Results",
+            "channel_index": [0, 1],
+            "duration": end - start,
+            "start": start,
+            "is_final": True,
+            "speech_final": True,
+            "channel": {"alternatives": [{"transcript": self.transcript, "confidence": 0.99, "words": []}]},
+            "metadata": {"request_id": "fake", "model_info": {"name": "fake", "version": "0", "arch": "fake"}, "model_uuid": "fake"},
+        })
+
+        await asyncio.sleep(StreamingConfig.UTTERANCE_END / 1000)
+        if not ws.closed:
+            await ws.send_json({"type": "UtteranceEnd", "channel": [0, 1], "last_word_end": end})
+
+    async def listen(self, request: web.Request) -> web.WebSocketResponse:
+        await asyncio.sleep(self.connect_delay)
+        if request.transport is None or request.transport.is_closing():
+            # the client gave up waiting
+            return web.Response(status=408)
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        bytes_per_second = StreamingConfig.calculate_buffer_size(1)
+        received = 0
+        speech_start: Optional[float] = None
+        silence = 0.0
+        tasks = set()
+
+        async for message in ws:
+            if message.type == WSMsgType.TEXT:
+                if json.loads(message.data).get("type") == "CloseStream":
+                    break
+                continue
+
+            if message.type != WSMsgType.BINARY:
+                continue
+
+            now = received / bytes_per_second
+            received += len(message.data)
+            loud = bool(np.abs(np.frombuffer(message.data, dtype="<i2")).max(initial=0) > 1000)
+
+            if loud and speech_start is None:
+                speech_start = now
+                await ws.send_json({"type": "SpeechStarted", "channel": [0, 1], "timestamp": now})
+
+            if speech_start is not None:
+                silence = 0.0 if loud else silence + len(message.data) / bytes_per_second
+                if silence >= self.endpointing:
+                    task = asyncio.create_task(self._results(ws, speech_start, now - silence))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    speech_start = None
+
+        for task in tasks:
+            task.cancel()
+
+        return ws
+
+
+class FakeElevenLabs(FakeServer):
+    """
+    A text-to-speech input stream. Every chunk of text is answered with
+    `seconds_per_word` of audio per word, after `first_audio_delay` for the
+    first chunk, in the `output_format` asked for (pcm_<rate> or ulaw_8000).
+
+    Faults can be injected: `stall_rate` of the utterances wait another
+    `stall` seconds before their first audio, `fail_rate` of them have the
+    socket closed on them instead, and `drop_rate` of them have it closed
+    after their first audio, cutting them short without an isFinal.
+    """
+
+    def __init__(self, first_audio_delay: float = 0.25, seconds_per_word: float = 0.3,
+                 stall_rate: float = 0, stall: float = 0, fail_rate: float = 0, drop_rate: float = 0,
+                 seed: int = 0) -> None:
+        super().__init__()
+        self.first_audio_delay = first_audio_delay
+        self.seconds_per_word = seconds_per_word
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.get("/v1/text-to-speech/{voice}/stream-input", self.stream_input)]
+
+    def _audio(self, seconds: float, output_format: str = "") -> bytes:
+        encoding, _, rate = output_format.partition("_")
+        rate = int(rate) if rate.isdigit() else StreamingConfig.FREQUENCY
+
+        t = np.arange(int(rate * seconds)) / rate
+        samples = (np.sin(2 * np.pi * 220 * t) * 3000).astype("<i2")
+        return codec.encode(samples, "mulaw" if encoding == "ulaw" else "linear16")
+
+    async def stream_input(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        first = True
+        dropped = False
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+
+            text = json.loads(message.data).get("text", " ")
+            if text == "":
+                await ws.send_json({"audio": None, "isFinal": True})
+                break
+
+            words = len(text.split())
+            if not words:
+                continue
+
+            if first:
+                first = False
+                if self.random.random() < self.fail_rate:
+                    break
+
+                stalled = self.random.random() < self.stall_rate
+                dropped = self.drop_rate > 0 and self.random.random() < self.drop_rate
+                await asyncio.sleep(self.first_audio_delay + (self.stall if stalled else 0))
+
+            audio = self._audio(words * self.seconds_per_word, request.query.get("output_format", ""))
+            audio = base64.b64encode(audio).decode()
+            await ws.send_json({"audio": audio, "isFinal": False})
+
+            if dropped:
+                break
+
+        await ws.close()
+        return ws
@@ -0,0 +1,67 @@
+"""
+Compares re-framing TTS audio with FrameBuffer against the previous
+`bytes +=` / re-slice implementation of TextToSpeech._speak_return.
+
+    python -m benchmarks.frame_buffer --seconds 60 --chunk 4096
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Iterable, Iterator
+
+from const import StreamingConfig
+from processing.texttospeech.framebuffer import FrameBuffer
+
+
+def legacy(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """ the previous implementation, minus the header skip """
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) > StreamingConfig.CHUNK_SIZE:
+            yield buffer[:StreamingConfig.CHUNK_SIZE]
+            buffer = buffer[StreamingConfig.CHUNK_SIZE:]
+
+
+def framebuffer(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    frames = FrameBuffer(StreamingConfig.CHUNK_SIZE)
+    for chunk in chunks:
+        yield from frames.feed(chunk)
+
+    if tail := frames.flush():
+        yield tail
+
+
+def measure(name: str, fn: Callable[[Iterable[bytes]], Iterator[bytes]], chunks: list[bytes]) -> None:
+    total = sum(len(c) for c in chunks)
+
+    started = time.perf_counter()
+    frames = sum(1 for _ in fn(chunks))
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for _ in fn(chunks):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:>12}: frames={frames:<7} {total / elapsed / 1e6:8.1f} MB/s  peak alloc={peak / 1024:8.1f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=60, help="length of the utterance")
+    parser.add_argument("--chunk", type=int, default=4096, help="size of the chunks the provider sends")
+    args = parser.parse_args()
+
+    size = StreamingConfig.calculate_buffer_size(args.seconds)
+    audio = bytes(i % 256 for i in range(size))
+    chunks = [audio[i:i + args.chunk] for i in range(0, size, args.chunk)]
+
+    print(f"{args.seconds}s of audio in {len(chunks)} chunks of {args.chunk} bytes")
+    measure("legacy", legacy, chunks)
+    measure("framebuffer", framebuffer, chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Time to first audio (and to an open speech-to-text socket) with and without
+a fallback provider, against local stand-in servers with injected faults.
+
+The primary ElevenLabs stand-in stalls for --stall seconds on --stall-rate of
+utterances and drops --fail-rate of them; the secondary is slower, but
+steady. With --down, the primary drops everything, which should trip its
+circuit breaker after AppConfig.BREAKER_FAILURES turns.
+
+    python -m benchmarks.hedging --turns 100 --concurrency 5
+"""
+import argparse
+import asyncio
+import time
+from typing import AsyncGenerator, Optional
+
+from const import AppConfig
+from processing import hedging
+from processing.speechtotext import HedgedSTT
+from processing.speechtotext.deepgram import DeepgramSTT
+from processing.texttospeech import HedgedTTS
+from processing.texttospeech.elevenlabs import ElevenLabsTTS
+
+from .fakes import FakeDeepgram, FakeElevenLabs
+from .probes import format_ms, percentiles
+
+REPLY = "Pancakes are better than waffles, because they are fluffier."
+
+
+async def reply(first_token_delay: float = 0.3, token_delay: float = 0.02) -> AsyncGenerator[str, None]:
+    """ a streamed LLM reply """
+    await asyncio.sleep(first_token_delay)
+    for word in REPLY.split(" "):
+        yield word + " "
+        await asyncio.sleep(token_delay)
+
+
+def provider(base, url: str):
+    """ a subclass of `base` pointed at its own stand-in server """
+    return type(f"{base.__name__}@{url}", (base,), {"URL": url, "_shared_client": None, "pool": None})
+
+
+async def speak(tts) -> Optional[float]:
+    """ seconds from the first token to the first audio, None if it failed """
+    first_token: Optional[float] = None
+
+    async def timed():
+        nonlocal first_token
+        async for token in reply():
+            first_token = first_token or time.monotonic()
+            yield token
+
+    try:
+        async for _ in await tts.speak_stream(timed()):
+            assert first_token is not None
+            return time.monotonic() - first_token
+        return None
+    except Exception:
+        return None
+    finally:
+        await tts.close()
+
+
+async def run_tts(name: str, make, turns: int, concurrency: int) -> None:
+    hedging._health.clear()
+    latencies: list[float] = []
+    failed = 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal failed
+        async with limit:
+            latency = await speak(make())
+            if latency is None:
+                failed += 1
+            else:
+                latencies.append(latency)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one() for _ in range(turns)))
+    elapsed = time.monotonic() - started
+
+    print(f"tts {name:<16} turns={turns:<4} failed={failed:<3} wall={elapsed:6.1f}s  first audio: {format_ms(percentiles(latencies))}")
+
+
+async def run_stt(name: str, make, calls: int) -> None:
+    hedging._health.clear()
+    opened: list[float] = []
+    failed = 0
+
+    for _ in range(calls):
+        stt = make()
+        started = time.monotonic()
+        try:
+            await stt.open()
+            opened.append(time.monotonic() - started)
+        except Exception:
+            failed += 1
+        finally:
+            await stt.close()
+
+    print(f"stt {name:<16} calls={calls:<4} failed={failed:<3} open: {format_ms(percentiles(opened))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--stall-rate", type=float, default=0.1)
+    parser.add_argument("--stall", type=float, default=3.0)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--down", action="store_true", help="the primary drops every utterance")
+    parser.add_argument("--budget", type=float, default=AppConfig.HEDGE_TTS_BUDGET)
+    parser.add_argument("--stt-calls", type=int, default=10)
+    parser.add_argument("--stt-connect-delay", type=float, default=3.0, help="the primary deepgram's connect time")
+    args = parser.parse_args()
+
+    AppConfig.HEDGE_TTS_BUDGET = args.budget
+
+    primary = FakeElevenLabs(
+        first_audio_delay=0.25, stall_rate=args.stall_rate, stall=args.stall,
+        fail_rate=1 if args.down else args.fail_rate, seed=1,
+    ).start()
+    secondary = FakeElevenLabs(first_audio_delay=0.4, seed=2).start()
+
+    slow_deepgram = FakeDeepgram(connect_delay=args.stt_connect_delay).start()
+    deepgram = FakeDeepgram().start()
+
+    try:
+        Primary = provider(ElevenLabsTTS, primary.ws_url)
+        Secondary = provider(ElevenLabsTTS, secondary.ws_url)
+
+        def hedged():
+            return HedgedTTS(Primary.create(), Secondary.create(), "primary", "secondary")
+
+        asyncio.run(run_tts("primary only", Primary.create, args.turns, args.concurrency))
+        asyncio.run(run_tts("hedged", hedged, args.turns, args.concurrency))
+
+        SlowSTT = provider(DeepgramSTT, slow_deepgram.url)
+        FastSTT = provider(DeepgramSTT, deepgram.url)
+
+        def hedged_stt():
+            return HedgedSTT(SlowSTT.create(), FastSTT.create(), "slow", "fast")
+
+        if args.stt_calls:
+            asyncio.run(run_stt("primary only", SlowSTT.create, args.stt_calls))
+            asyncio.run(run_stt("hedged", hedged_stt, args.stt_calls))
+
+    finally:
+        for server in (primary, secondary, slow_deepgram, deepgram):
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+How long `import api` takes, from `python -X importtime` in a fresh
+interpreter, with the slowest modules. Importing the app should not pull in
+any provider SDK (they load when the app starts serving, see
+processing/providers.py), nor do any network or .env work beyond one parse.
+
+Exits non-zero if the import takes longer than --budget-ms (the best of
+--runs), or if any --forbid module was imported, so it can be run as a
+regression check:
+
+    python -m benchmarks.importtime --runs 5 --budget-ms 1500
+"""
+import argparse
+import re
+import subprocess
+import sys
+from typing import Optional
+
+# the provider sdks (and what used to come with them)
+FORBID = ["vonage", "deepgram", "elevenlabs", "pyht", "ngrok", "curses"]
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime(module: str) -> dict[str, tuple[int, int, int]]:
+    """ module -> (self µs, cumulative µs, depth), for one import in a new interpreter """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if match := LINE.match(line):
+            own, cumulative, indent, name = match.groups()
+            modules[name] = (int(own), int(cumulative), len(indent) // 2)
+    return modules
+
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--forbid", nargs="*", default=FORBID)
+    args = parser.parse_args()
+
+    runs = [importtime(args.module) for _ in range(args.runs)]
+    totals = [run[args.module][1] / 1000 for run in runs]
+    best = min(range(args.runs), key=lambda i: totals[i])
+
+    print(f"import {args.module}: best {min(totals):.1f}ms, worst {max(totals):.1f}ms over {args.runs} runs\n")
+
+    # the slowest packages imported directly by the app, from the best run
+    top = sorted(
+        ((name, cumulative) for name, (_, cumulative, depth) in runs[best].items() if depth == 1),
+        key=lambda item: -item[1],
+    )
+    for name, cumulative in top[:args.top]:
+        print(f"{cumulative / 1000:>9.1f}ms  {name}")
+
+    failed = False
+    imported = [name for name in args.forbid if name in runs[best]]
+    if imported:
+        print(f"\nFAIL: imported {', '.join(imported)}")
+        failed = True
+
+    if args.budget_ms is not None and min(totals) > args.budget_ms:
+        print(f"\nFAIL: {min(totals):.1f}ms is over the {args.budget_ms:.0f}ms budget")
+        failed = True
+
+    return 1 if failed else None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
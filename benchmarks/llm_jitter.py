@@ -0,0 +1,78 @@
+"""
+Measures how much N simultaneous LLM generations disturb a 20ms frame sender
+running on the same event loop.
+
+    python -m benchmarks.llm_jitter --calls 1 10 50 --mode sync async
+"""
+import argparse
+import asyncio
+import time
+
+import openai
+
+from const import AppConfig
+from processing.generate_response import OpenAIGPT
+
+from .fakes import FakeOpenAI
+from .probes import LoopLagProbe, format_ms
+
+
+async def legacy_generate(client: openai.Client, text: str):
+    """ the previous implementation: a sync stream iterated inside an async generator """
+    response = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": text}],
+        stream=True
+    )
+    for chunk in response:
+        if chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def run(mode: str, calls: int) -> None:
+    # creating the client loads certificates, do it before measuring
+    OpenAIGPT.get_client()
+
+    probe = LoopLagProbe().start()
+    await asyncio.sleep(0)
+    started = time.monotonic()
+
+    async def one_call():
+        if mode == "sync":
+            client = openai.Client(api_key="fake", base_url=AppConfig.OPENAI_BASE_URL)
+            stream = legacy_generate(client, "hello")
+        else:
+            stream = OpenAIGPT.create().generate("hello")
+
+        async for _ in stream:
+            pass
+
+    await asyncio.gather(*(one_call() for _ in range(calls)))
+
+    elapsed = time.monotonic() - started
+    stats = await probe.stop()
+    print(f"{mode:>5} calls={calls:<4} wall={elapsed:6.2f}s  frame lateness: {format_ms(stats)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--mode", nargs="+", choices=["sync", "async"], default=["sync", "async"])
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = FakeOpenAI(token_delay=args.token_delay).start()
+    AppConfig.OPENAI_BASE_URL = server.base_url
+
+    try:
+        for mode in args.mode:
+            for calls in args.calls:
+                asyncio.run(run(mode, calls))
+                # the shared client is bound to the loop it was created on
+                OpenAIGPT._shared_client = None
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Load test: how many concurrent calls can api.py carry, with one process
+or several workers (--workers)?
+
+The app runs in a subprocess, pointed at local stand-in servers for
+Deepgram, ElevenLabs and OpenAI (see fakes.py). Simulated Vonage callers
+are answered through /answer (like Vonage, so the call is warmed up), then
+connect to /ws and stream 16kHz linear16 frames in real time: they speak
+for a while, wait for the bot to answer, and repeat. For each concurrency
+level we report turn latency (end of caller speech to first bot frame),
+outbound frame jitter, and the app's CPU and RSS per call.
+
+    python -m benchmarks.loadtest --calls 1 10 50 100 200 --turns 3
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import aiohttp
+import numpy as np
+
+from const import AppConfig, StreamingConfig
+
+from .fakes import FakeDeepgram, FakeElevenLabs, FakeOpenAI
+from .probes import percentiles, format_ms
+
+
+# ----------------------------------------------------------------------------#
+# The app under test
+# ----------------------------------------------------------------------------#
+
+
+def serve(port: int, workers: int, openai_url: str, deepgram_url: str, elevenlabs_url: str) -> None:
+    """ run api.py against the fakes, this is the subprocess entrypoint """
+    AppConfig.ENV = "benchmark"
+    AppConfig.PORT = port
+    AppConfig.WORKERS = workers
+    AppConfig.OPENAI_BASE_URL = openai_url
+    AppConfig.DEEPGRAM_URL = deepgram_url
+    AppConfig.ELEVENLABS_URL = elevenlabs_url
+
+    import api
+    api.serve(host="127.0.0.1", log_level="warning")
+
+
+class ProcessStats:
+    """ cpu and memory of a process and its children (the workers), read from /proc """
+    TICKS = os.sysconf("SC_CLK_TCK")
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+
+    def pids(self) -> list[int]:
+        pids, i = [self.pid], 0
+        while i < len(pids):
+            try:
+                with open(f"/proc/{pids[i]}/task/{pids[i]}/children") as f:
+                    pids += [int(pid) for pid in f.read().split()]
+            except FileNotFoundError:
+                pass
+            i += 1
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except FileNotFoundError:
+                continue
+            # utime and stime are fields 14 and 15, counted from the pid
+            total += int(fields[11]) + int(fields[12])
+        return total / self.TICKS
+
+    def rss_mb(self) -> float:
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            except (FileNotFoundError, StopIteration):
+                continue
+        return total / 1024
+
+
+# ----------------------------------------------------------------------------#
+# Simulated callers
+# ----------------------------------------------------------------------------#
+
+
+def caller_audio(seconds: float) -> list[bytes]:
+    """ a loud tone, cut into frames, stands in for the caller speaking """
+    samples = int(StreamingConfig.FREQUENCY * seconds)
+    t = np.arange(samples) / StreamingConfig.FREQUENCY
+    audio = (np.sin(2 * np.pi * 180 * t) * 8000).astype("<i2").tobytes()
+
+    size = StreamingConfig.CHUNK_SIZE
+    return [audio[i:i + size] for i in range(0, len(audio) - size + 1, size)]
+
+
+SILENCE = bytes(StreamingConfig.CHUNK_SIZE)
+
+
+class Caller:
+    def __init__(self, url: str, turns: int, speech: list[bytes], bot_silence: float = 0.6,
+                 answer_delay: float = 0.3) -> None:
+        self.url = url
+        self.turns = turns
+        self.answer_delay = answer_delay
+        self.speech = speech
+        self.bot_silence = bot_silence
+
+        self.latencies: list[float] = []
+        self.jitter: list[float] = []
+        self.failed = False
+
+        self._speech_end = 0.0
+        self._last_frame = 0.0
+        self._turn_started = False
+
+    async def _receive(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.BINARY:
+                continue
+
+            now = time.monotonic()
+            if not self._turn_started:
+                self._turn_started = True
+                self.latencies.append(now - self._speech_end)
+            else:
+                self.jitter.append(abs(now - self._last_frame - StreamingConfig.BUFFER_DURATION))
+
+            self._last_frame = now
+
+    async def run(self, session: aiohttp.ClientSession) -> None:
+        interval = StreamingConfig.BUFFER_DURATION
+
+        try:
+            # vonage asks for the NCCO first, then connects to the websocket it names
+            base = self.url.rsplit("/", 1)[0].replace("ws://", "http://")
+            async with session.post(f"{base}/answer", json={"uuid": uuid.uuid4().hex}) as response:
+                ncco = await response.json()
+
+            query = urlsplit(ncco[0]["endpoint"][0]["uri"]).query
+            await asyncio.sleep(self.answer_delay)
+
+            async with session.ws_connect(f"{self.url}?{query}" if query else self.url) as ws:
+                await ws.send_json({"event": "websocket:connected", "content-type": "audio/l16;rate=16000"})
+                receiver = asyncio.create_task(self._receive(ws))
+                deadline = time.monotonic()
+
+                async def send(frame: bytes):
+                    nonlocal deadline
+                    await ws.send_bytes(frame)
+                    deadline += interval
+                    await asyncio.sleep(max(0, deadline - time.monotonic()))
+
+                for _ in range(self.turns):
+                    for frame in self.speech:
+                        await send(frame)
+
+                    self._speech_end = time.monotonic()
+                    self._turn_started = False
+
+                    # keep the line open (silence) until the bot has answered and gone quiet
+                    while not self._turn_started or time.monotonic() - self._last_frame < self.bot_silence:
+                        await send(SILENCE)
+                        if time.monotonic() - self._speech_end > 30:
+                            raise TimeoutError("no answer from the bot")
+
+                receiver.cancel()
+
+        except Exception as e:
+            print(f"caller failed: {e!r}", file=sys.stderr)
+            self.failed = True
+
+
+async def ramp(url: str, calls: int, turns: int, speech: list[bytes], stats: ProcessStats) -> None:
+    callers = [Caller(url, turns, speech) for _ in range(calls)]
+
+    rss_before = stats.rss_mb()
+    cpu_before = stats.cpu_seconds()
+    started = time.monotonic()
+
+    async with aiohttp.ClientSession() as session:
+        # spread the connects over one frame, like independent callers would
+        async def start(caller: Caller, delay: float):
+            await asyncio.sleep(delay)
+            await caller.run(session)
+
+        await asyncio.gather(*(
+            start(c, i * StreamingConfig.BUFFER_DURATION / calls) for i, c in enumerate(callers)
+        ))
+
+    elapsed = time.monotonic() - started
+    cpu = (stats.cpu_seconds() - cpu_before) / elapsed
+    rss = stats.rss_mb()
+
+    latencies = [x for c in callers for x in c.latencies]
+    jitter = [x for c in callers for x in c.jitter]
+    failed = sum(c.failed for c in callers)
+
+    print(f"\n== {calls} concurrent calls, {len(latencies)} turns, {failed} failed")
+    print(f"turn latency  {format_ms(percentiles(latencies))}")
+    print(f"frame jitter  {format_ms(percentiles(jitter))}")
+    print(f"cpu {cpu:6.1%} ({cpu / calls:6.2%} per call)   "
+          f"rss {rss:7.1f}MB ({(rss - rss_before) / calls:5.2f}MB per call)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--speech", type=float, default=1.5, help="seconds the caller speaks per turn")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--workers", type=int, default=1, help="app worker processes")
+    parser.add_argument("--stt-latency", type=float, default=0.15)
+    parser.add_argument("--llm-first-token", type=float, default=0.3)
+    parser.add_argument("--tts-first-audio", type=float, default=0.25)
+    parser.add_argument("--serve", nargs=3, metavar=("OPENAI", "DEEPGRAM", "ELEVENLABS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.workers, *args.serve)
+        return
+
+    openai = FakeOpenAI(first_token_delay=args.llm_first_token).start()
+    deepgram = FakeDeepgram(latency=args.stt_latency).start()
+    elevenlabs = FakeElevenLabs(first_audio_delay=args.tts_first_audio).start()
+
+    app = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.loadtest", "--port", str(args.port), "--workers", str(args.workers),
+        "--serve", openai.base_url, deepgram.url, elevenlabs.ws_url,
+    ])
+
+    try:
+        url = f"ws://127.0.0.1:{args.port}/ws"
+        asyncio.run(wait_for_app(url))
+
+        stats = ProcessStats(app.pid)
+        speech = caller_audio(args.speech)
+        for calls in args.calls:
+            asyncio.run(ramp(url, calls, args.turns, speech, stats))
+
+    finally:
+        app.terminate()
+        app.wait()
+        for server in (openai, deepgram, elevenlabs):
+            server.stop()
+
+
+async def wait_for_app(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.ws_connect(url):
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Measures how much logging disturbs a 20ms frame sender on the same event
+loop. N simulated calls each log a record per LLM token (--rate records a
+second), written out to a sink that takes --write-delay per write, as
+stdout does when the terminal or the pipe behind it is slow to read.
+
+    off     logging disabled
+    sync    a StreamHandler on the event loop (the previous log_conf.yaml)
+    queue   processing/logs.py: a bounded queue and a writer thread
+
+    python -m benchmarks.log_lag --calls 10 50 --mode off sync queue
+"""
+import argparse
+import asyncio
+import io
+import logging
+import time
+
+from processing import logs
+
+from .probes import LoopLagProbe, format_ms
+
+
+class SlowSink(io.StringIO):
+    """ a stream whose every write blocks for `delay` seconds """
+
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+        return len(text)
+
+
+def handler(mode: str, sink: SlowSink, capacity: int) -> tuple[logging.Handler, logs.LogPipeline | None]:
+    if mode == "queue":
+        pipeline = logs.LogPipeline(stream=sink, capacity=capacity)  # type: ignore[arg-type]
+        return pipeline.handler, pipeline
+
+    output = logging.StreamHandler(sink)
+    output.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    return output, None
+
+
+async def run(mode: str, calls: int, seconds: float, rate: float, sink: SlowSink, capacity: int) -> None:
+    logger = logging.getLogger("benchmarks.log_lag")
+    logger.propagate = False
+    logger.handlers.clear()
+    logger.setLevel(logging.INFO if mode != "off" else logging.CRITICAL)
+
+    pipeline = None
+    if mode != "off":
+        output, pipeline = handler(mode, sink, capacity)
+        logger.addHandler(output)
+
+    probe = LoopLagProbe().start()
+    await asyncio.sleep(0)
+
+    async def one_call(index: int):
+        logs.call_id.set(f"call-{index}")
+        deadline = time.monotonic() + seconds
+        token = 0
+        while time.monotonic() < deadline:
+            token += 1
+            logger.info("token", extra={"token": token})
+            await asyncio.sleep(1 / rate)
+
+    await asyncio.gather(*(one_call(i) for i in range(calls)))
+    stats = await probe.stop()
+
+    dropped = 0
+    if pipeline is not None:
+        dropped = pipeline.handler.dropped
+        pipeline.stop()
+
+    print(f"{mode:>5} calls={calls:<4} written={sink.lines:<6} dropped={dropped:<6} frame lateness: {format_ms(stats)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--mode", nargs="+", choices=["off", "sync", "queue"], default=["off", "sync", "queue"])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--rate", type=float, default=50, help="records per second, per call")
+    parser.add_argument("--write-delay", type=float, default=0.0002, help="seconds each write to the sink blocks")
+    parser.add_argument("--capacity", type=int, default=10000, help="log queue size")
+    args = parser.parse_args()
+
+    for mode in args.mode:
+        for calls in args.calls:
+            sink = SlowSink(args.write_delay)
+            asyncio.run(run(mode, calls, args.seconds, args.rate, sink, args.capacity))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from typing import Iterable
+
+from const import StreamingConfig
+
+
+def percentiles(values: Iterable[float], points: Iterable[int] = (50, 95, 99)) -> dict[str, float]:
+    """ nearest-rank percentiles, plus the max """
+    ordered = sorted(values)
+    if not ordered:
+        return {**{f"p{p}": 0.0 for p in points}, "max": 0.0}
+
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        result[f"p{p}"] = ordered[index]
+
+    result["max"] = ordered[-1]
+    return result
+
+
+def format_ms(stats: dict[str, float]) -> str:
+    return "  ".join(f"{k}={v * 1000:7.2f}ms" for k, v in stats.items())
+
+
+class LoopLagProbe:
+    """
+    Emulates a 20ms audio frame sender. Every tick it records how late it
+    woke up, which is exactly the jitter a caller would hear on the line.
+    """
+
+    def __init__(self, interval: float = StreamingConfig.BUFFER_DURATION) -> None:
+        self.interval = interval
+        self.lateness: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            self.lateness.append(max(0.0, time.monotonic() - deadline))
+
+    def start(self) -> "LoopLagProbe":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> dict[str, float]:
+        # let one more tick through, so a stall right at the end is recorded
+        await asyncio.sleep(self.interval * 2)
+
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        return percentiles(self.lateness)
@@ -0,0 +1,169 @@
+"""
+Replays recorded calls (see processing/recorder.py) through the speech to
+text, model and text to speech providers selected in AppConfig, to
+reproduce a bad call or to check a change against calls already made.
+
+The caller's recorded audio is streamed in at --speed times real time, and
+the providers run as they do in a call: each turn pauses the transcription
+while the reply is generated and "played" (for its length, at --speed),
+then resumes it. Per turn we report when it ended on the caller's audio,
+and the time from its end to the first audio of the reply, next to what
+was recorded, and whether the caller was heard saying the same thing.
+
+Faster than real time, the caller's audio stops while each reply is on its
+way (the providers still take their time), so nobody talks over the bot:
+barge-ins are only reproduced at --speed 1, and turns end later on the
+caller's audio by the provider's endpointing delay times --speed.
+
+With --fakes, the providers are the local stand-in servers (fakes.py)
+instead of the real ones, which never need a key or cost anything.
+
+    python -m benchmarks.replay .cache/calls/* --speed 4 --fakes
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from const import AppConfig, StreamingConfig
+from processing import providers
+from processing.recorder import Recording
+
+from .fakes import FakeDeepgram, FakeElevenLabs, FakeOpenAI
+from .probes import format_ms, percentiles
+
+
+def normalize(text: str) -> str:
+    return " ".join("".join(c for c in text.lower() if c.isalnum() or c.isspace()).split())
+
+
+async def replay(recording: Recording, speed: float) -> dict[str, Any]:
+    stt = providers.load("stt", AppConfig.STT).create()
+    gpt = providers.load("gpt", AppConfig.GPT).create()
+    TTS = providers.load("tts", AppConfig.TTS)
+
+    bytes_per_second = StreamingConfig.calculate_buffer_size(1)
+    sent = 0
+    started = time.monotonic()
+    heard: list[str] = []
+    turns: list[dict[str, Any]] = []
+    running: Optional[asyncio.Task] = None
+
+    async def audio():
+        nonlocal sent, started
+        for frame in recording.inbound():
+            if speed > 1 and running is not None and not running.done():
+                # the providers still answer in real time: wait for the
+                # reply, or the caller talks over it and is not heard
+                paused = time.monotonic()
+                await asyncio.gather(running, return_exceptions=True)
+                started += time.monotonic() - paused
+
+            # the frame is due when the caller said it, at `speed`
+            delay = started + sent / bytes_per_second / speed - time.monotonic()
+            await asyncio.sleep(max(0, delay))
+            sent += len(frame)
+            yield frame
+
+        # let the last turn finish before hanging up
+        if running is not None:
+            await asyncio.gather(running, return_exceptions=True)
+
+    async def on_word(text: str):
+        heard.append(text)
+        await gpt.append(text)
+
+    async def turn(result: dict[str, Any]):
+        tts = TTS.create()
+        played = 0
+        try:
+            reply = await tts.speak_stream(gpt.generate())
+            async for chunk in reply:
+                result.setdefault("latency", time.monotonic() - result["ended"])
+                played += len(chunk)
+
+            # the caller listens to all of it before talking again
+            heard_at = result["ended"] + result.get("latency", 0) + played / bytes_per_second / speed
+            await asyncio.sleep(max(0, heard_at - time.monotonic()))
+
+        except Exception as e:
+            result["error"] = repr(e)
+
+        finally:
+            await tts.close()
+            await stt.resume()
+
+    async def on_end():
+        nonlocal running
+        await stt.pause()
+        result = {"turn": len(turns) + 1, "audio": sent / bytes_per_second, "ended": time.monotonic()}
+        turns.append(result)
+        running = asyncio.create_task(turn(result))
+
+    try:
+        await stt.transcribe(audio=audio(), callback=on_word, finish=on_end)
+    finally:
+        await stt.close()
+
+    return {"turns": turns, "heard": heard}
+
+
+def report(path: Path, recording: Recording, replayed: dict[str, Any]) -> list[float]:
+    """ print a recording against its replay, returning the replay's turn latencies """
+    recorded = recording.turns
+    turns = replayed["turns"]
+    print(f"\n== {path.name}: {len(recorded)} turns recorded, {len(turns)} replayed")
+
+    for index in range(max(len(recorded), len(turns))):
+        before = recorded[index] if index < len(recorded) else {}
+        after = turns[index] if index < len(turns) else {}
+
+        was = f"{before['audio']:6.2f}s" if before else "      -"
+        now = f"{after['audio']:6.2f}s" if after else "      -"
+        was_latency = f"{(before['first_frame'] - before['start']) * 1000:6.0f}ms" if "first_frame" in before else "      -"
+        now_latency = f"{after['latency'] * 1000:6.0f}ms" if "latency" in after else after.get("error", "      -")
+        print(f"turn {index + 1:<3} ended at {was} -> {now}   first audio {was_latency} -> {now_latency}")
+
+    said = [normalize(text) for text in recording.said()]
+    heard = [normalize(text) for text in replayed["heard"]]
+    same = sum(1 for a, b in zip(said, heard) if a == b)
+    print(f"transcripts: {same} of {len(said)} recorded the same, {len(heard)} heard")
+
+    return [turn["latency"] for turn in turns if "latency" in turn]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", type=Path, help="call directories, under AppConfig.RECORD_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="times real time")
+    parser.add_argument("--fakes", action="store_true", help="use the local stand-in providers")
+    args = parser.parse_args()
+
+    servers = []
+    if args.fakes:
+        servers = [FakeOpenAI().start(), FakeDeepgram().start(), FakeElevenLabs().start()]
+        AppConfig.STT, AppConfig.GPT, AppConfig.TTS = "deepgram", "openai", "elevenlabs"
+        AppConfig.OPENAI_BASE_URL = servers[0].base_url
+        AppConfig.DEEPGRAM_URL = servers[1].url
+        AppConfig.ELEVENLABS_URL = servers[2].ws_url
+
+    # one event loop for every call, the provider clients are shared
+    async def run() -> list[float]:
+        latencies: list[float] = []
+        for path in args.recordings:
+            recording = Recording(str(path))
+            latencies += report(path, recording, await replay(recording, args.speed))
+        return latencies
+
+    try:
+        latencies = asyncio.run(run())
+    finally:
+        for server in servers:
+            server.stop()
+
+    print(f"\nfirst audio after the end of a turn: {format_ms(percentiles(latencies))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+The response cache (processing/generate_response/cache.py): how well it
+matches callers' questions, what a lookup costs, and the time to the first
+token of a reply it answers against one the model has to generate.
+
+Matching: a handful of questions is cached as first asked, then looked up
+again as a transcript might come back (misheard, rephrased, with filler),
+alongside questions that look alike but should not get the same answer.
+For each threshold we report the hits, wrong answers and misses, and the
+false hit rate: how many of the different questions got a cached answer.
+
+    python -m benchmarks.response_cache --thresholds 0.7 0.8 0.9 --entries 1000 10000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from const import AppConfig
+from processing import providers
+from processing.generate_response import ResponseCache
+
+from .fakes import FakeOpenAI
+from .probes import format_ms, percentiles
+
+
+# (question as cached, [the same question as it might come back], [different questions])
+QUESTIONS = [
+    ("What are your opening hours?",
+     ["what are your opening hours", "What r your opening hours?", "um what are your opening hours",
+      "what are you're opening hours", "what are the opening hours"],
+     ["what are your closing hours", "what time do you close", "what are your opening hours on sunday"]),
+    ("Are pancakes better than waffles?",
+     ["are pancakes better then waffles", "so are pancakes better than waffles",
+      "are pancake better than waffles"],
+     ["are waffles better than pancakes", "are pancakes worse than waffles"]),
+    ("Where are you located?",
+     ["where are you located", "where are you guys located", "where are you locate it"],
+     ["where are you going", "how are you"]),
+    ("How much does a stack of pancakes cost?",
+     ["how much does a stack of pancakes cost", "how much is a stack of pancakes cost",
+      "how much does a stack of pan cakes cost"],
+     ["how much does a waffle cost", "how many pancakes are in a stack"]),
+    ("Do you have gluten free pancakes?",
+     ["do you have gluten free pancakes", "do you have gluten-free pancakes", "do you guys have gluten free pancakes"],
+     ["do you have dairy free pancakes", "do you have gluten free waffles"]),
+    ("Can I book a table for tonight?",
+     ["can i book a table for tonight", "could i book a table for tonight", "can i book a table tonight"],
+     ["can i book a table for tomorrow", "can i cancel a table for tonight", "can i book a table for twelve tonight"]),
+]
+
+
+def matching(threshold: float) -> None:
+    cache = ResponseCache(max_entries=1000, ttl=3600, threshold=threshold, min_words=3)
+    for question, _, _ in QUESTIONS:
+        cache.put(question, question)
+
+    hits = wrong = misses = false_hits = 0
+    for question, same, different in QUESTIONS:
+        for text in same:
+            answer = cache.get(text)
+            if answer == question:
+                hits += 1
+            elif answer is None:
+                misses += 1
+            else:
+                wrong += 1
+
+        false_hits += sum(cache.get(text) is not None for text in different)
+
+    same_total = sum(len(same) for _, same, _ in QUESTIONS)
+    different_total = sum(len(different) for _, _, different in QUESTIONS)
+    print(f"threshold {threshold:.2f}  rephrased: {hits:>2}/{same_total} hit ({hits / same_total:4.0%}), "
+          f"{wrong} wrong, {misses:>2} missed   "
+          f"different: {false_hits:>2}/{different_total} answered anyway (false hits {false_hits / different_total:4.0%})")
+
+
+def lookups(entries: int, count: int = 2000) -> None:
+    rng = random.Random(0)
+
+    # made up words, a few thousand of them, like the vocabulary of real questions
+    words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(3000)]
+
+    cache = ResponseCache(max_entries=entries, ttl=3600, threshold=0.8, min_words=3)
+    for _ in range(entries):
+        cache.put(" ".join(rng.choices(words, k=rng.randint(4, 10))), "answer")
+
+    times = []
+    for _ in range(count):
+        text = " ".join(rng.choices(words, k=rng.randint(4, 10)))
+        started = time.perf_counter()
+        cache.get(text)
+        times.append(time.perf_counter() - started)
+
+    print(f"{entries:>6} entries  lookup {format_ms(percentiles(times))}")
+
+
+async def first_token(turns: int) -> None:
+    GPT = providers.load("gpt", "openai")
+    cache = ResponseCache(max_entries=1000, ttl=3600, threshold=0.8, min_words=3)
+
+    async def ask(use_cache: bool) -> float:
+        gpt = GPT.create()
+        gpt.cache = cache if use_cache else None
+        await gpt.append("What are your opening hours?")
+
+        started = time.monotonic()
+        latency = 0.0
+        async for _ in gpt.generate():
+            latency = latency or time.monotonic() - started
+        return latency
+
+    # the first asks the model, and caches its answer for the rest
+    await ask(True)
+    model = [await ask(False) for _ in range(turns)]
+    cached = [await ask(True) for _ in range(turns)]
+
+    print(f"first token  model {format_ms(percentiles(model))}")
+    print(f"             cache {format_ms(percentiles(cached))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7, 0.75, 0.8, 0.85, 0.9])
+    parser.add_argument("--entries", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    print("== matching")
+    for threshold in args.thresholds:
+        matching(threshold)
+
+    print("\n== lookup cost")
+    for entries in args.entries:
+        lookups(entries)
+
+    print("\n== time to first token")
+    openai = FakeOpenAI().start()
+    AppConfig.OPENAI_BASE_URL = openai.base_url
+    try:
+        asyncio.run(first_token(args.turns))
+    finally:
+        openai.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+What per-turn latency tracing (processing/tracing.py) costs the hot path.
+
+Calls run through processing/session.py against the local OpenAI and
+ElevenLabs stand-ins (fakes.py), with the scripted speech-to-text of
+dispatch_lag.py: the caller asks a question, and barges in a second after
+the end of it. One run counts how often a turn hits the tracing hooks
+(spans marked per token, per audio chunk, per frame sent). The turn's CPU
+on the event loop thread (the stand-ins run on threads of their own) is
+then measured with every turn traced and with none, and the tracing hooks
+of such a turn are timed on their own, traced against not:
+
+    overhead = (hooks traced - hooks untraced) / event loop CPU of a turn
+
+The A/B difference in CPU is reported too, but an overhead that small is
+lost in the noise between runs.
+
+    python -m benchmarks.tracing --calls 20 --turns 5
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from const import AppConfig
+from processing import providers, tracing
+from processing.metrics import Metrics
+from processing.telephony import OutboundScheduler
+
+from .dispatch_lag import ScriptedSTT, script, session_call
+from .fakes import FakeElevenLabs, FakeOpenAI
+
+
+async def run(calls: int, turns: int) -> float:
+    """ event loop thread CPU seconds, for `calls` calls of `turns` turns """
+    GPT = providers.load("gpt", "openai")
+    TTS = providers.load("tts", "elevenlabs")
+    scheduler = OutboundScheduler()
+    events = script(turns)
+    seconds = events[-1][0] + 1
+
+    started = time.thread_time()
+    await asyncio.gather(*(
+        session_call(ScriptedSTT(events), GPT.create(), TTS.create, scheduler, seconds, [])
+        for _ in range(calls)
+    ))
+    return time.thread_time() - started
+
+
+def count_hooks(calls: int, turns: int) -> Counter:
+    """ how often the tracing hooks are hit per turn, by span """
+    counts: Counter = Counter()
+    mark, turn_mark = tracing.mark, tracing.TurnTrace.mark
+
+    def counted_mark(span):
+        counts[span] += 1
+        mark(span)
+
+    def counted_turn_mark(self, span, at=None):
+        counts[span] += 1
+        turn_mark(self, span, at)
+
+    tracing.mark, tracing.TurnTrace.mark = counted_mark, counted_turn_mark  # type: ignore[method-assign]
+    try:
+        asyncio.run(run(calls, turns))
+    finally:
+        tracing.mark, tracing.TurnTrace.mark = mark, turn_mark  # type: ignore[method-assign]
+
+    return Counter({span: count / (calls * turns) for span, count in counts.items()})
+
+
+def hooks(counts: Counter, repeat: int) -> float:
+    """ seconds per turn spent in the tracing hooks of a turn hitting them `counts` times """
+    frames = round(counts["first_frame"])
+    marks = [(span, round(counts[span])) for span in ("first_token", "first_audio")]
+
+    async def turns() -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            # as CallSession._start_turn, the providers, _send_frame and _respond do
+            trace = tracing.start_turn()
+            if trace is not None:
+                trace.mark("utterance_end")
+                trace.mark("speech_end")
+            tracing.current_turn.set(trace)
+
+            for span, count in marks:
+                for _ in range(count):
+                    tracing.mark(span)
+
+            for _ in range(frames):
+                if trace is not None:
+                    trace.mark("first_frame")
+                    trace.marks["last_frame"] = time.monotonic()
+
+            if trace is not None:
+                trace.finish("done")
+        return (time.perf_counter() - started) / repeat
+
+    return asyncio.run(turns())
+
+
+def outcomes() -> dict[str, int]:
+    """ traced turns, by how they ended """
+    samples = Metrics.families()[f"{Metrics.PREFIX}turn_span_seconds"]["samples"]
+    return {
+        outcome: int(samples.get(f'{Metrics.PREFIX}turn_span_seconds_count{{outcome="{outcome}",span="utterance_end"}}', 0))
+        for outcome in tracing.TurnTrace.OUTCOMES
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20000, help="turns of hooks to time")
+    args = parser.parse_args()
+
+    openai = FakeOpenAI().start()
+    elevenlabs = FakeElevenLabs().start()
+    AppConfig.OPENAI_BASE_URL = openai.base_url
+    AppConfig.ELEVENLABS_URL = elevenlabs.ws_url
+    AppConfig.GREETING = None
+
+    try:
+        AppConfig.TRACE_SAMPLE_RATE = 1.0
+        counts = count_hooks(args.calls, args.turns)
+        print("hooks per turn  " + "  ".join(f"{span}={count:.1f}" for span, count in sorted(counts.items())))
+        print("traced turns    " + "  ".join(f"{outcome}={count}" for outcome, count in outcomes().items()))
+
+        cpu, hooked = {}, {}
+        for rate in (0.0, 1.0):
+            AppConfig.TRACE_SAMPLE_RATE = rate
+            cpu[rate] = asyncio.run(run(args.calls, args.turns)) / (args.calls * args.turns)
+            hooked[rate] = hooks(counts, args.repeat)
+            print(f"sample rate {rate:4.0%}  event loop cpu {cpu[rate] * 1000:7.3f}ms/turn   "
+                  f"tracing hooks {hooked[rate] * 1e6:7.2f}us/turn")
+
+        overhead = (hooked[1.0] - hooked[0.0]) / cpu[0.0]
+        print(f"overhead          {overhead:.3%} of the event loop cpu of a turn "
+              f"(a/b cpu difference {(cpu[1.0] - cpu[0.0]) / cpu[0.0]:+.1%})")
+    finally:
+        openai.stop()
+        elevenlabs.stop()
+
+
+if __name__ == "__main__":
+    main()
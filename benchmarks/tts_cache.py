@@ -0,0 +1,85 @@
+"""
+The text-to-speech cache (processing/texttospeech/cache.py): time to the
+first audio of a reply it has cached against one the provider has to
+speak, and what it keeps of replies the provider cut short.
+
+Each reply is spoken by an ElevenLabs stand-in through `CachedTTS`, with a
+memory and a disk tier. The steady stand-in finishes every utterance; the
+dropping one closes the socket after the first audio, without an isFinal.
+Those turns should fail, and leave nothing cached, however often the same
+reply is asked for again.
+
+    python -m benchmarks.tts_cache --turns 20
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from typing import AsyncGenerator, Optional
+
+from processing.texttospeech import CachedTTS, TTSCache
+from processing.texttospeech.elevenlabs import ElevenLabsTTS
+
+from .fakes import FakeElevenLabs
+from .hedging import provider
+from .probes import format_ms, percentiles
+
+REPLY = "Pancakes are better than waffles, because they are fluffier."
+
+
+async def reply() -> AsyncGenerator[str, None]:
+    """ a streamed LLM reply """
+    for word in REPLY.split(" "):
+        yield word + " "
+        await asyncio.sleep(0.02)
+
+
+async def speak(tts: CachedTTS) -> Optional[float]:
+    """ seconds to the first audio, None if the turn failed """
+    started = time.monotonic()
+    latency: Optional[float] = None
+    try:
+        async for _ in await tts.speak_stream(reply()):
+            latency = latency or time.monotonic() - started
+        return latency
+    except Exception:
+        return None
+    finally:
+        await tts.close()
+
+
+async def run(name: str, url: str, turns: int) -> None:
+    TTS = provider(ElevenLabsTTS, url)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = TTSCache(memory_bytes=16 * 1024 * 1024, disk_path=directory, disk_bytes=64 * 1024 * 1024)
+
+        latencies = [await speak(CachedTTS(TTS.create(), cache)) for _ in range(turns)]
+        spoken = [latency for latency in latencies if latency is not None]
+        first, rest = latencies[0], [latency for latency in latencies[1:] if latency is not None]
+
+        assert cache.disk is not None
+        print(f"{name:<9} turns={turns:<4} failed={turns - len(spoken):<4} "
+              f"cached: memory={len(cache.memory)} disk={len(cache.disk)}")
+        print(f"{'':<9} first audio  first turn {f'{first * 1000:7.2f}ms' if first is not None else '-'}")
+        print(f"{'':<9}              later      {format_ms(percentiles(rest)) if rest else '-'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    steady = FakeElevenLabs(seed=1).start()
+    dropping = FakeElevenLabs(drop_rate=1, seed=2).start()
+
+    try:
+        asyncio.run(run("steady", steady.ws_url, args.turns))
+        asyncio.run(run("dropping", dropping.ws_url, args.turns))
+    finally:
+        steady.stop()
+        dropping.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Offline evaluation of the local VAD endpointer on recorded calls.
+
+Each recording is raw linear16 mono PCM at StreamingConfig.FREQUENCY
+(`call.pcm`), with a sidecar `call.json` listing when each caller turn
+really ended, in seconds:
+
+    {"ends": [2.41, 7.9, 12.03]}
+
+For every labelled end we report how long the endpointer took to fire
+(endpoint latency). Endpoints that fire mid-turn, away from any labelled
+end, are false cuts.
+
+    python -m benchmarks.vad_eval recordings/*.pcm --endpoint-ms 200 300 500
+"""
+import argparse
+import json
+from pathlib import Path
+
+from const import StreamingConfig
+from processing.speechtotext.vad import EnergyVAD, frame_energies
+
+from .probes import percentiles, format_ms
+
+
+def endpoints(pcm: bytes, endpoint_ms: int, threshold_db: float) -> list[float]:
+    """ the time (in seconds) of every endpoint the vad fires on this audio """
+    vad = EnergyVAD(endpoint_ms=endpoint_ms, threshold_db=threshold_db)
+    result = []
+
+    for index, energy in enumerate(frame_energies(pcm)):
+        if vad.update(float(energy)) == "end":
+            result.append((index + 1) * StreamingConfig.BUFFER_DURATION)
+
+    return result
+
+
+def evaluate(files: list[Path], endpoint_ms: int, threshold_db: float, tolerance: float) -> None:
+    latencies: list[float] = []
+    missed = 0
+    false_cuts = 0
+    fired = 0
+
+    for path in files:
+        ends = json.loads(path.with_suffix(".json").read_text())["ends"]
+        found = endpoints(path.read_bytes(), endpoint_ms, threshold_db)
+        fired += len(found)
+
+        matched = set()
+        for end in ends:
+            hit = next((t for t in found if end <= t <= end + tolerance and t not in matched), None)
+            if hit is None:
+                missed += 1
+                continue
+
+            matched.add(hit)
+            latencies.append(hit - end)
+
+        false_cuts += len(found) - len(matched)
+
+    rate = false_cuts / fired if fired else 0.0
+    print(f"endpoint={endpoint_ms:>4}ms  latency: {format_ms(percentiles(latencies))}"
+          f"  missed={missed}  false cuts={false_cuts}/{fired} ({rate:.1%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", type=Path, nargs="+")
+    parser.add_argument("--endpoint-ms", type=int, nargs="+", default=[StreamingConfig.VAD_ENDPOINT_MS])
+    parser.add_argument("--threshold-db", type=float, default=StreamingConfig.VAD_THRESHOLD_DB)
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="seconds after a labelled end in which an endpoint still counts")
+    args = parser.parse_args()
+
+    print(f"deepgram UtteranceEnd baseline: {StreamingConfig.UTTERANCE_END}ms after the last word")
+    for endpoint_ms in args.endpoint_ms:
+        evaluate(args.files, endpoint_ms, args.threshold_db, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
-from dotenv import get_key
+from functools import lru_cache
+from typing import Optional
+from dotenv import dotenv_values
 
 
 # ------------------------------------------------------------------------------ #
 # This is a helper function that allows us to guarantee that all
 # used environment variables are present. If they are not, it will
 # raise a ValueError with a message indicating which variable is
-# missing.
+# missing. The file is only parsed once, however many keys are read.
 # ------------------------------------------------------------------------------ #
 
 
+@lru_cache(maxsize=None)
+def _env(env_file: str) -> dict[str, Optional[str]]:
+    return dotenv_values(env_file)
+
+
 def got(key: str, env_file=".env"):
     """ get or throw error """
-    value = get_key(env_file, key)
+    value = _env(env_file).get(key)
     if value is None:
         raise ValueError(f"Missing {key} in {env_file}")
     return value
@@ -30,6 +37,123 @@ class AppConfig:
     PORT: int = 3000
 
     GPT_PROMPT: str = "You are a helpful assistant. That tries to convince people that pancakes are better than waffles."
+    GPT_MODEL: str = "gpt-3.5-turbo"
+
+    # Conversation context. Recent turns are sent verbatim, up to
+    # GPT_CONTEXT_TOKENS. Past that, all but the last GPT_RECENT_TURNS turns
+    # are folded into a running summary, in the background between turns.
+    GPT_CONTEXT_TOKENS: int = 1500
+    GPT_RECENT_TURNS: int = 4
+
+    # Response cache. A caller's first question, if close enough to one
+    # another caller opened with (RESPONSE_CACHE_THRESHOLD, 0-1, on the
+    # letter trigrams of its words, and the same content words in the same
+    # order), gets the reply they got, without asking the model. Up to
+    # RESPONSE_CACHE_SIZE answers per GPT_PROMPT are kept, for
+    # RESPONSE_CACHE_TTL seconds; questions under RESPONSE_CACHE_MIN_WORDS
+    # words are always sent to the model.
+    RESPONSE_CACHE: bool = False
+    RESPONSE_CACHE_THRESHOLD: float = 0.8
+    RESPONSE_CACHE_SIZE: int = 1000
+    RESPONSE_CACHE_TTL: float = 24 * 60 * 60
+    RESPONSE_CACHE_MIN_WORDS: int = 3
+
+    # Provider endpoints (None uses the provider default). These are mostly
+    # useful to point the app at local stand-in servers for benchmarking.
+    OPENAI_BASE_URL: Optional[str] = None
+    DEEPGRAM_URL: Optional[str] = None
+    ELEVENLABS_URL: Optional[str] = None
+
+    # Connection pools. TTS_POOL_SIZE text-to-speech websockets are kept open
+    # ahead of time, and dropped after TTS_POOL_MAX_IDLE seconds unused.
+    TTS_POOL_SIZE: int = 2
+    TTS_POOL_MAX_IDLE: float = 15
+
+    # Text-to-speech cache. Repeated phrases are served from memory (up to
+    # TTS_CACHE_MEMORY_MB) or from files in TTS_CACHE_DIR (up to
+    # TTS_CACHE_DISK_MB, None keeps the cache in memory only).
+    TTS_CACHE: bool = True
+    TTS_CACHE_MEMORY_MB: int = 64
+    TTS_CACHE_DIR: Optional[str] = ".cache/tts"
+    TTS_CACHE_DISK_MB: int = 1024
+
+    # Providers are opened while a call is being answered, and handed to its
+    # websocket when it connects, or closed after PREWARM_TIMEOUT seconds.
+    # GREETING (if set) is said as soon as the call connects.
+    PREWARM: bool = True
+    PREWARM_TIMEOUT: float = 30
+    GREETING: Optional[str] = None
+
+    # Worker processes. With more than one, api.py forks WORKERS copies of the
+    # app onto one socket under a supervisor (SIGHUP restarts them one at a
+    # time). Pools and caches above are per worker; calls and metrics are
+    # shared through the SQLite database at STATE_DB.
+    WORKERS: int = 1
+    STATE_DB: str = ".cache/state.db"
+
+    # Draining. On SIGTERM the app stops taking calls, and waits up to
+    # DRAIN_TIMEOUT seconds for the calls in progress to end. Calls still
+    # going then end once the bot has finished its turn (or after
+    # DRAIN_TURN_TIMEOUT seconds). Meanwhile /answer sends new calls to the
+    # websocket at DRAIN_TRANSFER_URL (another host), if set, or says
+    # DRAIN_MESSAGE and hangs up.
+    DRAIN_TIMEOUT: float = 300
+    DRAIN_TURN_TIMEOUT: float = 15
+    DRAIN_TRANSFER_URL: Optional[str] = None
+    DRAIN_MESSAGE: str = "Sorry, we can't take your call right now. Please call back in a minute."
+
+    # Providers, by name (see processing/providers.py). Only the selected
+    # ones are imported, when the app starts serving.
+    TELEPHONY: str = "vonage"
+    STT: str = "deepgram"
+    TTS: str = "elevenlabs"
+    GPT: str = "openai"
+
+    # Failover. With TTS_FALLBACK set, a reply that has no audio from TTS
+    # HEDGE_TTS_BUDGET seconds after its first text (or the provider's recent
+    # p95, if longer, up to HEDGE_MAX_BUDGET) is started on the fallback too,
+    # and whichever speaks first is used. STT_FALLBACK does the same for
+    # connecting the speech-to-text socket (HEDGE_STT_BUDGET). A provider that
+    # fails, or is too slow, BREAKER_FAILURES times in a row is skipped for
+    # BREAKER_COOLDOWN seconds.
+    TTS_FALLBACK: Optional[str] = None
+    STT_FALLBACK: Optional[str] = None
+    HEDGE_TTS_BUDGET: float = 1.0
+    HEDGE_STT_BUDGET: float = 1.5
+    HEDGE_MAX_BUDGET: float = 3.0
+    BREAKER_FAILURES: int = 3
+    BREAKER_COOLDOWN: float = 30
+
+    # Admission control. Each GPT, TTS and STT provider takes at most
+    # *_CONCURRENCY requests at once (an STT request lasts the whole call) and
+    # *_RATE new ones a second, None for no limit. These are for the host,
+    # each of the WORKERS gets its share. Requests past them queue, a caller's
+    # first turn ahead of later ones. /answer turns calls away (as when
+    # draining) past MAX_CALLS connected calls, or when a first turn would
+    # queue for more than SHED_WAIT seconds.
+    MAX_CALLS: Optional[int] = None
+    SHED_WAIT: float = 2.0
+    GPT_CONCURRENCY: Optional[int] = None
+    GPT_RATE: Optional[float] = None
+    TTS_CONCURRENCY: Optional[int] = None
+    TTS_RATE: Optional[float] = None
+    STT_CONCURRENCY: Optional[int] = None
+    STT_RATE: Optional[float] = None
+
+    # Call recording. With RECORD_DIR set, every call's audio (both ways)
+    # and what was heard and replied are recorded under it, one directory
+    # per call, to replay with benchmarks/replay.py (see processing/recorder.py).
+    # Nothing recorded is ever deleted from it; a call that sent no audio
+    # leaves no directory behind.
+    RECORD_DIR: Optional[str] = None
+
+    # Log records waiting to be written out (as JSON lines, by a background
+    # thread). Past this many, records are dropped and counted rather than
+    # holding up the calls.
+    LOG_QUEUE_SIZE: int = 10000
+
+    # Fraction of turns whose latency breakdown is traced into /metrics.
+    TRACE_SAMPLE_RATE: float = 1.0
 
     # Environment Variables
     NGROK_AUTHTOKEN = got("NGROK_AUTHTOKEN")
@@ -68,17 +192,58 @@ class _StreamingConfig:
     # This is the audio format. Some providers (Twilio),
     # cough, cough, only support 8-bit audio. Is this a
     # bad thing? No, but the quality is twice as bad.
+    # Use 8 with the mulaw/alaw encodings below.
     BITRATE = 16
 
     # This is the buffer duration in milliseconds.
     BUFFER_DURATION = 20 / 1000  # 20ms
 
-    # This is the audio encoding.
+    # This is the audio encoding on the call: linear16, mulaw or alaw.
+    # Text-to-speech audio in any other format (or rate) is converted to
+    # it by processing/codec.py. Vonage websockets only carry linear16.
     ENCODING = "linear16"
 
+    # This is how many outbound frames (of BUFFER_DURATION each) may be queued
+    # ahead of real time, before text-to-speech has to wait.
+    OUTBOUND_LOOKAHEAD = 10
+
+    # This is how many inbound frames (of BUFFER_DURATION each) may wait for
+    # the speech-to-text provider, and how many of its events may wait to be
+    # handled, before the websocket (or the provider's event dispatch) waits.
+    INBOUND_QUEUE = 50
+    EVENT_QUEUE = 100
+
     # This is the time in milliseconds to wait for the end of an utterance.
     UTTERANCE_END = 1000
 
+    # End the turn locally, after VAD_ENDPOINT_MS of silence, as soon as the
+    # transcript is final, instead of waiting for UTTERANCE_END. Frames
+    # quieter than VAD_THRESHOLD_DB (dBFS) never count as speech.
+    VAD_ENDPOINT = True
+    VAD_ENDPOINT_MS = 300
+    VAD_THRESHOLD_DB = -45
+
+    # Start generating a reply while the caller is still talking, from a
+    # stable interim transcript, and use it if the final transcript matches.
+    # At most SPECULATION_LIMIT of these run at once per call.
+    SPECULATE = False
+    SPECULATION_LIMIT = 2
+
+    # Keep the speech-to-text socket open between turns, rather than closing
+    # it while the bot speaks and re-opening it afterwards.
+    STT_KEEPALIVE = True
+
+    # Stop the bot as soon as the caller talks over it. This relies on
+    # STT_KEEPALIVE, as caller audio has to keep flowing while the bot speaks.
+    BARGE_IN = True
+
+    # Seconds without audio before a KeepAlive message is sent.
+    STT_KEEPALIVE_INTERVAL = 5
+
+    # Seconds of caller audio held locally while the socket reconnects
+    # (only used when STT_KEEPALIVE is off).
+    STT_RECONNECT_BUFFER = 2
+
     @property
     def AUDIO_WIDTH(self) -> int:
         """ returns the audio width in bytes """
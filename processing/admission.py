@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Optional
+
+from const import AppConfig
+from processing.metrics import Metrics
+
+
+# ------------------------------------------------------------------------------ #
+# Admission control. Every GPT, TTS and STT provider gets a limiter: at most
+# so many requests open at once, and so many started per second (a token
+# bucket). Requests past either limit queue, a caller's first turn ahead of
+# later turns, since that is when a caller is deciding whether to hang up.
+# Work nobody is waiting on (summarising a conversation) goes after both.
+# What the queues add up to decides whether /answer takes another call.
+# ------------------------------------------------------------------------------ #
+
+
+FIRST_TURN, LATER_TURN, BACKGROUND = 0, 1, 2
+PRIORITIES = {FIRST_TURN: "first_turn", LATER_TURN: "later_turn", BACKGROUND: "background"}
+
+# the priority of whatever the current task asks a provider for, set per turn
+# (the greeting and the warm-up of a call count as its first turn)
+priority: ContextVar[int] = ContextVar("priority", default=FIRST_TURN)
+
+
+class TokenBucket:
+    """ `rate` tokens a second, up to `burst` saved up """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait(self, count: int = 1) -> float:
+        """ seconds until `count` tokens have come in """
+        self._refill()
+        return max(0.0, (count - self.tokens) / self.rate)
+
+
+class Limiter:
+    """
+    A concurrency limit and a rate limit on one provider, with a priority
+    queue in front. `acquire` waits for a turn and returns when it was
+    given one, which goes back to `release` when the request is over.
+    """
+
+    def __init__(self, kind: str, name: str, concurrency: Optional[int], rate: Optional[float]) -> None:
+        self.kind = kind
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, max(1.0, rate)) if rate else None
+
+        self.in_use = 0
+        self._waiting: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # how long requests hold their turn, on average, to project waits with
+        self.held: Optional[float] = None
+
+        labels = {"kind": kind, "provider": name}
+        self._depth = Metrics.gauge("limiter_queue_depth", "requests waiting for a provider's limiter", labels)
+        self._in_use = Metrics.gauge("limiter_in_use", "requests holding a turn of a provider's limiter", labels)
+        self._waited = {
+            p: Metrics.histogram("limiter_wait_seconds", "time requests waited for a provider's limiter",
+                                 {**labels, "priority": label})
+            for p, label in PRIORITIES.items()
+        }
+
+    def _take(self) -> bool:
+        if self.concurrency is not None and self.in_use >= self.concurrency:
+            return False
+        if self.bucket is not None and not self.bucket.take():
+            return False
+        self.in_use += 1
+        return True
+
+    def _dispatch(self) -> None:
+        """ give free turns to the waiting requests, most urgent first """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiting:
+            if self._waiting[0][2].done():
+                # gave up waiting
+                heapq.heappop(self._waiting)
+                continue
+            if not self._take():
+                break
+            heapq.heappop(self._waiting)[2].set_result(None)
+
+        # out of tokens rather than turns, come back when the next one is in
+        blocked = self.concurrency is None or self.in_use < self.concurrency
+        if self._waiting and blocked and self.bucket is not None:
+            self._timer = asyncio.get_running_loop().call_later(self.bucket.wait(), self._dispatch)
+
+        self._depth.set(len(self._waiting))
+        self._in_use.set(self.in_use)
+
+    async def acquire(self, urgency: Optional[int] = None) -> float:
+        """ wait for a turn (at the current task's priority, by default), returning when it started """
+        urgency = priority.get() if urgency is None else urgency
+        started = time.monotonic()
+
+        if self._waiting or not self._take():
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (urgency, next(self._order), future))
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # given a turn just as it was cancelled
+                    self.release()
+                else:
+                    self._waiting = [w for w in self._waiting if w[2] is not future]
+                    heapq.heapify(self._waiting)
+                    self._depth.set(len(self._waiting))
+                raise
+
+        granted = time.monotonic()
+        self._waited[urgency].observe(granted - started)
+        self._in_use.set(self.in_use)
+        return granted
+
+    def release(self, granted: Optional[float] = None) -> None:
+        if granted is not None:
+            held = time.monotonic() - granted
+            self.held = held if self.held is None else 0.9 * self.held + 0.1 * held
+        self.in_use -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, urgency: Optional[int] = None) -> AsyncIterator[None]:
+        granted = await self.acquire(urgency)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+    def projected_wait(self, urgency: int = FIRST_TURN) -> float:
+        """ roughly how long a new request at `urgency` would wait for its turn """
+        ahead = sum(1 for p, _, future in self._waiting if p <= urgency and not future.done()) + 1
+
+        wait = 0.0
+        if self.concurrency is not None and self.held is not None:
+            queued = self.in_use + ahead - self.concurrency
+            if queued > 0:
+                wait = queued / self.concurrency * self.held
+        if self.bucket is not None:
+            wait = max(wait, self.bucket.wait(ahead))
+        return wait
+
+
+def _share(limit):
+    """ the limits are for the host, each worker gets its share """
+    if limit is None:
+        return None
+    share = limit / max(1, AppConfig.WORKERS)
+    return max(1, int(share)) if isinstance(limit, int) else share
+
+
+_limiters: dict[tuple[str, str], Limiter] = {}
+
+
+def limiter(kind: str, name: str) -> Limiter:
+    """ the process wide limiter of a provider, limited as AppConfig says for its kind """
+    if (kind, name) not in _limiters:
+        concurrency = getattr(AppConfig, f"{kind.upper()}_CONCURRENCY")
+        rate = getattr(AppConfig, f"{kind.upper()}_RATE")
+        _limiters[(kind, name)] = Limiter(kind, name, _share(concurrency), _share(rate))
+    return _limiters[(kind, name)]
+
+
+async def limited(kind: str, name: str, stream: Awaitable[AsyncIterator] | AsyncIterator) -> AsyncGenerator:
+    """
+    `stream`, holding a turn of the provider's limiter from its first item to
+    its end. The provider is only asked once that first item is wanted: an
+    async generator does not start until then, and an awaitable stream is
+    awaited once the turn has been granted.
+    """
+    async with limiter(kind, name).slot():
+        if inspect.isawaitable(stream):
+            stream = await stream
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()  # type: ignore[attr-defined]
+
+
+def projected_wait(urgency: int = FIRST_TURN) -> float:
+    """ the longest a new request at `urgency` would wait, over every provider """
+    return max((lim.projected_wait(urgency) for lim in _limiters.values()), default=0.0)
@@ -0,0 +1,325 @@
+import math
+from typing import Optional, Union
+
+import numpy as np
+
+from const import StreamingConfig
+
+
+ENCODINGS = ("linear16", "mulaw", "alaw")
+
+# the byte that pads audio out with silence in each encoding (a zero byte is
+# silence in linear16, but close to full scale in mu-law and A-law)
+SILENCE = {"linear16": b"\x00", "mulaw": b"\xff", "alaw": b"\xd5"}
+
+
+class AudioFormat:
+    """ how a stream of audio is encoded: encoding, sample rate and (interleaved) channels """
+    __slots__ = ("encoding", "sample_rate", "channels")
+
+    def __init__(self, encoding: str = "linear16", sample_rate: int = 16000, channels: int = 1) -> None:
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding!r}, expected one of {ENCODINGS}")
+
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @property
+    def width(self) -> int:
+        """ bytes per sample """
+        return 2 if self.encoding == "linear16" else 1
+
+    def size(self, seconds: float) -> int:
+        """ bytes in `seconds` of audio """
+        return int(self.sample_rate * seconds) * self.width * self.channels
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, AudioFormat) and self.encoding == other.encoding
+            and self.sample_rate == other.sample_rate and self.channels == other.channels
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.encoding, self.sample_rate, self.channels))
+
+    def __repr__(self) -> str:
+        return f"AudioFormat({self.encoding!r}, {self.sample_rate}, channels={self.channels})"
+
+
+def call_format() -> AudioFormat:
+    """ the call's audio on the telephony carrier, as set in StreamingConfig """
+    return AudioFormat(StreamingConfig.ENCODING, StreamingConfig.FREQUENCY, StreamingConfig.CHANNELS)
+
+
+def closest(formats: dict[str, AudioFormat], target: AudioFormat) -> str:
+    """
+    The key of the format in `formats` that is cheapest to convert to
+    `target`: the same format, else the same sample rate, else the lowest
+    rate above it (nothing is lost), else the highest rate there is.
+    """
+    def cost(key: str) -> tuple:
+        fmt = formats[key]
+        return (
+            fmt != target,
+            fmt.sample_rate != target.sample_rate,
+            fmt.sample_rate < target.sample_rate,
+            abs(fmt.sample_rate - target.sample_rate),
+            fmt.encoding != target.encoding,
+            fmt.channels != target.channels,
+        )
+
+    return min(formats, key=cost)
+
+
+# ------------------------------------------------------------------------------ #
+# G.711. Both laws are done through lookup tables, built once at import with
+# the reference (Sun) algorithms: decoding indexes a 256 entry table with the
+# bytes, encoding a 65536 entry table with the samples (as unsigned 16 bits).
+# ------------------------------------------------------------------------------ #
+
+
+def _segment(values: np.ndarray, ends: list[int]) -> np.ndarray:
+    """ the G.711 segment of each value, 8 if it is past the last one """
+    return np.searchsorted(np.array(ends), values, side="left")
+
+
+def _mulaw_tables() -> tuple[np.ndarray, np.ndarray]:
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = ((((u & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    decode = np.where(u & 0x80, -magnitude, magnitude).astype("<i2")
+
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), 8159) + (0x84 >> 2)
+    seg = _segment(pcm, [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+    value = np.where(seg >= 8, 0x7F, (np.minimum(seg, 7) << 4) | ((pcm >> (np.minimum(seg, 7) + 1)) & 0x0F))
+    encode = (value ^ mask).astype(np.uint8)
+
+    return decode, encode
+
+
+def _alaw_tables() -> tuple[np.ndarray, np.ndarray]:
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (a >> 4) & 0x07
+    magnitude = ((a & 0x0F) << 4) + 8
+    magnitude = np.where(exponent > 0, (magnitude + 0x100) << np.maximum(exponent - 1, 0), magnitude)
+    decode = np.where(a & 0x80, magnitude, -magnitude).astype("<i2")
+
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    pcm = np.where(pcm >= 0, pcm, -pcm - 1)
+    seg = _segment(pcm, [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+    shift = np.where(seg < 2, 1, np.minimum(seg, 7))
+    value = np.where(seg >= 8, 0x7F, (np.minimum(seg, 7) << 4) | ((pcm >> shift) & 0x0F))
+    encode = (value ^ mask).astype(np.uint8)
+
+    return decode, encode
+
+
+_DECODE: dict[str, np.ndarray] = {}
+_ENCODE: dict[str, np.ndarray] = {}
+_DECODE["mulaw"], _ENCODE["mulaw"] = _mulaw_tables()
+_DECODE["alaw"], _ENCODE["alaw"] = _alaw_tables()
+
+
+def decode(data: bytes, encoding: str) -> np.ndarray:
+    """ bytes in `encoding` to int16 samples """
+    if encoding == "linear16":
+        return np.frombuffer(data, dtype="<i2")
+    return _DECODE[encoding][np.frombuffer(data, dtype=np.uint8)]
+
+
+def encode(samples: np.ndarray, encoding: str) -> bytes:
+    """ int16 samples to bytes in `encoding` """
+    if encoding == "linear16":
+        return samples.astype("<i2", copy=False).tobytes()
+    return _ENCODE[encoding][samples.astype("<i2", copy=False).view(np.uint16)].tobytes()
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """ float samples, rounded and clipped, as int16 (reusing `samples`) """
+    np.rint(samples, out=samples)
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype("<i2")
+
+
+# ------------------------------------------------------------------------------ #
+# Resampling
+# ------------------------------------------------------------------------------ #
+
+
+class Resampler:
+    """
+    Polyphase resampling by a rational factor, over a stream of chunks.
+
+    The filter is the one scipy's resample_poly designs (a Kaiser windowed
+    sinc, beta 5, cut off at the lower of the two Nyquist rates), split into
+    one short filter per output phase. Each chunk is resampled in one
+    vectorized pass: a (outputs x taps) window of the input times the phase
+    filter of each output. The last taps of input and the output phase are
+    carried over, so a stream resamples the same however it is cut up.
+
+    Which input window and phase each output uses only depends on the output
+    phase a chunk starts at and its length, which with steady frames cycles
+    through a handful of values, so those are worked out once and kept.
+    """
+
+    # filter half-width, in zero crossings of the lower rate
+    ZERO_CROSSINGS = 10
+
+    def __init__(self, source_rate: int, target_rate: int) -> None:
+        divisor = math.gcd(source_rate, target_rate)
+        self.up = target_rate // divisor
+        self.down = source_rate // divisor
+
+        # taps per phase, enough to cover the filter at the input rate
+        self.taps = 2 * self.ZERO_CROSSINGS * math.ceil(self.down / self.up)
+        length = self.taps * self.up
+
+        cutoff = 1 / max(self.up, self.down)
+        t = np.arange(length) - (length - 1) / 2
+        h = self.up * cutoff * np.sinc(cutoff * t) * np.kaiser(length, 5.0)
+
+        # phase p holds h[p], h[p + up], ... reversed, to dot with input oldest first
+        self.phases = h.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+
+        # the last taps - 1 input samples, then the chunk being resampled,
+        # and every window of taps samples over it (a view, not a copy)
+        self._buffer = np.zeros(self.taps - 1, dtype=np.float32)
+        self._windows = self._buffer
+        self._reserve(4096)
+
+        # upsampled position of the next output, relative to the next chunk
+        self._position = 0
+        # (position, chunk length) -> (first input of each window, their phase filters)
+        self._plans: dict[tuple[int, int], tuple[Union[slice, np.ndarray], np.ndarray]] = {}
+
+    @property
+    def delay(self) -> int:
+        """ input samples still inside the filter, which `flush` pushes out """
+        return self.taps // 2
+
+    def _reserve(self, count: int) -> None:
+        """ make room for a chunk of `count` samples """
+        size = self.taps - 1 + count
+        if size <= len(self._buffer):
+            return
+
+        buffer = np.zeros(max(size, 2 * len(self._buffer)), dtype=np.float32)
+        buffer[:self.taps - 1] = self._buffer[:self.taps - 1]
+
+        stride = buffer.strides[0]
+        self._buffer = buffer
+        self._windows = np.lib.stride_tricks.as_strided(
+            buffer, (len(buffer) - self.taps + 1, self.taps), (stride, stride), writeable=False,
+        )
+
+    def _plan(self, position: int, count: int) -> tuple[Union[slice, np.ndarray], np.ndarray]:
+        plan = self._plans.get((position, count))
+        if plan is None:
+            # every output whose newest input sample is in this chunk
+            outputs = max(0, -(-(count * self.up - position) // self.down))
+            positions = position + self.down * np.arange(outputs)
+            starts = positions // self.up
+
+            # plain decimation reads evenly spaced windows, which slice as a view
+            if self.up == 1 and outputs:
+                starts = slice(int(starts[0]), int(starts[-1]) + 1, self.down)
+            plan = starts, np.ascontiguousarray(self.phases[positions % self.up])
+
+            if len(self._plans) >= 64:
+                self._plans.clear()
+            self._plans[(position, count)] = plan
+        return plan
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """ resample the next chunk of (mono) samples """
+        count = len(samples)
+        history = self.taps - 1
+
+        self._reserve(count)
+        self._buffer[history:history + count] = samples
+
+        starts, phases = self._plan(self._position, count)
+        self._position += len(phases) * self.down - count * self.up
+
+        output = (
+            np.einsum("ij,ij->i", self._windows[starts], phases)
+            if len(phases) else np.zeros(0, dtype=np.float32)
+        )
+
+        # keep the newest samples for the next chunk's windows
+        self._buffer[:history] = self._buffer[count:count + history].copy()
+        return output
+
+    def flush(self) -> np.ndarray:
+        return self.process(np.zeros(self.delay, dtype=np.float32))
+
+
+# ------------------------------------------------------------------------------ #
+# Converting streams
+# ------------------------------------------------------------------------------ #
+
+
+class Converter:
+    """
+    Converts a stream of audio from one format to another: decode, mix down
+    to mono, resample, copy out to the target's channels, encode.
+
+    Chunks can be any size. A partial sample is held over to the next chunk,
+    and the resampler keeps its state, so the stream converts the same
+    however it is cut up. When the formats match, chunks pass through as is.
+    """
+
+    def __init__(self, source: AudioFormat, target: Optional[AudioFormat] = None) -> None:
+        self.source = source
+        self.target = target or call_format()
+        self.passthrough = self.source == self.target
+
+        self._block = self.source.width * self.source.channels
+        self._partial = b""
+        self._resampler = (
+            Resampler(self.source.sample_rate, self.target.sample_rate)
+            if self.source.sample_rate != self.target.sample_rate else None
+        )
+
+    def _samples(self, data: bytes) -> np.ndarray:
+        """ whole samples of the source, as mono """
+        if self._partial:
+            data = self._partial + data
+
+        usable = len(data) - len(data) % self._block
+        if usable != len(data):
+            data, self._partial = data[:usable], data[usable:]
+        else:
+            self._partial = b""
+
+        samples = decode(data, self.source.encoding)
+        if self.source.channels > 1:
+            samples = samples.reshape(-1, self.source.channels).mean(axis=1)
+        return samples
+
+    def _output(self, samples: np.ndarray) -> bytes:
+        if samples.dtype != np.int16:
+            samples = to_int16(samples)
+        if self.target.channels > 1:
+            samples = np.repeat(samples, self.target.channels)
+        return encode(samples, self.target.encoding)
+
+    def convert(self, data: bytes) -> bytes:
+        if self.passthrough:
+            return data
+
+        samples = self._samples(data)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        return self._output(samples)
+
+    def flush(self) -> bytes:
+        """ the end of the stream: what is still inside the resampler """
+        self._partial = b""
+        if self.passthrough or self._resampler is None:
+            return b""
+        return self._output(self._resampler.flush())
@@ -1,3 +1,16 @@
-from .open_ai import OpenAIGPT
+from importlib import import_module
 
-__all__ = ["OpenAIGPT"]
+from .cache import ResponseCache
+from .speculative import Speculator
+
+# providers are imported on first use, each one pulls in its vendor's sdk
+_PROVIDERS = {"OpenAIGPT": ".open_ai"}
+
+
+def __getattr__(name: str):
+    if name in _PROVIDERS:
+        return getattr(import_module(_PROVIDERS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["OpenAIGPT", "ResponseCache", "Speculator"]
@@ -1,8 +1,45 @@
+import asyncio
+from functools import lru_cache
+from logging import getLogger
+from typing import AsyncGenerator, Optional
+
+from const import AppConfig
+from processing import tracing
+from processing.metrics import Metrics
+from .cache import ResponseCache
+from .history import History, Message, MESSAGE_OVERHEAD, count_tokens
+
+
+logger = getLogger(__name__)
+
+prompt_tokens = Metrics.histogram(
+    "gpt_prompt_tokens", "tokens in each prompt sent to the llm",
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+)
+
+
+@lru_cache(maxsize=8)
+def _system_tokens(prompt: str) -> int:
+    return count_tokens(prompt) + MESSAGE_OVERHEAD
+
+
 class GPT:
-    history: list[str]
+    history: History
+
+    # answers to questions asked before, shared by every call (see cache.py)
+    cache: Optional[ResponseCache] = None
 
     def __init__(self) -> None:
-        self.history = [""]
+        self.history = History(
+            max_tokens=AppConfig.GPT_CONTEXT_TOKENS,
+            recent_turns=AppConfig.GPT_RECENT_TURNS
+        )
+
+        # the background summary of older turns, if one is being written
+        self._summarising: Optional[asyncio.Task] = None
+
+        # tokens in the last prompt built by `_get_messages`
+        self.prompt_tokens = 0
 
     @classmethod
     def create(cls) -> "GPT":
@@ -11,8 +48,108 @@ class GPT:
     def generate(self, text: str) -> str:
         raise NotImplementedError("GPT > Generate")
 
-    def _get_history(self) -> str:
-        return "".join(self.history[:-1])
+    def complete(self, text: str) -> AsyncGenerator[str, None]:
+        """ stream a reply to `text` given the history so far, without recording it """
+        raise NotImplementedError("GPT > Complete")
+
+    async def summarise(self, summary: str, messages: list[Message]) -> str:
+        """ fold `messages` into the running `summary` of the conversation """
+        raise NotImplementedError("GPT > Summarise")
+
+    def _get_messages(self, text: str) -> list[dict[str, str]]:
+        """ the prompt for a reply to `text`: system prompt, context, then the caller """
+        messages = [
+            {"role": "system", "content": AppConfig.GPT_PROMPT},
+            *self.history.context(),
+            {"role": "user", "content": text},
+        ]
+
+        self.prompt_tokens = (
+            _system_tokens(AppConfig.GPT_PROMPT) + self.history.context_tokens + count_tokens(text) + MESSAGE_OVERHEAD
+        )
+        prompt_tokens.observe(self.prompt_tokens)
+        return messages
+
+    def pending(self) -> str:
+        """ what the caller has said since the last reply """
+        return self.history.pending
+
+    def take_pending(self) -> str:
+        """ what the caller has said since the last reply, which is then cleared """
+        text, self.history.pending = self.history.pending, ""
+        return text
 
     async def append(self, text: str) -> None:
-        self.history[-1] += text
+        self.history.pending = f"{self.history.pending} {text}".strip()
+
+    async def _summarise(self) -> None:
+        messages = self.history.to_summarise()
+        try:
+            summary = await self.summarise(self.history.summary, messages)
+        except Exception as e:
+            # the verbatim turns are kept, and trimmed to fit, until it works
+            logger.warning(f"Could not summarise the conversation: {e!r}")
+            return
+
+        self.history.summarised(len(messages), summary)
+
+    def _summarise_later(self) -> None:
+        """ start summarising older turns, off the critical path, if they need it """
+        if self.history.needs_summary() and (self._summarising is None or self._summarising.done()):
+            self._summarising = asyncio.create_task(self._summarise())
+
+    def _answer(self, text: str) -> AsyncGenerator[str, None]:
+        """
+        A reply to `text`, from the response cache if it has one. Only a
+        caller's first question is answered without any context, so the
+        cache only answers, and keeps the replies to, first questions: a
+        later one may depend on what was said before.
+        """
+        if self.cache is None or self.history.summary or any(m.role == "user" for m in self.history.messages):
+            return self.complete(text)
+
+        if (answer := self.cache.get(text)) is not None:
+            logger.info("answered from the response cache")
+            return self._cached(answer)
+
+        return self._store(text, self.complete(text))
+
+    async def _cached(self, answer: str) -> AsyncGenerator[str, None]:
+        # all at once, text to speech gets the whole answer (and can cache its audio)
+        yield answer
+
+    async def _store(self, text: str, reply: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """ pass a reply through, caching it if it was generated to the end """
+        answer = ""
+        try:
+            async for token in reply:
+                answer += token
+                yield token
+        finally:
+            await reply.aclose()
+
+        if self.cache is not None:
+            self.cache.put(text, answer)
+
+    async def _record(self, text: str, reply: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """ pass a reply through, adding the exchange to the history """
+        self.history.add("user", text)
+        answer = ""
+
+        logger.info("caller said", extra={"text": text})
+        try:
+            async for token in reply:
+                tracing.mark("first_token")
+                answer += token
+                yield token
+
+        finally:
+            # closing the reply aborts the upstream request if we stopped early
+            await reply.aclose()
+
+            logger.info("bot replied", extra={"text": answer})
+            if answer:
+                self.history.add("assistant", answer)
+
+            # the reply is out, the caller is listening to it: a good time
+            self._summarise_later()
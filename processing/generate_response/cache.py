@@ -0,0 +1,201 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from logging import getLogger
+from typing import Optional
+
+from const import AppConfig
+from processing.metrics import Metrics
+from .history import normalize
+
+
+logger = getLogger(__name__)
+
+_lookups = {
+    result: Metrics.counter("gpt_cache_lookups_total", "response cache lookups, by result", {"result": result})
+    for result in ("hit", "miss")
+}
+_evictions = {
+    reason: Metrics.counter("gpt_cache_evictions_total", "response cache entries dropped", {"reason": reason})
+    for reason in ("size", "expired")
+}
+_similarity = Metrics.histogram(
+    "gpt_cache_similarity", "similarity of the closest cached question asking about the same things, on each lookup",
+    buckets=(0.2, 0.4, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0)
+)
+
+
+@lru_cache(maxsize=8)
+def _namespace(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()[:16]
+
+
+def namespace() -> str:
+    """ answers are only reused under the model and system prompt they were given with """
+    return _namespace(AppConfig.GPT_MODEL, AppConfig.GPT_PROMPT)
+
+
+def trigrams(question: str) -> frozenset[str]:
+    """ the letter trigrams of a normalized question, padded so short words count """
+    padded = f" {question} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a: frozenset[str], b: frozenset[str]) -> float:
+    """ Dice's coefficient: 1 for the same trigrams, 0 for none in common """
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+# words that change little about what is being asked, and fillers
+STOP_WORDS = frozenset("""
+    a an the and or but so um uh er like well oh just please okay ok hey hi hello
+    is are am was were be been being do does did have has had can could would will shall should may might
+    i you he she it we they me my your our their its this that these those there here
+    to of in on at for with about from by as if then than
+    you're i'm it's that's there's what's guys
+""".split())
+
+
+def content_words(question: str) -> tuple[str, ...]:
+    """ the words of a normalized question that carry its meaning, in order """
+    return tuple(word for word in question.split() if len(word) > 1 and word not in STOP_WORDS)
+
+
+def same_words(a: tuple[str, ...], b: tuple[str, ...], threshold: float = 0.6) -> bool:
+    """
+    Whether two questions ask about the same things in the same order: their
+    content words pair up one to one, each close enough to allow for a
+    mishearing ("pancake", "pancakes") but not a different word.
+    """
+    return len(a) == len(b) and all(
+        x == y or similarity(trigrams(x), trigrams(y)) >= threshold for x, y in zip(a, b)
+    )
+
+
+class Answer:
+    __slots__ = ("question", "grams", "words", "text", "expires")
+
+    def __init__(self, question: str, grams: frozenset[str], text: str, expires: float) -> None:
+        self.question = question
+        self.grams = grams
+        self.words = content_words(question)
+        self.text = text
+        self.expires = expires
+
+
+class ResponseCache:
+    """
+    Answers to questions callers have asked before, shared by every call.
+
+    Questions are compared on the letter trigrams of their normalized words,
+    so a transcript that comes out slightly differently ("what r your hours")
+    still finds the answer. The closest cached question is used if it is at
+    least `threshold` similar. An inverted index from trigram to question
+    finds the candidates: a question that similar shares at least a known
+    number of the new one's trigrams, so it is enough to look up the rarest
+    few (all but that many, less one) and score what they turn up.
+
+    Trigrams alone cannot tell "are pancakes better than waffles" from "are
+    waffles better than pancakes", or "tonight" from "tomorrow" in a long
+    question. So a match must also have the same content words (see
+    `same_words`), in the same order.
+
+    Entries live for `ttl` seconds, and the least recently used go once there
+    are more than `max_entries`. Everything is keyed by `namespace()`, so a
+    new prompt or model starts with nothing. Questions shorter than
+    `min_words` ("yes", "go on") mean nothing on their own and are skipped.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float, min_words: int) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.min_words = min_words
+
+        self._answers: "OrderedDict[tuple[str, str], Answer]" = OrderedDict()
+        self._postings: dict[tuple[str, str], set[str]] = {}
+
+        Metrics.collector(self._collect)
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def _collect(self) -> None:
+        Metrics.gauge("gpt_cache_entries", "answers held by the response cache").set(len(self._answers))
+
+    def _question(self, text: str) -> Optional[str]:
+        question = normalize(text)
+        return question if len(question.split()) >= self.min_words else None
+
+    def _remove(self, space: str, question: str) -> None:
+        answer = self._answers.pop((space, question))
+        for gram in answer.grams:
+            posting = self._postings[(space, gram)]
+            posting.discard(question)
+            if not posting:
+                del self._postings[(space, gram)]
+
+    def get(self, text: str) -> Optional[str]:
+        """ the answer to the closest question to `text`, if it is close enough """
+        question = self._question(text)
+        if question is None:
+            return None
+
+        space = namespace()
+        grams = trigrams(question)
+        words = content_words(question)
+
+        # dice >= threshold needs at least this many trigrams in common
+        needed = math.ceil(self.threshold * len(grams) / (2 - self.threshold))
+        postings = sorted((self._postings.get((space, gram), set()) for gram in grams), key=len)
+        candidates = set().union(*postings[:max(1, len(grams) - needed + 1)])
+
+        # and can only be so much shorter or longer
+        shortest, longest = needed, len(grams) * (2 - self.threshold) / self.threshold
+
+        now = time.monotonic()
+        best: Optional[Answer] = None
+        best_score = 0.0
+        for candidate in candidates:
+            answer = self._answers[(space, candidate)]
+            if answer.expires <= now:
+                self._remove(space, candidate)
+                _evictions["expired"].inc()
+                continue
+            if not shortest <= len(answer.grams) <= longest:
+                continue
+
+            score = similarity(grams, answer.grams)
+            if score > best_score and same_words(words, answer.words):
+                best, best_score = answer, score
+
+        _similarity.observe(best_score)
+        if best is None or best_score < self.threshold:
+            _lookups["miss"].inc()
+            return None
+
+        _lookups["hit"].inc()
+        self._answers.move_to_end((space, best.question))
+        logger.debug(f"response cache hit ({best_score:.2f}) for {question!r}: {best.question!r}")
+        return best.text
+
+    def put(self, text: str, answer: str) -> None:
+        question = self._question(text)
+        if question is None or not answer.strip():
+            return
+
+        space = namespace()
+        if (space, question) in self._answers:
+            self._remove(space, question)
+
+        grams = trigrams(question)
+        self._answers[(space, question)] = Answer(question, grams, answer, time.monotonic() + self.ttl)
+        for gram in grams:
+            self._postings.setdefault((space, gram), set()).add(question)
+
+        while len(self._answers) > self.max_entries:
+            oldest_space, oldest = next(iter(self._answers))
+            self._remove(oldest_space, oldest)
+            _evictions["size"].inc()
@@ -0,0 +1,119 @@
+import re
+from functools import lru_cache
+from logging import getLogger
+from typing import Optional
+
+
+logger = getLogger(__name__)
+
+# every chat message costs a few tokens of framing on top of its content
+MESSAGE_OVERHEAD = 4
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    """ tiktoken's encoding, if tiktoken is installed and has its data """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.info("tiktoken unavailable, estimating token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tokens in `text`. Without tiktoken this is an estimate, which for English
+    conversation lands within ~10% of cl100k: one token per word or
+    punctuation mark, plus one for every further 6 characters of long words.
+    """
+    if (encoding := _encoding()) is not None:
+        return len(encoding.encode(text))
+    return sum(1 + (len(word) - 1) // 6 for word in _WORD.findall(text))
+
+
+def normalize(text: str) -> str:
+    """ compare transcripts on their words, not their punctuation or case """
+    return " ".join(re.findall(r"[a-z0-9']+", text.lower()))
+
+
+class Message:
+    """ a chat message, with its token count worked out once """
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str) -> None:
+        self.role = role
+        self.content = content
+        self.tokens = count_tokens(content) + MESSAGE_OVERHEAD
+
+    def as_dict(self) -> dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class History:
+    """
+    The conversation so far, as chat messages.
+
+    Recent turns are kept verbatim. Once they add up to more than
+    `max_tokens`, everything but the last `recent_turns` turns can be folded
+    into a running summary (see `GPT._summarise_later`), sent ahead of them.
+    Summarising a batch of turns at once, rather than one turn at a time,
+    keeps the start of the prompt unchanged for several turns in a row, so
+    upstream prompt caching can apply.
+
+    `context` never goes over `max_tokens` (plus the summary), even if a
+    summary is late: the oldest verbatim turns are left out until it lands.
+    """
+
+    def __init__(self, max_tokens: int, recent_turns: int) -> None:
+        self.max_tokens = max_tokens
+        self.recent_turns = recent_turns
+
+        self.summary = ""
+        self._summary: Optional[Message] = None
+        self.messages: list[Message] = []
+        self.tokens = 0  # of the verbatim messages
+        self.context_tokens = 0  # of what `context` last returned
+
+        # what the caller has said since the last reply
+        self.pending = ""
+
+    def add(self, role: str, content: str) -> None:
+        message = Message(role, content)
+        self.messages.append(message)
+        self.tokens += message.tokens
+
+    def context(self) -> list[dict[str, str]]:
+        """ the summary, then as many of the most recent messages as fit """
+        budget = self.max_tokens
+        start = len(self.messages)
+        while start > 0 and budget - self.messages[start - 1].tokens >= 0:
+            start -= 1
+            budget -= self.messages[start].tokens
+
+        messages = [m.as_dict() for m in self.messages[start:]]
+        self.context_tokens = self.max_tokens - budget
+
+        if self._summary is not None:
+            messages.insert(0, self._summary.as_dict())
+            self.context_tokens += self._summary.tokens
+
+        return messages
+
+    def needs_summary(self) -> bool:
+        return self.tokens > self.max_tokens and len(self.messages) > 2 * self.recent_turns
+
+    def to_summarise(self) -> list[Message]:
+        """ the messages that the next summary should cover """
+        return self.messages[:len(self.messages) - 2 * self.recent_turns]
+
+    def summarised(self, count: int, summary: str) -> None:
+        """ replace the `count` oldest messages with `summary` """
+        for message in self.messages[:count]:
+            self.tokens -= message.tokens
+
+        del self.messages[:count]
+        self.summary = summary
+        self._summary = Message("system", f"Summary of the conversation so far: {summary}")
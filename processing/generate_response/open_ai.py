@@ -1,48 +1,102 @@
+import httpx
 import openai
 from typing import AsyncGenerator, Optional
 
+from processing import admission
 from .abstract import GPT
+from .history import Message
 from const import AppConfig
 
 
 class OpenAIGPT(GPT):
-    client: openai.Client
+    client: openai.AsyncClient
+
+    # one client (and so one httpx connection pool) is shared by every call
+    # on this process, so each turn reuses warm keep-alive connections
+    # instead of paying for a new TLS handshake.
+    _shared_client: Optional[openai.AsyncClient] = None
+
+    MAX_CONNECTIONS: int = 100
+    MAX_KEEPALIVE_CONNECTIONS: int = 20
+
+    SUMMARY_PROMPT: str = (
+        "You keep notes on a phone call between a caller and an assistant. "
+        "Update the summary so far with the new part of the transcript, in a "
+        "few sentences. Keep names, facts, questions and anything promised."
+    )
+    SUMMARY_MAX_TOKENS: int = 200
 
     @classmethod
-    def create(cls) -> "OpenAIGPT":
-        self = cls()
+    def get_client(cls) -> openai.AsyncClient:
+        """ return the process wide async client, creating it on first use """
+        if cls._shared_client is None:
+            cls._shared_client = openai.AsyncClient(
+                api_key=AppConfig.OPENAI_API_KEY,
+                base_url=AppConfig.OPENAI_BASE_URL,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=cls.MAX_CONNECTIONS,
+                        max_keepalive_connections=cls.MAX_KEEPALIVE_CONNECTIONS,
+                    )
+                )
+            )
 
-        self.client = openai.Client(
-            api_key=AppConfig.OPENAI_API_KEY
-        )
+        return cls._shared_client
 
+    @classmethod
+    def create(cls) -> "OpenAIGPT":
+        self = cls()
+        self.client = cls.get_client()
         return self
 
     async def generate(self, text: Optional[str] = None) -> AsyncGenerator[str, None]:
         if not text:
-            text = self.history.pop()
-
-        response = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": AppConfig.GPT_PROMPT},
-                {"role": "system", "content": "Conversation Context: " +
-                    self._get_history()},
-                {"role": "user", "content": text}
-            ],
-            stream=True
+            text = self.take_pending()
+
+        async for token in self._record(text, self._answer(text)):
+            yield token
+
+    def complete(self, text: str) -> AsyncGenerator[str, None]:
+        # the prompt is built now, so the reply only sees the history as it
+        # is at this point, even if the stream is consumed later on
+        return self._stream(self._get_messages(text))
+
+    async def summarise(self, summary: str, messages: list[Message]) -> str:
+        transcript = "\n".join(
+            f"{'Caller' if m.role == 'user' else 'Assistant'}: {m.content}" for m in messages
         )
 
-        self.history.append(f"User: {text}")
-        self.history.append("GPT: ")
+        # off the critical path, so behind every turn waiting for the model
+        async with admission.limiter("gpt", "openai").slot(admission.BACKGROUND):
+            response = await self.client.chat.completions.create(
+                model=AppConfig.GPT_MODEL,
+                messages=[
+                    {"role": "system", "content": self.SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Summary so far: {summary or '(none)'}\n\n{transcript}"},
+                ],
+                max_tokens=self.SUMMARY_MAX_TOKENS,
+            )
+
+        return (response.choices[0].message.content or summary).strip()
+
+    def _stream(self, messages: list) -> AsyncGenerator[str, None]:
+        # the request counts against the quota until the reply has streamed out
+        return admission.limited("gpt", "openai", self._deltas(messages))
+
+    async def _deltas(self, messages: list) -> AsyncGenerator[str, None]:
+        response = await self.client.chat.completions.create(
+            model=AppConfig.GPT_MODEL,
+            messages=messages,
+            stream=True
+        )
 
-        print(f"\n>>> {text}\n<<< ", end="")
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                self.history[-1] += chunk.choices[0].delta.content
-                print(chunk.choices[0].delta.content, end="")
-                yield chunk.choices[0].delta.content
+        try:
+            async for chunk in response:
+                if chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
 
-        print("\n")
-        # just a blank line in case the .append method is used
-        self.history.append("")
+        finally:
+            # if the consumer stopped early (or the task was cancelled), close
+            # the http response so the upstream completion is aborted and the
+            # connection goes back to the pool.
+            await response.response.aclose()
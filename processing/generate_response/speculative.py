@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import AsyncGenerator, Optional
+
+from const import StreamingConfig
+from processing.metrics import Metrics
+from .abstract import GPT
+from .history import normalize
+
+
+logger = getLogger(__name__)
+
+_started = Metrics.counter("speculations_started_total", "speculative replies started")
+_commits = {
+    result: Metrics.counter("speculation_commits_total", "turns that did (hit) or did not (miss) use a speculative reply", {"result": result})
+    for result in ("hit", "miss")
+}
+# the _sum is the latency saved in all, the _count the same as the hits
+_saved = Metrics.histogram("speculation_saved_seconds", "head start a committed speculative reply had on a normal generation")
+
+
+class Speculation:
+    """ a reply being generated ahead of time, buffered until it is committed or dropped """
+
+    def __init__(self, text: str, reply: AsyncGenerator[str, None]) -> None:
+        self.text = text
+        self.started = time.monotonic()
+        self.tokens: list[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+        self._changed = asyncio.Event()
+        self._reply = reply
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            async for token in self._reply:
+                self.tokens.append(token)
+                self._changed.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    def cancel(self) -> None:
+        self._task.cancel()
+
+    async def replay(self) -> AsyncGenerator[str, None]:
+        """ what has been generated so far, then the rest as it arrives """
+        index = 0
+        try:
+            while True:
+                while index < len(self.tokens):
+                    yield self.tokens[index]
+                    index += 1
+
+                if self.done:
+                    break
+
+                self._changed.clear()
+                await self._changed.wait()
+
+            if self.error is not None:
+                raise self.error
+
+        finally:
+            self.cancel()
+
+
+class Speculator:
+    """
+    Starts generating a reply while the caller is still talking.
+
+    Whenever the transcript looks stable (see `speculate`), a completion is
+    started for it in the background. When the turn really ends, `commit`
+    checks whether one of those was for exactly what the caller said: if so,
+    its buffered tokens are replayed (and recorded in the history as though
+    they had been generated just now); if not, every speculation is dropped
+    and the caller falls back to a normal generation.
+
+    At most `limit` speculations run at once per call; starting another one
+    cancels the oldest.
+    """
+
+    def __init__(self, gpt: GPT, limit: int = StreamingConfig.SPECULATION_LIMIT) -> None:
+        self.gpt = gpt
+        self.limit = limit
+        self._active: "OrderedDict[str, Speculation]" = OrderedDict()
+        self._last_interim: Optional[str] = None
+
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0  # seconds of head start given to committed replies
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def speculate(self, text: str) -> None:
+        """ start generating a reply to `text`, unless we already are """
+        key = normalize(text)
+        if not key or key in self._active:
+            return
+
+        while len(self._active) >= self.limit:
+            _, oldest = self._active.popitem(last=False)
+            oldest.cancel()
+
+        self._active[key] = Speculation(text, self.gpt.complete(text))
+        self.started += 1
+        _started.inc()
+
+    def on_interim(self, transcript: str) -> None:
+        """
+        An interim (not yet final) transcript of what the caller is saying.
+        It is only worth speculating on once it stops changing.
+        """
+        if transcript == self._last_interim:
+            self.speculate(" ".join(filter(None, (self.gpt.pending(), transcript))))
+        self._last_interim = transcript
+
+    def on_final(self) -> None:
+        """ a segment was finalised, everything said so far is known """
+        self._last_interim = None
+        self.speculate(self.gpt.pending())
+
+    def discard(self) -> None:
+        for speculation in self._active.values():
+            speculation.cancel()
+        self._active.clear()
+        self._last_interim = None
+
+    def commit(self) -> Optional[AsyncGenerator[str, None]]:
+        """
+        The turn has ended. Returns the speculative reply if one matches what
+        the caller said (in which case it takes the place of `gpt.generate()`),
+        otherwise None.
+        """
+        key = normalize(self.gpt.pending())
+        speculation = self._active.pop(key, None)
+        self.discard()
+
+        if speculation is None:
+            self.misses += 1
+            _commits["miss"].inc()
+            return None
+
+        self.hits += 1
+        _commits["hit"].inc()
+        saved = time.monotonic() - speculation.started
+        self.saved += saved
+        _saved.observe(saved)
+        logger.debug(f"Speculation hit ({self.hit_rate:.0%}), {self.saved:.2f}s saved so far")
+
+        self.gpt.take_pending()
+        return self.gpt._record(speculation.text, speculation.replay())
@@ -0,0 +1,267 @@
+import asyncio
+import time
+from collections import deque
+from logging import getLogger
+from typing import Awaitable, Callable, Deque, Generic, Optional, TypeVar
+
+from const import AppConfig
+from processing.metrics import Metrics
+
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """ the last `window` latencies of a provider, for percentiles """
+
+    def __init__(self, window: int = 200) -> None:
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """ nearest-rank percentile, None until there are samples """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a provider that keeps failing.
+
+    Closed, requests go through. After `failures` failures in a row it opens,
+    and requests are refused for `cooldown` seconds. Then it is half open:
+    one request is let through, and closes it again if it succeeds, or
+    re-opens it if it fails.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = 3, cooldown: float = 30) -> None:
+        self.failures = failures
+        self.cooldown = cooldown
+
+        self._failed = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """ may a request go to the provider (in half open, the one trial) """
+        state = self.state
+        if state == self.HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return state == self.CLOSED
+
+    def success(self) -> None:
+        self._failed = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self) -> None:
+        self._failed += 1
+        if self._trial or self._failed >= self.failures:
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class ProviderHealth:
+    """
+    How one provider has been doing, shared by every call on the process:
+    its time to first response, and its circuit breaker.
+    """
+
+    def __init__(self, kind: str, name: str) -> None:
+        self.kind = kind
+        self.name = name
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(AppConfig.BREAKER_FAILURES, AppConfig.BREAKER_COOLDOWN)
+
+        labels = {"kind": kind, "provider": name}
+        self._seconds = Metrics.histogram("provider_first_response_seconds", "time for a provider to first respond", labels)
+        self._failures = Metrics.counter("provider_failures_total", "provider requests that failed or were too slow", labels)
+        self._open = Metrics.gauge("provider_breaker_open", "1 while a provider's circuit breaker is open", labels)
+
+    def budget(self, default: float, limit: float) -> float:
+        """
+        How long to give it before hedging: its p95 (once there are enough
+        samples) but no less than `default`, and no more than `limit`.
+        """
+        p95 = self.latency.percentile(95) if len(self.latency) >= 20 else None
+        return min(max(default, p95 or 0), limit)
+
+    def success(self, seconds: float) -> None:
+        self.latency.observe(seconds)
+        self._seconds.observe(seconds)
+        self.breaker.success()
+        self._open.set(0)
+
+    def failure(self, why: str) -> None:
+        self._failures.inc()
+        self.breaker.failure()
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            self._open.set(1)
+            logger.warning(f"{self.kind} provider {self.name} {why}, circuit breaker open")
+        else:
+            logger.info(f"{self.kind} provider {self.name} {why}")
+
+
+_health: dict[tuple[str, str], ProviderHealth] = {}
+
+
+def health(kind: str, name: str) -> ProviderHealth:
+    """ the process wide health of a provider """
+    if (kind, name) not in _health:
+        _health[(kind, name)] = ProviderHealth(kind, name)
+    return _health[(kind, name)]
+
+
+def swapped(primary: ProviderHealth, secondary: ProviderHealth) -> bool:
+    """ should the secondary go first: the primary's breaker is open, and its is not """
+    return not primary.breaker.allow() and secondary.breaker.state == CircuitBreaker.CLOSED
+
+
+# ------------------------------------------------------------------------------ #
+# Hedged requests: start the primary provider, and if it has not responded
+# within its budget (or fails), start the secondary too, and go with whichever
+# responds first. The other one is given up.
+# ------------------------------------------------------------------------------ #
+
+
+# attempts being given up, kept so they are not garbage collected half way
+_discarding: set[asyncio.Task] = set()
+
+
+class Attempt(Generic[T]):
+    """ one provider's go at a request: `run` until its first response, `discard` to give it up """
+
+    def __init__(self, health: ProviderHealth, run: Callable[[], Awaitable[T]],
+                 discard: Callable[[], Awaitable[None]]) -> None:
+        self.health = health
+        self._run = run
+        self._discard = discard
+        self.task: Optional[asyncio.Task] = None
+
+        # latency is measured from here, which `hedge` may move up to when the
+        # request could first have been answered (the first text arrived)
+        self.since = time.monotonic()
+
+    def launch(self) -> "Attempt[T]":
+        self.since = time.monotonic()
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def result(self) -> T:
+        assert self.task is not None
+        return self.task.result()
+
+    def discard_later(self) -> None:
+        """
+        Give it up in the background: closing a stalled provider can wait on
+        that same provider (a websocket close handshake), and the request
+        has already moved on.
+        """
+        task = asyncio.create_task(self.discard())
+        _discarding.add(task)
+        task.add_done_callback(_discarding.discard)
+
+    async def discard(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        try:
+            await self._discard()
+        except Exception as e:
+            logger.debug(f"{self.health.name}: error giving up a request: {e!r}")
+
+
+async def hedge(primary: Attempt[T], secondary: Optional[Attempt[T]], budget: float,
+                ready: Optional[asyncio.Event] = None) -> Attempt[T]:
+    """
+    Race `primary` against `secondary` (if there is one, and its breaker
+    lets it), started once `primary` has taken `budget` seconds, counted from
+    `ready` being set if given. Returns the attempt that responded first,
+    having discarded the other; raises the last error if they both failed.
+    """
+    primary.launch()
+    assert primary.task is not None
+
+    try:
+        if ready is not None and not ready.is_set():
+            waiter = asyncio.create_task(ready.wait())
+            await asyncio.wait([primary.task, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            primary.since = time.monotonic()
+
+        await asyncio.wait([primary.task], timeout=budget)
+
+    except asyncio.CancelledError:
+        await primary.discard()
+        raise
+
+    if primary.task.done() and primary.task.exception() is None:
+        primary.health.success(time.monotonic() - primary.since)
+        return primary
+
+    running = [primary]
+    if primary.task.done():
+        primary.health.failure(f"failed: {primary.task.exception()!r}")
+        running = []
+
+    if secondary is not None and secondary.health.breaker.allow():
+        running.append(secondary.launch())
+    elif not running:
+        # nothing to fall back to
+        raise primary.task.exception()  # type: ignore[misc]
+
+    error: Optional[BaseException] = primary.task.exception() if primary.task.done() else None
+    try:
+        while running:
+            done, _ = await asyncio.wait([a.task for a in running], return_when=asyncio.FIRST_COMPLETED)  # type: ignore[misc]
+
+            for attempt in [a for a in running if a.task in done]:
+                running.remove(attempt)
+                assert attempt.task is not None
+
+                if attempt.task.exception() is not None:
+                    error = attempt.task.exception()
+                    attempt.health.failure(f"failed: {error!r}")
+                    continue
+
+                attempt.health.success(time.monotonic() - attempt.since)
+                if secondary is not None and secondary.task is not None:
+                    winner = "primary" if attempt is primary else "secondary"
+                    Metrics.counter(
+                        "hedges_total", "requests that started a second provider, by which one responded first",
+                        {"kind": attempt.health.kind, "winner": winner}
+                    ).inc()
+
+                for loser in running:
+                    if loser is primary:
+                        loser.health.failure(f"slower than {attempt.health.name}")
+                    loser.discard_later()
+                return attempt
+
+    except asyncio.CancelledError:
+        for attempt in running:
+            await attempt.discard()
+        raise
+
+    assert error is not None
+    raise error
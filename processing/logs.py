@@ -0,0 +1,150 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, TextIO
+
+from const import AppConfig
+from processing.metrics import Metrics
+
+
+# ------------------------------------------------------------------------------ #
+# Logging off the event loop. Records are put on a bounded queue by the
+# handler (which never blocks: when the queue is full, the record is dropped
+# and counted), and written out as JSON lines by a listener thread. Every
+# record carries the call and turn it was logged from, set in context vars
+# by the websocket handler, so they follow the call into the tasks it starts.
+# ------------------------------------------------------------------------------ #
+
+
+call_id: ContextVar[Optional[str]] = ContextVar("call_id", default=None)
+turn_id: ContextVar[Optional[int]] = ContextVar("turn_id", default=None)
+
+_dropped = Metrics.counter("log_records_dropped_total", "log records dropped because the log queue was full")
+
+# everything a LogRecord has before `extra` is added to it (and uvicorn's coloured copy of the message)
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "color_message"}
+
+
+class JSONFormatter(logging.Formatter):
+    """ one JSON object per line, with the call, the turn and any `extra` fields """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and value is not None:
+                line[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line["exc"] = record.exc_text
+
+        return json.dumps(line, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """ a QueueHandler that drops (and counts) records rather than wait for room """
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__(queue.Queue(capacity))
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Add the call and turn, on the thread that logged the record. The
+        message and its args are left for the listener's formatter, only the
+        traceback is rendered here (the frames it holds may not outlive us).
+        """
+        record = copy.copy(record)
+        record.call = call_id.get()
+        record.turn = turn_id.get()
+
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            _dropped.inc()
+
+
+class LogPipeline:
+    """ the queue handler, and the thread writing out what it queues """
+
+    def __init__(self, stream: TextIO = sys.stderr, capacity: int = AppConfig.LOG_QUEUE_SIZE) -> None:
+        self.stream = stream
+        self.capacity = capacity
+
+        self.output = logging.StreamHandler(stream)
+        self.output.setFormatter(JSONFormatter())
+
+        self.handler = DroppingQueueHandler(capacity)
+        self.listener: Optional[QueueListener] = None
+        self.start()
+
+        # the listener thread does not survive a fork (the workers), start another
+        os.register_at_fork(after_in_child=self._restart)
+        atexit.register(self.stop)
+
+    def start(self) -> None:
+        self.listener = QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """ write out what is queued, and stop the thread """
+        if self.listener is not None:
+            try:
+                self.listener.stop()
+            except queue.Full:
+                pass
+            self.listener = None
+
+    def _restart(self) -> None:
+        # the parent's queue (and its locks) may have been mid use
+        self.handler.queue = queue.Queue(self.capacity)
+        self.listener = None
+        self.start()
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def queue_handler(stream: str = "stderr", capacity: Optional[int] = None) -> logging.Handler:
+    """
+    The handler to log through (one per process, however often it is asked
+    for), as a factory for logging.config, see log_conf.yaml.
+    """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = LogPipeline(
+            stream=sys.stdout if stream == "stdout" else sys.stderr,
+            capacity=capacity or AppConfig.LOG_QUEUE_SIZE,
+        )
+    return _pipeline.handler
+
+
+def flush(timeout: float = 1) -> None:
+    """ wait (a little) for the queued records to be written out """
+    if _pipeline is None:
+        return
+
+    deadline = time.monotonic() + timeout
+    while not _pipeline.handler.queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
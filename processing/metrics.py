@@ -0,0 +1,168 @@
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+
+# default buckets (seconds) sized for voice latencies, 5ms up to 10s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+
+
+def _labels(labels: dict[str, str], extra: Optional[dict[str, str]] = None) -> str:
+    merged = {**labels, **(extra or {})}
+    if not merged:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(merged.items()))
+    return "{" + inner + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, labels: dict[str, str]) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        yield self.name, _labels(self.labels), self.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class Histogram:
+    """
+    A fixed bucket histogram. Observing is a bisect and two additions, so it
+    is cheap enough to sit on the audio path.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: dict[str, str], buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", _labels(self.labels, {"le": str(bound)}), cumulative
+
+        yield f"{self.name}_bucket", _labels(self.labels, {"le": "+Inf"}), self.count
+        yield f"{self.name}_sum", _labels(self.labels), self.sum
+        yield f"{self.name}_count", _labels(self.labels), self.count
+
+
+class Registry:
+    """
+    Every metric of the process, rendered in the Prometheus text format.
+
+    Components either keep a metric and update it as things happen, or
+    register a collector that is called at scrape time (for stats they
+    already keep themselves, like the connection pools).
+    """
+
+    PREFIX = "televoice_"
+
+    def __init__(self) -> None:
+        self._metrics: dict[tuple[str, tuple], Counter | Histogram] = {}
+        self._help: dict[str, tuple[str, str]] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def _get(self, cls, name: str, help: str, labels: Optional[dict[str, str]], **kwargs):
+        name = self.PREFIX + name
+        labels = labels or {}
+        key = (name, tuple(sorted(labels.items())))
+
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = cls(name, labels, **kwargs)
+            self._help.setdefault(name, (cls.kind, help))
+
+        return metric
+
+    def counter(self, name: str, help: str, labels: Optional[dict[str, str]] = None) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Optional[dict[str, str]] = None) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Optional[dict[str, str]] = None,
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def collector(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """ register `fn` to refresh gauges right before each scrape """
+        self._collectors.append(fn)
+        return fn
+
+    def families(self) -> dict[str, dict]:
+        """ every sample, by metric name, as plain data that can be stored and merged """
+        for collect in self._collectors:
+            collect()
+
+        families: dict[str, dict] = {}
+        for (name, _), metric in sorted(self._metrics.items(), key=lambda item: item[0]):
+            if name not in families:
+                kind, help = self._help[name]
+                families[name] = {"kind": kind, "help": help, "samples": {}}
+
+            for sample, labels, value in metric.samples():
+                families[name]["samples"][sample + labels] = value
+
+        return families
+
+    def render(self) -> str:
+        return render(self.families())
+
+
+def render(families: dict[str, dict]) -> str:
+    """ metric families in the Prometheus text format """
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for sample, value in family["samples"].items():
+            lines.append(f"{sample} {value!r}")
+
+    return "\n".join(lines) + "\n"
+
+
+def merge(snapshots: Iterable[dict[str, dict]], kinds: Optional[set[str]] = None) -> dict[str, dict]:
+    """
+    Add up the metric families of several processes, series by series (or
+    only the families of the given `kinds`). Counters and histograms sum to
+    the whole host's; gauges sum to its total, which is what the gauges here
+    (calls, connections, bytes) mean.
+    """
+    merged: dict[str, dict] = {}
+    for families in snapshots:
+        for name, family in families.items():
+            if kinds is not None and family["kind"] not in kinds:
+                continue
+
+            into = merged.setdefault(name, {"kind": family["kind"], "help": family["help"], "samples": {}})
+            for sample, value in family["samples"].items():
+                into["samples"][sample] = into["samples"].get(sample, 0) + value
+
+    return dict(sorted(merged.items()))
+
+
+Metrics = Registry()
@@ -0,0 +1,175 @@
+import asyncio
+import time
+from collections import deque
+from logging import getLogger
+from typing import Awaitable, Callable, Deque, Generic, Optional, TypeVar
+
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class PoolMetrics:
+    """ counters for a single pool """
+
+    def __init__(self) -> None:
+        self.hits = 0          # acquire served by a warm connection
+        self.misses = 0        # acquire had to connect on the spot
+        self.evictions = 0     # idle or unhealthy connections thrown away
+        self.failures = 0      # connect attempts that raised
+        self.connects = 0      # successful connects, warm or on the spot
+        self.connect_time = 0.0  # total seconds spent connecting
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def mean_connect_time(self) -> float:
+        return self.connect_time / self.connects if self.connects else 0.0
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "failures": self.failures,
+            "connects": self.connects,
+            "connect_time": self.connect_time,
+            "hit_rate": self.hit_rate,
+            "mean_connect_time": self.mean_connect_time,
+        }
+
+
+class ConnectionPool(Generic[T]):
+    """
+    Keeps `size` connections open and ready, so a turn does not pay for the
+    TLS and protocol handshake on the critical path.
+
+    A background task evicts connections that have been idle longer than
+    `max_idle` (providers close idle sockets on their side) or fail the
+    `health_check`, and tops the pool back up. Connections that can only be
+    used once (an ElevenLabs input stream) are simply never released.
+    """
+
+    def __init__(self,
+                 name: str,
+                 connect: Callable[[], Awaitable[T]],
+                 close: Callable[[T], Awaitable[None]],
+                 size: int = 1,
+                 max_idle: float = 60,
+                 health_check: Optional[Callable[[T], bool]] = None,
+                 interval: float = 1,
+                 ) -> None:
+        self.name = name
+        self.size = size
+        self.max_idle = max_idle
+        self.interval = interval
+        self.metrics = PoolMetrics()
+
+        self._connect = connect
+        self._close = close
+        self._health_check = health_check
+        self._idle: Deque[tuple[T, float]] = deque()
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _healthy(self, conn: T, since: float) -> bool:
+        if time.monotonic() - since > self.max_idle:
+            return False
+        return self._health_check is None or self._health_check(conn)
+
+    async def _timed_connect(self) -> T:
+        started = time.monotonic()
+        try:
+            conn = await self._connect()
+        except Exception:
+            self.metrics.failures += 1
+            raise
+
+        self.metrics.connects += 1
+        self.metrics.connect_time += time.monotonic() - started
+        return conn
+
+    async def _discard(self, conn: T) -> None:
+        self.metrics.evictions += 1
+        try:
+            await self._close(conn)
+        except Exception as e:
+            logger.debug(f"{self.name}: error closing evicted connection: {e}")
+
+    async def acquire(self) -> T:
+        """ take a warm connection if there is one, otherwise open a new one """
+        while self._idle:
+            conn, since = self._idle.pop()
+            if self._healthy(conn, since):
+                self.metrics.hits += 1
+                self._wakeup.set()
+                return conn
+
+            await self._discard(conn)
+
+        self.metrics.misses += 1
+        self._wakeup.set()
+        return await self._timed_connect()
+
+    def release(self, conn: T) -> None:
+        """ hand a reusable connection back to the pool """
+        if len(self._idle) < self.size:
+            self._idle.append((conn, time.monotonic()))
+        else:
+            asyncio.create_task(self._discard(conn))
+
+    async def _fill_one(self) -> None:
+        try:
+            conn = await self._timed_connect()
+        except Exception as e:
+            logger.warning(f"{self.name}: failed to pre-open connection: {e}")
+            return
+        finally:
+            self._pending -= 1
+
+        self.release(conn)
+
+    async def _maintain(self) -> None:
+        while True:
+            # evict anything that has gone stale, oldest first
+            for _ in range(len(self._idle)):
+                conn, since = self._idle.popleft()
+                if self._healthy(conn, since):
+                    self._idle.append((conn, since))
+                else:
+                    await self._discard(conn)
+
+            # and top the pool back up
+            missing = self.size - len(self._idle) - self._pending
+            if missing > 0:
+                self._pending += missing
+                await asyncio.gather(*(self._fill_one() for _ in range(missing)))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> "ConnectionPool[T]":
+        """ start pre-opening connections, must be called from a running loop """
+        if self._task is None and self.size > 0:
+            self._task = asyncio.create_task(self._maintain())
+        return self
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        while self._idle:
+            conn, _ = self._idle.pop()
+            await self._discard(conn)
+
+        logger.info(f"{self.name}: {self.metrics.as_dict()}")
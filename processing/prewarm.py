@@ -0,0 +1,139 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Optional
+
+from processing.metrics import Metrics
+
+
+logger = getLogger(__name__)
+
+_sessions = {
+    result: Metrics.counter("prewarm_sessions_total", "warmed up calls, by what became of them", {"result": result})
+    for result in ("claimed", "expired", "released", "failed")
+}
+_warm_seconds = Metrics.histogram("prewarm_seconds", "time taken to warm up a call")
+_claim_wait = Metrics.histogram("prewarm_claim_wait_seconds", "time the websocket waited for its warm-up to finish")
+
+
+class WarmCall:
+    """
+    The providers opened for a call while it was being answered.
+
+    Whatever the warm-up function manages to set here (an open speech-to-text
+    stream, a prepared text-to-speech instance, the greeting's audio) is
+    handed to the websocket handler; anything left as None is created cold.
+    """
+
+    def __init__(self, call_id: str) -> None:
+        self.call_id = call_id
+        self.created = time.monotonic()
+
+        self.stt: Any = None
+        self.tts: Any = None
+        self.gpt: Any = None
+        self.greeting: Optional[list[bytes]] = None
+
+        self.task: Optional[asyncio.Task] = None
+
+    async def close(self) -> None:
+        """ release what was opened, the call never showed up """
+        for provider in (self.stt, self.tts):
+            if provider is not None:
+                try:
+                    await provider.close()
+                except Exception as e:
+                    logger.debug(f"{self.call_id}: error closing warm provider: {e!r}")
+
+
+class Prewarmer:
+    """
+    Warms up calls between the answer webhook and the websocket connecting,
+    keyed by the call's uuid.
+
+    `start` runs `warm(call)` in the background and returns at once, so the
+    NCCO is not held up. `claim` hands the call to its websocket, waiting for
+    the warm-up to finish if it is still going (it is doing work the call
+    would otherwise do cold). Calls not claimed within `timeout` seconds
+    are closed, as are calls `released(call_id)` says were connected
+    somewhere else (another worker).
+    """
+
+    def __init__(self, warm: Callable[[WarmCall], Awaitable[None]], timeout: float,
+                 released: Optional[Callable[[str], bool]] = None) -> None:
+        self.warm = warm
+        self.timeout = timeout
+        self.released = released
+        self._calls: dict[str, WarmCall] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def _run(self, call: WarmCall) -> None:
+        started = time.monotonic()
+        await self.warm(call)
+        _warm_seconds.observe(time.monotonic() - started)
+
+    def start(self, call_id: str) -> None:
+        if call_id in self._calls:
+            return
+
+        call = self._calls[call_id] = WarmCall(call_id)
+        call.task = asyncio.create_task(self._run(call))
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def claim(self, call_id: Optional[str]) -> Optional[WarmCall]:
+        """ the warmed up call, or None if there is none (or it failed) """
+        call = self._calls.pop(call_id, None) if call_id else None
+        if call is None:
+            return None
+
+        started = time.monotonic()
+        try:
+            assert call.task is not None
+            await call.task
+        except Exception as e:
+            logger.warning(f"{call_id}: warm-up failed, starting cold: {e!r}")
+            _sessions["failed"].inc()
+            await call.close()
+            return None
+
+        _claim_wait.observe(time.monotonic() - started)
+        _sessions["claimed"].inc()
+        return call
+
+    async def _expire(self, call: WarmCall) -> None:
+        if call.task is not None:
+            call.task.cancel()
+            await asyncio.gather(call.task, return_exceptions=True)
+        await call.close()
+
+    async def _reap(self) -> None:
+        """ close calls that were answered but never connected """
+        while self._calls:
+            await asyncio.sleep(self.timeout / 4)
+
+            now = time.monotonic()
+            for call_id, call in list(self._calls.items()):
+                if now - call.created > self.timeout:
+                    result, why = "expired", "the websocket never connected"
+                elif self.released is not None and self.released(call_id):
+                    result, why = "released", "the websocket connected to another worker"
+                else:
+                    continue
+
+                # it may have been claimed while we were closing another
+                if self._calls.pop(call_id, None) is not call:
+                    continue
+
+                _sessions[result].inc()
+                logger.info(f"{call_id}: warm-up {result}, {why}")
+                await self._expire(call)
+
+    async def close(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+        calls, self._calls = list(self._calls.values()), {}
+        for call in calls:
+            await self._expire(call)
@@ -0,0 +1,63 @@
+import importlib
+from functools import lru_cache
+from typing import Any
+
+from const import AppConfig
+
+
+# ------------------------------------------------------------------------------ #
+# Every provider the app can use, by kind and name, as "module:class". Each one
+# pulls in its vendor's SDK, so nothing is imported until it is asked for: the
+# app only ever pays for the providers selected in AppConfig.
+# ------------------------------------------------------------------------------ #
+
+
+PROVIDERS: dict[str, dict[str, str]] = {
+    "telephony": {
+        "vonage": "processing.telephony.vonage:VonageTel",
+    },
+    "stt": {
+        "deepgram": "processing.speechtotext.deepgram:DeepgramSTT",
+    },
+    "tts": {
+        "elevenlabs": "processing.texttospeech.elevenlabs:ElevenLabsTTS",
+        "playht": "processing.texttospeech.pyht:PlayHTTTS",
+        # OpenAITTS (texttospeech/openai.py) is unfinished, register it once it speaks
+    },
+    "gpt": {
+        "openai": "processing.generate_response.open_ai:OpenAIGPT",
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def load(kind: str, name: str) -> Any:
+    """ the provider class registered as `name`, importing its module """
+    try:
+        path = PROVIDERS[kind][name]
+    except KeyError:
+        raise ValueError(f"Unknown {kind} provider {name!r}, expected one of {list(PROVIDERS.get(kind, {}))}")
+
+    module, _, cls = path.partition(":")
+    return getattr(importlib.import_module(module), cls)
+
+
+def selected() -> dict[str, Any]:
+    """ the provider class of each kind (and fallback), as selected in AppConfig """
+    chosen = {
+        "telephony": load("telephony", AppConfig.TELEPHONY),
+        "stt": load("stt", AppConfig.STT),
+        "tts": load("tts", AppConfig.TTS),
+        "gpt": load("gpt", AppConfig.GPT),
+    }
+    if AppConfig.STT_FALLBACK:
+        chosen["stt_fallback"] = load("stt", AppConfig.STT_FALLBACK)
+    if AppConfig.TTS_FALLBACK:
+        chosen["tts_fallback"] = load("tts", AppConfig.TTS_FALLBACK)
+    return chosen
+
+
+def tts_classes() -> list[Any]:
+    """ the text-to-speech providers in use, the fallback too if there is one """
+    names = dict.fromkeys(name for name in (AppConfig.TTS, AppConfig.TTS_FALLBACK) if name)
+    return [load("tts", name) for name in names]
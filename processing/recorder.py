@@ -0,0 +1,237 @@
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+from logging import getLogger
+from typing import Any, AsyncGenerator, AsyncIterator, Iterator, Optional
+
+from const import AppConfig, StreamingConfig
+
+
+logger = getLogger(__name__)
+
+# call ids come from the client (vonage's uuid), anything else is hashed
+_SAFE_ID = re.compile(r"[A-Za-z0-9-]{1,64}")
+
+
+# ------------------------------------------------------------------------------ #
+# Call recordings, to reproduce a bad call. With AppConfig.RECORD_DIR set,
+# each call gets a directory of its own holding:
+#
+#   inbound.pcm    the caller's audio, as it came off the websocket
+#   outbound.pcm   the bot's audio, as it was sent out
+#   events.jsonl   what the speech-to-text heard and the model replied
+#   index.json     the audio format, and when each turn (and stretch of bot
+#                  audio) happened, written when the call ends
+#
+# Both tracks are raw audio in the call's format. Every event carries `t`,
+# seconds since the call started, and `audio`, seconds of caller audio
+# received by then, which is where it happened on the inbound track.
+# ------------------------------------------------------------------------------ #
+
+
+class Track:
+    """
+    An append-only PCM file, written through a memory map that grows GROW
+    bytes at a time. A frame goes straight into the map (the page cache):
+    nothing is copied, buffered or grown per frame.
+    """
+    GROW = StreamingConfig.calculate_buffer_size(30)
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.size = 0
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._capacity = 0
+        self._map: Optional[mmap.mmap] = None
+        self._grow()
+
+    def _grow(self) -> None:
+        # remapped rather than resized, mmap.resize needs mremap (linux only)
+        if self._map is not None:
+            self._map.close()
+
+        self._capacity += self.GROW
+        os.ftruncate(self._fd, self._capacity)
+        self._map = mmap.mmap(self._fd, self._capacity)
+        self._map.seek(self.size)
+
+    def write(self, frame: bytes) -> None:
+        if self.size + len(frame) > self._capacity:
+            self._grow()
+        self._map.write(frame)  # type: ignore[union-attr]
+        self.size += len(frame)
+
+    def close(self) -> None:
+        if self._map is None:
+            return
+
+        self._map.close()
+        self._map = None
+        os.ftruncate(self._fd, self.size)
+        os.close(self._fd)
+
+
+class CallRecorder:
+    """ records one call, see above """
+
+    def __init__(self, path: str, call_id: str) -> None:
+        self.path = path
+        self.call_id = call_id
+
+        # always a new directory, so `close` only ever removes its own
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.mkdir(path)
+
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.bytes_per_second = StreamingConfig.calculate_buffer_size(1)
+
+        self.inbound = Track(os.path.join(path, "inbound.pcm"))
+        self.outbound = Track(os.path.join(path, "outbound.pcm"))
+
+        # [t, offset] for every stretch of bot audio, so it can be lined up
+        self.segments: list[tuple[float, int]] = []
+        self._last_sent: Optional[float] = None
+
+        # one entry per turn, the times (t) things happened in it
+        self.turns: list[dict[str, Any]] = []
+
+        self._events = open(os.path.join(path, "events.jsonl"), "w", buffering=1 << 16)
+
+    @classmethod
+    def create(cls, call_id: str) -> "CallRecorder":
+        assert AppConfig.RECORD_DIR is not None
+        root = os.path.realpath(AppConfig.RECORD_DIR)
+        name = call_id if _SAFE_ID.fullmatch(call_id) else hashlib.sha256(call_id.encode()).hexdigest()[:32]
+
+        # the same call can connect more than once, keep every recording
+        for attempt in itertools.count(1):
+            path = os.path.join(root, name if attempt == 1 else f"{name}-{attempt}")
+            if os.path.dirname(os.path.realpath(path)) != root:
+                raise ValueError(f"recording for {call_id!r} would not be under {root}")
+            try:
+                return cls(path, call_id)
+            except FileExistsError:
+                continue
+        raise AssertionError("unreachable")
+
+    def now(self) -> float:
+        return round(time.monotonic() - self.started, 3)
+
+    def position(self) -> float:
+        """ seconds of the caller's audio so far """
+        return round(self.inbound.size / self.bytes_per_second, 3)
+
+    async def tee(self, audio: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+        """ pass the caller's audio through, recording it """
+        async for frame in audio:
+            self.inbound.write(frame)
+            yield frame
+
+    def sent(self, frame: bytes) -> None:
+        """ a frame of the bot's audio went out """
+        now = time.monotonic()
+        if self._last_sent is None or now - self._last_sent > 2 * StreamingConfig.BUFFER_DURATION:
+            self.segments.append((self.now(), self.outbound.size))
+        self._last_sent = now
+        self.outbound.write(frame)
+
+    def event(self, name: str, **fields: Any) -> None:
+        if self._events.closed:
+            # a cancelled turn winding down after the call ended
+            return
+        fields.update(event=name, t=self.now(), audio=self.position())
+        self._events.write(json.dumps(fields) + "\n")
+
+    def turn(self, number: int) -> None:
+        self.turns.append({"turn": number, "start": self.now(), "audio": self.position()})
+        self.event("turn", turn=number)
+
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        """ when (time.monotonic, now by default) something first happened in the current turn """
+        if self.turns and name not in self.turns[-1]:
+            self.turns[-1][name] = self.now() if at is None else round(at - self.started, 3)
+
+    async def reply(self, tokens: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """ pass the bot's reply through, recording it """
+        text = ""
+        try:
+            async for token in tokens:
+                self.mark("first_token")
+                text += token
+                yield token
+        finally:
+            await tokens.aclose()
+            self.event("reply", text=text)
+
+    def close(self) -> None:
+        self.inbound.close()
+        self.outbound.close()
+        self._events.close()
+
+        if self.inbound.size == 0:
+            # never got any audio (a health check, say), nothing to replay
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+
+        index = {
+            "call_id": self.call_id,
+            "started_at": self.started_at,
+            "duration": self.now(),
+            "format": {
+                "frequency": StreamingConfig.FREQUENCY,
+                "encoding": StreamingConfig.ENCODING,
+                "channels": StreamingConfig.CHANNELS,
+            },
+            "inbound_bytes": self.inbound.size,
+            "outbound_bytes": self.outbound.size,
+            "outbound_segments": self.segments,
+            "turns": self.turns,
+        }
+        with open(os.path.join(self.path, "index.json"), "w") as f:
+            json.dump(index, f, indent=1)
+
+        logger.info(f"Recorded call to {self.path}")
+
+
+class Recording:
+    """ a recorded call, read back (see benchmarks/replay.py) """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.index: dict[str, Any] = json.load(f)
+
+        with open(os.path.join(path, "events.jsonl")) as f:
+            self.events: list[dict[str, Any]] = [json.loads(line) for line in f if line.strip()]
+
+        expected = {
+            "frequency": StreamingConfig.FREQUENCY,
+            "encoding": StreamingConfig.ENCODING,
+            "channels": StreamingConfig.CHANNELS,
+        }
+        if self.index["format"] != expected:
+            raise ValueError(f"{path} was recorded as {self.index['format']}, the app is set up for {expected}")
+
+    @property
+    def turns(self) -> list[dict[str, Any]]:
+        return self.index["turns"]
+
+    def said(self) -> list[str]:
+        """ every final transcript of the caller, in order """
+        return [e["text"] for e in self.events if e["event"] == "final"]
+
+    def inbound(self, frame_size: int = StreamingConfig.CHUNK_SIZE) -> Iterator[bytes]:
+        """ the caller's audio, frame by frame """
+        with open(os.path.join(self.path, "inbound.pcm"), "rb") as f:
+            if self.index["inbound_bytes"] == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as audio:
+                for offset in range(0, len(audio), frame_size):
+                    yield audio[offset:offset + frame_size]
@@ -0,0 +1,329 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Optional
+
+from const import AppConfig, StreamingConfig
+from processing import admission, logs, tracing
+from processing.generate_response import Speculator
+from processing.metrics import Metrics
+from processing.recorder import CallRecorder
+from processing.signals import SignalHandler
+from processing.telephony import OutboundScheduler
+from processing.texttospeech.framebuffer import FrameBuffer
+
+
+logger = getLogger(__name__)
+
+_event_lag = Metrics.histogram("stt_event_lag_seconds", "time speech-to-text events waited to be handled")
+_failures = {
+    task: Metrics.counter("call_task_failures_total", "call tasks (and turns) that failed", {"task": task})
+    for task in ("ingest", "stt", "events", "turns", "turn")
+}
+
+
+class CallSession:
+    """
+    One call, as a handful of tasks joined by bounded queues:
+
+        ingest  the caller's audio, off the websocket into `audio`
+        stt     `audio` to the speech-to-text provider, whose callbacks only
+                queue `events`, so its event dispatch never waits on us
+        events  transcripts into the model's pending text, the ends of
+                turns into `turns`, and barge-ins into cancelling the reply
+        turns   one reply at a time: the model, text to speech, into the
+                call's outbound stream
+
+    The outbound stream is paced out by the process wide OutboundScheduler,
+    one frame per tick. `run` lasts until the caller hangs up (the audio
+    ends), then cancels the rest; if any task fails, the call ends and its
+    error is raised from `run`. A failed turn is logged, and the call goes on.
+    """
+
+    def __init__(self,
+                 call_id: str,
+                 audio: AsyncIterator[bytes],
+                 stt: Any,
+                 gpt: Any,
+                 new_tts: Callable[[], Any],
+                 scheduler: OutboundScheduler,
+                 send: Callable[[bytes], Awaitable[None]],
+                 clear: Callable[[], Awaitable[None]],
+                 synthesize: Callable[[str], Awaitable[list[bytes]]],
+                 next_tts: Any = None,
+                 greeting: Optional[list[bytes]] = None,
+                 recorder: Optional[CallRecorder] = None) -> None:
+        self.call_id = call_id
+        self.stt = stt
+        self.gpt = gpt
+        self.new_tts = new_tts
+        self.recorder = recorder
+
+        self._source = recorder.tee(audio) if recorder else audio
+        self._send = send
+        self._clear = clear
+        self._synthesize = synthesize
+
+        # a tts instance prepared for the first turn, and the greeting's audio
+        self._next_tts = next_tts
+        self._greeting = greeting
+
+        # optionally start replies before the caller has finished talking
+        self.speculator = Speculator(gpt) if StreamingConfig.SPECULATE else None
+
+        self.audio: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=StreamingConfig.INBOUND_QUEUE)
+        self.events: asyncio.Queue[tuple[str, float, Any]] = asyncio.Queue(maxsize=StreamingConfig.EVENT_QUEUE)
+        self.turns: asyncio.Queue[tuple[str, float, Any]] = asyncio.Queue(maxsize=1)
+
+        # frames are paced out in real time, one per 20ms
+        self.outbound = scheduler.register(self._send_frame)
+        self._scheduler = scheduler
+
+        self.turn_count = 0
+        self._trace: Optional[tracing.TurnTrace] = None
+
+        # the reply being spoken, if any, and the session's own tasks
+        self._reply: Optional[asyncio.Task] = None
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    # -------------------------------------------------------------------------- #
+    # The tasks
+    # -------------------------------------------------------------------------- #
+
+    async def _ingest(self) -> None:
+        async for frame in self._source:
+            await self.audio.put(frame)
+
+        # the caller hung up (or the app is shutting down)
+        await self.audio.put(None)
+
+    async def _inbound(self) -> AsyncGenerator[bytes, None]:
+        while (frame := await self.audio.get()) is not None:
+            yield frame
+
+    async def _transcribe(self) -> None:
+        async def queue(name: str, value: Any = None) -> None:
+            await self.events.put((name, time.monotonic(), value))
+
+        await self.stt.transcribe(
+            audio=self._inbound(),
+            callback=lambda text: queue("final", text),
+            finish=lambda: queue("end"),
+            interrupt=(lambda: queue("speech")) if StreamingConfig.BARGE_IN else None,
+            interim=(lambda text: queue("interim", text)) if self.speculator else None
+        )
+
+    async def _handle_events(self) -> None:
+        while True:
+            name, at, value = await self.events.get()
+            _event_lag.observe(time.monotonic() - at)
+
+            if name == "final":
+                if self.recorder:
+                    self.recorder.event("final", text=value)
+                await self.gpt.append(value)
+                if self.speculator:
+                    self.speculator.on_final()
+
+            elif name == "interim":
+                if self.speculator:
+                    self.speculator.on_interim(value)
+
+            elif name == "end":
+                # stop listening until the reply has been heard
+                await self.stt.pause()
+                await self.turns.put(("reply", at, self.stt.speech_ended_at))
+
+                # anything started from here on (a speculative reply) is for a later turn
+                admission.priority.set(admission.LATER_TURN)
+
+            elif name == "speech":
+                await self._barge_in()
+
+    async def _take_turns(self) -> None:
+        if AppConfig.GREETING:
+            await self._run_turn(self._greet(AppConfig.GREETING))
+
+        while True:
+            _, at, speech_end = await self.turns.get()
+            self._start_turn(at, speech_end)
+            await self._run_turn(self._respond())
+
+    async def _run_turn(self, reply: Awaitable[None]) -> None:
+        """ run a turn as a task of its own, that a barge-in can cancel """
+        task = self._reply = asyncio.ensure_future(reply)
+
+        # (waited on, not awaited: cancelling the session leaves it to `close`)
+        await asyncio.wait([task])
+        self._reply = None
+
+        if not task.cancelled() and (error := task.exception()) is not None:
+            _failures["turn"].inc()
+            logger.error(f"Turn failed: {error!r}", exc_info=error)
+
+    # -------------------------------------------------------------------------- #
+    # Turns
+    # -------------------------------------------------------------------------- #
+
+    def _start_turn(self, at: float, speech_end: Optional[float]) -> None:
+        self.turn_count += 1
+        logs.turn_id.set(self.turn_count)
+
+        # a caller's first reply goes ahead of everyone else's later ones
+        admission.priority.set(admission.FIRST_TURN if self.turn_count == 1 else admission.LATER_TURN)
+
+        if self.recorder:
+            self.recorder.turn(self.turn_count)
+            if speech_end is not None:
+                self.recorder.mark("speech_end", speech_end)
+
+        self._trace = tracing.start_turn()
+        if self._trace is not None:
+            self._trace.mark("utterance_end", at)
+            if speech_end is not None:
+                self._trace.mark("speech_end", speech_end)
+
+        # everything the turn awaits (gpt, tts) marks its spans on this trace
+        tracing.current_turn.set(self._trace)
+
+    async def _play(self, media: AsyncIterator[bytes]) -> None:
+        """ send audio to the caller, and wait until they have heard it all """
+        # providers send audio in whatever sizes they like
+        frames = FrameBuffer()
+        async for chunk in media:
+            for frame in frames.feed(chunk):
+                await self.outbound.put(frame)
+
+        if tail := frames.flush():
+            await self.outbound.put(tail)
+
+        await self.outbound.drain()
+
+    async def _respond(self) -> None:
+        tts, self._next_tts = self._next_tts or self.new_tts(), None
+        outcome = "failed"
+
+        try:
+            # generate response & reset transcript (unless we already started)
+            response_stream = self.speculator.commit() if self.speculator else None
+            if response_stream is None:
+                response_stream = self.gpt.generate()
+            if self.recorder:
+                response_stream = self.recorder.reply(response_stream)
+
+            # don't start listening again until the caller has heard it all
+            await self._play(await tts.speak_stream(response_stream))
+            if self.recorder:
+                self.recorder.mark("done")
+            outcome = "done"
+
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+
+        finally:
+            # slow and broken turns are the ones worth seeing, trace them all
+            if self._trace is not None:
+                self._trace.finish(outcome)
+            await tts.close()
+            await self.stt.resume()
+
+    async def _greet(self, text: str) -> None:
+        """ say the greeting, as a turn of its own, so the caller can talk over it """
+        try:
+            frames = self._greeting or await self._synthesize(text)
+        except Exception as e:
+            logger.warning(f"could not synthesize the greeting, skipping it: {e!r}")
+            return
+
+        # the socket has to be open before the stream can be paused
+        await self.stt.opened.wait()
+        await self.stt.pause()
+        self.gpt.history.add("assistant", text)
+        if self.recorder:
+            self.recorder.event("greeting", text=text)
+
+        async def media():
+            for frame in frames:
+                yield frame
+
+        try:
+            await self._play(media())
+        finally:
+            await self.stt.resume()
+
+    async def _barge_in(self) -> None:
+        """ the caller talked over the bot, stop generating and speaking """
+        if self._reply is None or self._reply.done():
+            return
+
+        self._reply.cancel()
+        self.outbound.clear()
+        if self.recorder:
+            self.recorder.event("barge_in")
+            self.recorder.mark("barge_in")
+        await self._clear()
+        logger.info("Caller barged in, turn cancelled")
+
+    async def _send_frame(self, frame: bytes) -> None:
+        await self._send(frame)
+
+        if self.recorder:
+            self.recorder.sent(frame)
+            self.recorder.mark("first_frame")
+
+        if self._trace is not None:
+            self._trace.mark("first_frame")
+            self._trace.marks["last_frame"] = time.monotonic()
+
+    # -------------------------------------------------------------------------- #
+    # Running the call
+    # -------------------------------------------------------------------------- #
+
+    async def run(self) -> None:
+        """ until the caller hangs up, raising the error of any task that fails """
+        logs.call_id.set(self.call_id)
+
+        self._tasks = {
+            "ingest": asyncio.create_task(self._ingest()),
+            "stt": asyncio.create_task(self._transcribe()),
+            "events": asyncio.create_task(self._handle_events()),
+            "turns": asyncio.create_task(self._take_turns()),
+        }
+
+        pending = set(self._tasks.values())
+        try:
+            # the transcription ends once the caller's audio has
+            while self._tasks["stt"] in pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for name, task in self._tasks.items():
+                    if task in done and not task.cancelled() and task.exception() is not None:
+                        _failures[name].inc()
+                        logger.error(f"Call {name} task failed, ending the call")
+                        raise task.exception()  # type: ignore[misc]
+
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        reply = self._reply
+        if reply is not None and not reply.done() and not SignalHandler.KEEP_RUNNING:
+            # the call is being ended by a shutdown, not by the caller
+            # hanging up: let the bot finish what it is saying
+            await asyncio.wait([reply], timeout=AppConfig.DRAIN_TURN_TIMEOUT)
+
+        tasks = [*self._tasks.values(), *([reply] if reply is not None else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._next_tts is not None:
+            await self._next_tts.close()
+
+        self._scheduler.unregister(self.outbound)
+
+        if self.speculator:
+            self.speculator.discard()
+
+        if self.recorder:
+            self.recorder.close()
@@ -1,15 +1,67 @@
+import asyncio
 import signal
+import time
+from logging import getLogger
+from typing import Optional
+
+
+logger = getLogger(__name__)
 
 
 class _SignalHandler:
+    """
+    Whether the process is shutting down, and the calls it is waiting on.
+
+    The first SIGTERM (or SIGINT) starts a drain: DRAINING goes True, new
+    calls are turned away, and the calls in progress carry on. KEEP_RUNNING
+    only goes False, which ends the calls still connected (once the bot has
+    finished what it is saying), when the drain deadline passes or a second
+    signal arrives.
+
+    Under uvicorn the signals go to `DrainingServer`, which drives the same
+    state; the handlers here cover running the processing modules on their own.
+    """
     KEEP_RUNNING = True
+    DRAINING = False
 
     def __init__(self):
+        # the calls in progress, by id, with when they started
+        self.sessions: dict[str, float] = {}
+
         signal.signal(signal.SIGINT, self.exit_gracefully)
         signal.signal(signal.SIGTERM, self.exit_gracefully)
 
     def exit_gracefully(self, signum, frame):
+        if self.DRAINING:
+            self.stop()
+        else:
+            self.drain()
+
+    def drain(self):
+        """ stop taking new calls """
+        if not self.DRAINING:
+            self.DRAINING = True
+            logger.info(f"Draining, {len(self.sessions)} calls in progress")
+
+    def stop(self):
+        """ end the calls still in progress """
+        self.DRAINING = True
         self.KEEP_RUNNING = False
 
+    def open(self, session: str) -> None:
+        self.sessions[session] = time.monotonic()
+
+    def close(self, session: str) -> None:
+        self.sessions.pop(session, None)
+
+    async def drained(self, timeout: Optional[float] = None) -> bool:
+        """ wait for the calls in progress to end, returning whether they all did """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.sessions:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
 
 SignalHandler = _SignalHandler()
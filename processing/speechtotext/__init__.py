@@ -1,2 +1,15 @@
-from .deepgram import DeepgramSTT
-__all__ = ["DeepgramSTT"]
+from importlib import import_module
+
+from .hedged import HedgedSTT
+
+# providers are imported on first use, each one pulls in its vendor's sdk
+_PROVIDERS = {"DeepgramSTT": ".deepgram"}
+
+
+def __getattr__(name: str):
+    if name in _PROVIDERS:
+        return getattr(import_module(_PROVIDERS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["DeepgramSTT", "HedgedSTT"]
@@ -1,14 +1,20 @@
 import asyncio
-from curses import nonl
-from typing import Any, AsyncGenerator, Callable, Coroutine, Optional, Union
+import json
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Callable, Coroutine, Deque, Optional, Union
 
+from processing import admission, codec
+from processing.metrics import Metrics
 from processing.signals import SignalHandler
 from .abstract import SpeechToText
+from .vad import EnergyVAD
 from const import AppConfig, StreamingConfig
 from logging import getLogger
 
 from deepgram import (
     DeepgramClient,
+    DeepgramClientOptions,
     AsyncLiveClient,
     LiveOptions,
     SpeechStartedResponse,
@@ -22,6 +28,8 @@ from deepgram import (
 
 logger = getLogger(__name__)
 
+resume_seconds = Metrics.histogram("stt_resume_seconds", "time taken to start listening again after a turn")
+
 
 class DeepgramSTT(SpeechToText):
     dg: DeepgramClient
@@ -30,11 +38,29 @@ class DeepgramSTT(SpeechToText):
 
     PAUSE: bool = False
 
+    # keep the live socket open between turns, instead of finish()/start()
+    KEEPALIVE: bool = StreamingConfig.STT_KEEPALIVE
+
+    # the live api, None for AppConfig.DEEPGRAM_URL (or the real one)
+    URL: Optional[str] = None
+
+    # the deepgram client only holds configuration, share it across calls
+    _shared_client: Optional[DeepgramClient] = None
+
+    @classmethod
+    def get_client(cls) -> DeepgramClient:
+        """ return the process wide client, creating it on first use """
+        if cls._shared_client is None:
+            url = cls.URL or AppConfig.DEEPGRAM_URL
+            config = DeepgramClientOptions(url=url) if url else None
+            cls._shared_client = DeepgramClient(api_key=AppConfig.DEEPGRAM_API_KEY, config=config)
+        return cls._shared_client
+
     @classmethod
     def create(cls) -> "DeepgramSTT":
         self = cls()
 
-        self.dg = DeepgramClient(api_key=AppConfig.DEEPGRAM_API_KEY)
+        self.dg = cls.get_client()
         self.client = self.dg.listen.asynclive.v("1")
 
         self.options = LiveOptions(
@@ -56,45 +82,227 @@ class DeepgramSTT(SpeechToText):
             vad_events=True,
         )
 
+        # audio sent on the current socket, in bytes, and when we last sent anything
+        self._sent = 0
+        self._last_send = time.monotonic()
+
+        # with KEEPALIVE, results for audio that ended before this offset (in
+        # seconds of stream audio) were spoken while the bot was talking
+        self._gate_until = 0.0
+
+        # without KEEPALIVE, caller audio is held here while the socket reconnects
+        self._reconnecting = False
+        self._backlog: Deque[bytes] = deque(
+            maxlen=int(StreamingConfig.STT_RECONNECT_BUFFER / StreamingConfig.BUFFER_DURATION)
+        )
+
+        # seconds it took to start listening again, for each turn
+        self.resume_latencies: list[float] = []
+
+        # where (in seconds of stream audio) the caller started talking over the bot
+        self._barge_in_at: Optional[float] = None
+
+        # local endpointing: the turn can end as soon as the vad hears silence
+        # and deepgram has finalised everything the caller said
+        self.vad: Optional[EnergyVAD] = EnergyVAD() if StreamingConfig.VAD_ENDPOINT else None
+        self._transcript_final = False
+        self._utt_callback: Optional[Callable[[], Any]] = None
+
+        # when (time.monotonic) the caller stopped talking, for the last turn
+        self.speech_ended_at: Optional[float] = None
+
+        # set once the socket is open (see `open`)
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self.opened = asyncio.Event()
+
+        # when this call was given its turn of the stt limiter, held until `close`
+        self._granted: Optional[float] = None
+
         return self
 
-    async def _register_events(self, text_callback: Optional[Callable[[str], Any]] = None, utt_callback: Optional[Callable[[], Any]] = None):
+    def _audio_offset(self) -> float:
+        """ seconds of audio sent on the current socket """
+        return self._sent / StreamingConfig.calculate_buffer_size(1)
+
+    def _gated(self, audio_end: float) -> bool:
+        """ was this audio spoken while the bot was talking? """
+        return self.PAUSE or audio_end <= self._gate_until
+
+    async def _register_events(self,
+                               text_callback: Optional[Callable[[str], Any]] = None,
+                               utt_callback: Optional[Callable[[], Any]] = None,
+                               speech_callback: Optional[Callable[[], Any]] = None,
+                               interim_callback: Optional[Callable[[str], Any]] = None):
         async def on_message(client, result: LiveResultResponse, **kwargs):
             """ when deepgram sends a message """
             nonlocal text_callback
-            if self.PAUSE:
+            if self._gated(result.start + result.duration):
                 return
 
             assert result.channel and result.channel.alternatives
-            if result.channel.alternatives[0].transcript and result.speech_final and text_callback:
-                await text_callback(result.channel.alternatives[0].transcript)
+            transcript = result.channel.alternatives[0].transcript
+            if not transcript:
+                return
+
+            # an interim result means the caller is still mid sentence
+            self._transcript_final = result.speech_final
+
+            # deepgram finalises long speech in segments (is_final), only the
+            # last of which is speech_final, so every final segment counts
+            if result.is_final:
+                if text_callback:
+                    await text_callback(transcript)
+
+                if result.speech_final:
+                    await self._maybe_endpoint()
+
+            elif interim_callback:
+                await interim_callback(transcript)
 
         async def on_utterance(client, utterance_end: UtteranceEndResponse, **kwargs):
             """ when deepgram says an utterance has ended """
             nonlocal utt_callback
-            if self.PAUSE:
+            assert utterance_end
+            if self._gated(utterance_end.last_word_end):
                 return
 
-            assert utterance_end
+            # (an utterance we already ended locally is gated above, since
+            # the turn it started paused us)
+            self._transcript_final = False
+            self.speech_ended_at = time.monotonic() - max(0, self._audio_offset() - utterance_end.last_word_end)
             if utt_callback:
                 await utt_callback()
 
+        async def on_speech_started(client, speech_started: SpeechStartedResponse, **kwargs):
+            """ when deepgram hears the caller start talking """
+            nonlocal speech_callback
+            assert speech_started
+
+            # only interesting while the bot is talking, that's a barge-in
+            if not self.PAUSE or self._barge_in_at is not None:
+                return
+
+            self._barge_in_at = speech_started.timestamp
+            if speech_callback:
+                await speech_callback()
+
         async def on_error(client, error: ErrorResponse, **kwargs):
             """ when deepgram sends an error """
             assert error
-            print(error)
+            logger.error(f"Deepgram error: {error}")
+
+        self._utt_callback = utt_callback
 
         self.client.on(LiveTranscriptionEvents.Transcript, on_message)
         self.client.on(LiveTranscriptionEvents.UtteranceEnd, on_utterance)
+        self.client.on(LiveTranscriptionEvents.SpeechStarted, on_speech_started)
         self.client.on(LiveTranscriptionEvents.Error, on_error)
 
+    async def _maybe_endpoint(self):
+        """ end the turn early, if the caller went quiet and the transcript is final """
+        if self.vad is None or self.PAUSE or not self._transcript_final or not self.vad.endpointed:
+            return
+
+        self._transcript_final = False
+        self.vad.endpointed = False
+        self.speech_ended_at = time.monotonic() - StreamingConfig.VAD_ENDPOINT_MS / 1000
+
+        if self._utt_callback:
+            await self._utt_callback()
+
+    @staticmethod
+    def _linear(data: bytes) -> bytes:
+        """ caller audio as linear16, which is what the vad reads """
+        if StreamingConfig.ENCODING == "linear16":
+            return data
+        return codec.decode(data, StreamingConfig.ENCODING).tobytes()
+
+    async def _send(self, data: bytes):
+        await self.client.send(data)
+        self._sent += len(data)
+        self._last_send = time.monotonic()
+
+    async def _keepalive(self):
+        """ deepgram closes a socket after ~10s without data, so nudge it when audio stalls """
+        interval = StreamingConfig.STT_KEEPALIVE_INTERVAL
+        await self.opened.wait()
+        while True:
+            await asyncio.sleep(max(1, interval - (time.monotonic() - self._last_send)))
+            if time.monotonic() - self._last_send >= interval and not self._reconnecting:
+                await self.client.send(json.dumps({"type": "KeepAlive"}))
+                self._last_send = time.monotonic()
+
+    async def open(self):
+        """
+        Connect to deepgram, ahead of the audio if need be (the call is being
+        answered). The socket is kept alive until `transcribe` starts sending.
+        """
+        if self._keepalive_task is not None:
+            return
+
+        # claimed before the first await, so a concurrent caller doesn't open twice
+        self._keepalive_task = asyncio.create_task(self._keepalive())
+        try:
+            self._granted = await admission.limiter("stt", "deepgram").acquire()
+            await self.client.start(self.options)
+        except BaseException:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+            self._release()
+            raise
+
+        self.opened.set()
+
+    async def close(self):
+        if self._keepalive_task is None:
+            return
+
+        self._keepalive_task.cancel()
+        self._keepalive_task = None
+        self.opened.clear()
+        try:
+            await self.client.finish()
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._granted is not None:
+            admission.limiter("stt", "deepgram").release(self._granted)
+            self._granted = None
+
     async def pause(self):
         self.PAUSE = True
-        await self.client.finish()
+        self._barge_in_at = None
+
+        if not self.KEEPALIVE:
+            self._reconnecting = True
+            await self.client.finish()
 
     async def resume(self):
+        started = time.monotonic()
+
+        if self.KEEPALIVE:
+            # the socket never closed, just ignore what was said over the bot,
+            # unless the caller interrupted it, then keep everything from there
+            if self._barge_in_at is not None:
+                self._gate_until = self._barge_in_at
+            else:
+                self._gate_until = self._audio_offset()
+        else:
+            await self.client.start(self.options)
+            self._sent = 0
+
+            # replay what the caller said while we were reconnecting
+            while self._backlog:
+                await self._send(self._backlog.popleft())
+
+            self._reconnecting = False
+
         self.PAUSE = False
-        await self.client.start(self.options)
+
+        self.resume_latencies.append(time.monotonic() - started)
+        resume_seconds.observe(self.resume_latencies[-1])
+        logger.debug(f"STT resumed in {self.resume_latencies[-1] * 1000:.1f}ms")
 
     async def start(self):
         await self.client.start(self.options)
@@ -103,8 +311,22 @@ class DeepgramSTT(SpeechToText):
     async def transcribe(self,
                          audio: AsyncGenerator[bytes, None],
                          callback: Callable[[str], Any],
-                         finish: Callable[[], Any]
+                         finish: Callable[[], Any],
+                         interrupt: Optional[Callable[[], Any]] = None,
+                         interim: Optional[Callable[[str], Any]] = None
                          ) -> None:
+        """
+        Stream the caller's audio to deepgram.
+
+        Args:
+            audio: the caller's audio.
+            callback: called with each final segment of transcript.
+            finish: called when the caller has finished speaking.
+            interrupt: called when the caller starts talking while paused
+                (barge-in). This needs STT_KEEPALIVE, since audio is only
+                sent while paused when the socket stays open.
+            interim: called with each interim (not yet final) transcript.
+        """
 
         try:
             if self.PAUSE:
@@ -112,17 +334,29 @@ class DeepgramSTT(SpeechToText):
 
             await self._register_events(
                 text_callback=callback,
-                utt_callback=finish
+                utt_callback=finish,
+                speech_callback=interrupt,
+                interim_callback=interim
             )
 
-            await self.client.start(self.options)
+            # already open, if the call was warmed up when it was answered
+            await self.open()
 
             async for c in audio:
                 if not SignalHandler.KEEP_RUNNING:
                     break
-                await self.client.send(c)
 
-            await self.client.finish()
+                if self._reconnecting:
+                    self._backlog.append(c)
+                    continue
+
+                await self._send(c)
+
+                if self.vad is not None and self.vad.process(self._linear(c)) == "end":
+                    await self._maybe_endpoint()
 
         except asyncio.CancelledError:
-            await self.client.finish()
+            pass
+
+        finally:
+            await self.close()
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Optional
+
+from const import AppConfig
+from processing.hedging import Attempt, hedge, health, swapped
+from .abstract import SpeechToText
+
+
+class HedgedSTT(SpeechToText):
+    """
+    Opens the speech-to-text socket with `primary`, and if it has not
+    connected within its budget (AppConfig.HEDGE_STT_BUDGET, or its p95 if
+    that is longer) or fails to, with `secondary` too, keeping whichever
+    connects first for the rest of the call. A provider whose circuit
+    breaker is open is skipped for the other.
+
+    Only the connect is hedged: once the caller's audio is flowing it goes
+    to the one provider, as sending it to two would pay for every call twice.
+    Everything else is passed through to the provider that was kept.
+    """
+
+    def __init__(self, primary: SpeechToText, secondary: SpeechToText,
+                 primary_name: str, secondary_name: str) -> None:
+        self.primary = primary
+        self.secondary = secondary
+        self.primary_health = health("stt", primary_name)
+        self.secondary_health = health("stt", secondary_name)
+
+        # the provider kept for the call, once one has connected
+        self.chosen: Optional[SpeechToText] = None
+        self.opened = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for what this class does not have itself
+        return getattr(self.chosen or self.primary, name)
+
+    def _attempt(self, stt: Any, provider_health) -> Attempt:
+        async def run() -> Any:
+            await stt.open()
+            return stt
+
+        return Attempt(provider_health, run, stt.close)
+
+    async def open(self):
+        async with self._lock:
+            if self.chosen is not None:
+                return
+
+            first = self._attempt(self.primary, self.primary_health)
+            second = self._attempt(self.secondary, self.secondary_health)
+            if swapped(self.primary_health, self.secondary_health):
+                first, second = second, first
+
+            budget = first.health.budget(AppConfig.HEDGE_STT_BUDGET, AppConfig.HEDGE_MAX_BUDGET)
+            self.chosen = (await hedge(first, second, budget)).result
+            self.opened.set()
+
+    async def transcribe(self, audio, *args, **kwargs) -> Any:  # type: ignore[override]
+        await self.open()
+        assert self.chosen is not None
+        return await self.chosen.transcribe(audio, *args, **kwargs)
+
+    async def close(self):
+        if self.chosen is not None:
+            await self.chosen.close()
+        else:
+            await asyncio.gather(self.primary.close(), self.secondary.close(), return_exceptions=True)
+        self.opened.clear()
@@ -0,0 +1,90 @@
+from typing import Optional
+
+import numpy as np
+
+from const import StreamingConfig
+
+
+def frame_energies(pcm: bytes, frame_size: Optional[int] = None) -> np.ndarray:
+    """
+    The energy (in dBFS) of every whole frame of linear16 audio in `pcm`,
+    computed in one pass over a (frames x samples) view of the buffer.
+    """
+    # a frame's worth of samples, whatever the call's encoding, as linear16 bytes
+    frame_size = frame_size or int(StreamingConfig.FREQUENCY * StreamingConfig.BUFFER_DURATION) * 2
+    samples = frame_size // 2
+
+    audio = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+    frames = audio[:len(audio) // samples * samples].reshape(-1, samples)
+
+    power = np.mean(np.square(frames, dtype=np.float64), axis=1)
+    return 10 * np.log10(power / (32768.0 ** 2) + 1e-12)
+
+
+class EnergyVAD:
+    """
+    A small energy based voice activity detector, run on the caller's 20ms
+    frames to spot the end of a turn sooner than the speech-to-text provider.
+
+    A frame counts as speech when it is louder than both `threshold_db` and
+    the tracked noise floor plus `margin_db`. Speech starts after
+    `start_frames` speech frames in a row, and ends (an endpoint) after
+    `endpoint_ms` of silence following speech.
+    """
+
+    def __init__(self,
+                 endpoint_ms: int = StreamingConfig.VAD_ENDPOINT_MS,
+                 threshold_db: float = StreamingConfig.VAD_THRESHOLD_DB,
+                 margin_db: float = 10,
+                 start_frames: int = 3,
+                 noise_decay: float = 0.95,
+                 ) -> None:
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.start_frames = start_frames
+        self.noise_decay = noise_decay
+        self.endpoint_frames = max(1, round(endpoint_ms / 1000 / StreamingConfig.BUFFER_DURATION))
+        self.reset()
+
+    def reset(self) -> None:
+        self.speaking = False
+        self.noise_floor = self.threshold_db - self.margin_db
+        self._speech_run = 0
+        self._silence_run = 0
+
+        # True once the caller has spoken and then gone quiet for endpoint_ms
+        self.endpointed = False
+
+    def update(self, energy_db: float) -> Optional[str]:
+        """
+        Feed the energy of the next frame.
+
+        Returns "start" when speech begins, "end" at an endpoint, otherwise None.
+        """
+        is_speech = energy_db > max(self.threshold_db, self.noise_floor + self.margin_db)
+
+        if is_speech:
+            self._speech_run += 1
+            self._silence_run = 0
+        else:
+            self._speech_run = 0
+            self._silence_run += 1
+            # only learn the noise floor from frames that are not speech
+            self.noise_floor = self.noise_decay * self.noise_floor + (1 - self.noise_decay) * energy_db
+
+        if not self.speaking and self._speech_run >= self.start_frames:
+            self.speaking = True
+            self.endpointed = False
+            return "start"
+
+        if self.speaking and self._silence_run >= self.endpoint_frames:
+            self.speaking = False
+            self.endpointed = True
+            return "end"
+
+        return None
+
+    def process(self, frame: bytes) -> Optional[str]:
+        """ feed one frame of linear16 audio """
+        energies = frame_energies(frame, len(frame))
+        return self.update(float(energies[0])) if len(energies) else None
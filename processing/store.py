@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import time
+from logging import getLogger
+from typing import Optional
+
+from processing.metrics import Registry, merge
+
+
+logger = getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    call_id     TEXT PRIMARY KEY,
+    answered_by INTEGER,
+    worker      INTEGER,
+    state       TEXT NOT NULL,
+    answered    REAL,
+    connected   REAL,
+    ended       REAL
+);
+CREATE INDEX IF NOT EXISTS calls_worker ON calls (worker, state);
+
+CREATE TABLE IF NOT EXISTS workers (
+    pid       INTEGER PRIMARY KEY,
+    started   REAL NOT NULL,
+    published REAL NOT NULL,
+    metrics   TEXT NOT NULL
+);
+"""
+
+# the workers row that holds the counters of workers that have exited
+_RETIRED = 0
+
+
+class SharedStore:
+    """
+    State shared by the worker processes of one host, in a SQLite database.
+
+    Workers record the calls they answer and connect, and publish their
+    metrics every PUBLISH_INTERVAL seconds, so any of them can report on the
+    whole host. When a worker exits, the supervisor folds its counters into
+    a retired row, so they keep counting up across restarts.
+
+    Every write is one small transaction, in WAL mode without an fsync, so
+    it is cheap enough to make from the event loop.
+    """
+
+    PUBLISH_INTERVAL = 5
+
+    # ended calls are kept this long, for anyone looking at the table
+    KEEP_CALLS = 3600
+
+    def __init__(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.pid = os.getpid()
+
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def answered(self, call_id: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO calls (call_id, answered_by, state, answered) VALUES (?, ?, 'answered', ?)",
+            (call_id, self.pid, time.time())
+        )
+
+    def connected(self, call_id: str) -> Optional[int]:
+        """ record that this worker has the call's websocket, returning the pid that answered it """
+        row = self.db.execute("SELECT answered_by FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+        self.db.execute(
+            "INSERT INTO calls (call_id, worker, state, connected) VALUES (?, ?, 'connected', ?) "
+            "ON CONFLICT (call_id) DO UPDATE SET worker = excluded.worker, state = 'connected', "
+            "connected = excluded.connected",
+            (call_id, self.pid, time.time())
+        )
+        return row[0] if row else None
+
+    def ended(self, call_id: str) -> None:
+        self.db.execute("UPDATE calls SET state = 'ended', ended = ? WHERE call_id = ?", (time.time(), call_id))
+
+    def connected_elsewhere(self, call_id: str) -> bool:
+        """ whether the call's websocket went to another worker """
+        row = self.db.execute("SELECT worker FROM calls WHERE call_id = ?", (call_id,)).fetchone()
+        return row is not None and row[0] is not None and row[0] != self.pid
+
+    def active_calls(self, pid: Optional[int] = None) -> int:
+        """ connected calls, on worker `pid` or on the whole host """
+        if pid is None:
+            row = self.db.execute("SELECT COUNT(*) FROM calls WHERE state = 'connected'").fetchone()
+        else:
+            row = self.db.execute("SELECT COUNT(*) FROM calls WHERE state = 'connected' AND worker = ?", (pid,)).fetchone()
+        return row[0]
+
+    def prune(self) -> None:
+        """ forget calls that ended (or were never connected) a while ago """
+        before = time.time() - self.KEEP_CALLS
+        self.db.execute(
+            "DELETE FROM calls WHERE ended < ? OR (state = 'answered' AND answered < ?)", (before, before)
+        )
+
+    def publish(self, families: dict[str, dict]) -> None:
+        """ share this worker's metrics with the others """
+        now = time.time()
+        self.db.execute(
+            "INSERT INTO workers (pid, started, published, metrics) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (pid) DO UPDATE SET published = excluded.published, metrics = excluded.metrics",
+            (self.pid, now, now, json.dumps(families))
+        )
+
+    def metrics(self) -> dict[str, dict]:
+        """ the metric families of the whole host """
+        rows = self.db.execute("SELECT pid, metrics FROM workers").fetchall()
+        families = merge(json.loads(metrics) for _, metrics in rows)
+
+        name = Registry.PREFIX + "workers"
+        families[name] = {
+            "kind": "gauge", "help": "worker processes serving calls",
+            "samples": {name: sum(1 for pid, _ in rows if pid != _RETIRED)}
+        }
+        return dict(sorted(families.items()))
+
+    def retire(self, pid: int) -> None:
+        """ a worker has exited: keep its counters and histograms, end its calls """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.db.execute(
+                "SELECT metrics FROM workers WHERE pid IN (?, ?)", (pid, _RETIRED)
+            ).fetchall()
+            retired = merge((json.loads(metrics) for metrics, in rows), kinds={"counter", "histogram"})
+
+            self.db.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO workers (pid, started, published, metrics) VALUES (?, ?, ?, ?)",
+                (_RETIRED, now, now, json.dumps(retired))
+            )
+
+            lost = self.db.execute(
+                "UPDATE calls SET state = 'lost', ended = ? WHERE worker = ? AND state = 'connected'", (now, pid)
+            ).rowcount
+            self.db.execute("COMMIT")
+
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        if lost:
+            logger.warning(f"worker {pid} exited with {lost} calls still connected")
+
+    def reset(self) -> None:
+        """ start a new run: no workers, and no calls left connected """
+        self.db.execute("DELETE FROM workers")
+        self.db.execute("UPDATE calls SET state = 'lost', ended = ? WHERE state = 'connected'", (time.time(),))
@@ -0,0 +1,295 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from logging import getLogger
+from typing import Optional
+
+import uvicorn
+
+from processing.signals import SignalHandler
+from processing.store import SharedStore
+
+
+logger = getLogger(__name__)
+
+# workers are forked, so they inherit the app and its configuration as is
+_context = multiprocessing.get_context("fork")
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    A uvicorn server that drains rather than drops its calls.
+
+    On SIGTERM or SIGINT it keeps serving, so /answer can turn new calls
+    away, until the calls in progress have ended or `drain_timeout` has
+    passed; then it ends the rest, giving each up to `turn_timeout` to
+    finish its turn. A second signal ends them at once, a third exits
+    without waiting.
+
+    SIGUSR1 drains the same way, but stops accepting connections at once:
+    the supervisor sends it when another worker on the socket takes over.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain_timeout: float, turn_timeout: float) -> None:
+        super().__init__(config)
+        self.drain_timeout = drain_timeout
+        self.turn_timeout = turn_timeout
+        self._drain: Optional[asyncio.Task] = None
+
+    def install_signal_handlers(self) -> None:
+        super().install_signal_handlers()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.handle_exit, signal.SIGUSR1, None)
+        except (NotImplementedError, RuntimeError):
+            # windows, or not on the main thread
+            pass
+
+    def handle_exit(self, sig: int, frame) -> None:
+        if self._drain is None:
+            self._drain = asyncio.get_running_loop().create_task(self.drain(handover=sig == signal.SIGUSR1))
+        elif SignalHandler.KEEP_RUNNING:
+            logger.info(f"Ending {len(SignalHandler.sessions)} calls now")
+            SignalHandler.stop()
+        else:
+            super().handle_exit(sig, frame)
+
+    async def drain(self, handover: bool = False) -> None:
+        SignalHandler.drain()
+
+        if handover:
+            # the listening socket is shared, the other workers accept from here on
+            for server in self.servers:
+                server.close()
+
+        if not await SignalHandler.drained(self.drain_timeout):
+            logger.warning(f"Drain timed out, ending {len(SignalHandler.sessions)} calls")
+            SignalHandler.stop()
+
+        # calls that were ended finish the turn they are on
+        await SignalHandler.drained(self.turn_timeout + 1)
+        self.should_exit = True
+
+
+def _serve(config: uvicorn.Config, sock: socket.socket, ready, drain_timeout: float, turn_timeout: float) -> None:
+    """ the worker process: serve the app on the shared socket """
+    # a hangup on the terminal reaches the whole process group, only the
+    # supervisor acts on it. the server installs its own INT and TERM handlers.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    server = DrainingServer(config, drain_timeout, turn_timeout)
+
+    async def serve():
+        task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started and not task.done():
+            await asyncio.sleep(0.05)
+
+        if server.started:
+            ready.set()
+        await task
+
+    config.setup_event_loop()
+    asyncio.run(serve())
+
+
+class Worker:
+    def __init__(self, index: int, config: uvicorn.Config, sock: socket.socket,
+                 drain_timeout: float, turn_timeout: float) -> None:
+        self.index = index
+        self.ready = _context.Event()
+        self.process = _context.Process(
+            target=_serve, args=(config, sock, self.ready, drain_timeout, turn_timeout), name=f"worker-{index}"
+        )
+        self.process.start()
+        self.started = time.monotonic()
+        self.exited = False
+
+        # when it was asked to stop, and must be gone by
+        self.deadline: Optional[float] = None
+
+    @property
+    def pid(self) -> int:
+        assert self.process.pid is not None
+        return self.process.pid
+
+    def stop(self, timeout: float, handover: bool = False) -> None:
+        """ ask it to drain, it is killed if it is still going after `timeout` seconds """
+        self.deadline = time.monotonic() + timeout
+        if self.process.pid is not None:
+            os.kill(self.process.pid, signal.SIGUSR1 if handover else signal.SIGTERM)
+
+
+class Supervisor:
+    """
+    Runs `workers` copies of the app, sharing one listening socket.
+
+    The socket is bound before the workers are forked, so the kernel spreads
+    connections across them and every core gets a share of the calls. Each
+    worker opens its own provider pools in its startup handler, so nothing
+    but the socket and the SharedStore is shared between them.
+
+    A worker that dies is replaced. SIGHUP restarts the workers one at a
+    time: each is drained (see DrainingServer) only once its replacement is
+    serving, so the host never stops taking calls. SIGINT or SIGTERM drains
+    them all. A worker still running `drain_timeout` plus `turn_timeout`
+    (and a little) seconds after it was asked to drain is killed.
+    """
+
+    # seconds a replacement has to start serving, before a restart gives up
+    READY_TIMEOUT = 30
+
+    # seconds before replacing a worker that died right after it started,
+    # doubled each time it does so again
+    BACKOFF = 1
+    MAX_BACKOFF = 30
+
+    # seconds a draining worker has to exit, past its own deadlines
+    STOP_GRACE = 10
+
+    def __init__(self, config: uvicorn.Config, workers: int, store: Optional[SharedStore] = None,
+                 drain_timeout: float = 300, turn_timeout: float = 15) -> None:
+        self.config = config
+        self.count = workers
+        self.store = store
+        self.drain_timeout = drain_timeout
+        self.turn_timeout = turn_timeout
+
+        self.workers: list[Worker] = []
+        self.stopping: list[Worker] = []
+
+        self._sock: Optional[socket.socket] = None
+        self._backoff = [0] * workers
+        self._respawn_at = [0.0] * workers
+        self._should_restart = False
+        self._should_exit = False
+
+    def _spawn(self, index: int) -> Worker:
+        assert self._sock is not None
+        worker = Worker(index, self.config, self._sock, self.drain_timeout, self.turn_timeout)
+        logger.info(f"Started worker {index} [{worker.pid}]")
+        return worker
+
+    def _handle_signal(self, signum: int, frame) -> None:
+        if signum == signal.SIGHUP:
+            self._should_restart = True
+        else:
+            self._should_exit = True
+
+    def run(self) -> None:
+        self._sock = self.config.bind_socket()
+        if self.store is not None:
+            self.store.reset()
+
+        for sig in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._handle_signal)
+
+        self.workers = [self._spawn(i) for i in range(self.count)]
+        logger.info(f"Supervising {self.count} workers on {self.config.host}:{self.config.port}, "
+                    "send SIGHUP to restart them")
+
+        pruned = time.monotonic()
+        try:
+            while not self._should_exit:
+                if self._should_restart:
+                    self._should_restart = False
+                    self.restart()
+
+                self._check()
+
+                if self.store is not None and time.monotonic() - pruned > 60:
+                    self.store.prune()
+                    pruned = time.monotonic()
+
+                time.sleep(0.2)
+
+        finally:
+            self.shutdown()
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + self.READY_TIMEOUT
+        while not worker.ready.wait(0.2):
+            if self._should_exit or not worker.process.is_alive() or time.monotonic() > deadline:
+                return False
+        return True
+
+    def restart(self) -> None:
+        """ replace every worker, one at a time, without dropping the socket """
+        logger.info("Restarting workers")
+        for index, old in enumerate(self.workers):
+            new = self._spawn(index)
+            if not self._wait_ready(new):
+                logger.error(f"Worker {index} [{new.pid}] did not start serving, keeping [{old.pid}]")
+                new.stop(0)
+                self.stopping.append(new)
+                return
+
+            self.workers[index] = new
+            self._stop(old, handover=True)
+
+        logger.info("Workers restarted")
+
+    def _stop(self, worker: Worker, handover: bool = False) -> None:
+        if worker.exited:
+            return
+
+        if self.store is not None:
+            calls = self.store.active_calls(worker.pid)
+            logger.info(f"Draining worker {worker.index} [{worker.pid}] with {calls} calls connected")
+
+        worker.stop(self.drain_timeout + self.turn_timeout + self.STOP_GRACE, handover)
+        self.stopping.append(worker)
+
+    def _exited(self, worker: Worker) -> None:
+        worker.process.join()
+        worker.exited = True
+        if self.store is not None:
+            self.store.retire(worker.pid)
+
+    def _check(self) -> None:
+        """ reap workers that were stopped, and replace any that died """
+        for worker in list(self.stopping):
+            if not worker.process.is_alive():
+                self.stopping.remove(worker)
+                self._exited(worker)
+
+            elif worker.deadline is not None and time.monotonic() > worker.deadline:
+                logger.warning(f"Worker {worker.index} [{worker.pid}] did not stop in time, killing it")
+                worker.process.kill()
+
+        now = time.monotonic()
+        for index, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                continue
+
+            if not worker.exited:
+                logger.error(f"Worker {index} [{worker.pid}] died (exit code {worker.process.exitcode})")
+                self._exited(worker)
+
+                # back off from a worker that cannot stay up
+                if now - worker.started > self.MAX_BACKOFF:
+                    self._backoff[index] = 0
+                else:
+                    self._backoff[index] = min(max(self._backoff[index] * 2, self.BACKOFF), self.MAX_BACKOFF)
+                self._respawn_at[index] = now + self._backoff[index]
+
+            if now >= self._respawn_at[index]:
+                self.workers[index] = self._spawn(index)
+
+    def shutdown(self) -> None:
+        logger.info("Stopping workers")
+        for worker in self.workers:
+            self._stop(worker)
+        self.workers = []
+
+        while self.stopping:
+            self._check()
+            time.sleep(0.1)
+
+        if self._sock is not None:
+            self._sock.close()
+        if self.store is not None:
+            self.store.close()
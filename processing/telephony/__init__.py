@@ -1,2 +1,15 @@
-from .vonage import VonageTel
-__all__ = ["VonageTel"]
+from importlib import import_module
+
+from .outbound import OutboundScheduler, OutboundStream
+
+# providers are imported on first use, each one pulls in its vendor's sdk
+_PROVIDERS = {"VonageTel": ".vonage"}
+
+
+def __getattr__(name: str):
+    if name in _PROVIDERS:
+        return getattr(import_module(_PROVIDERS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["VonageTel", "OutboundScheduler", "OutboundStream"]
@@ -1,4 +1,4 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from fastapi import Request, Response, WebSocket
 
 
@@ -12,8 +12,17 @@ class Telephony:
     async def answer(self, request: Request) -> Response:
         raise NotImplementedError("Telephony > Answer")
 
+    async def busy(self, request: Request, message: str) -> Response:
+        raise NotImplementedError("Telephony > Busy")
+
+    async def call_id(self, request: Request) -> Optional[str]:
+        raise NotImplementedError("Telephony > Call ID")
+
     async def event(self, request: Request) -> Response:
         raise NotImplementedError("Telephony > Event")
 
     async def websocket(self, websocket: WebSocket) -> AsyncGenerator[bytes, None]:
         raise NotImplementedError("Telephony > Websocket")
+
+    async def clear(self, websocket: WebSocket) -> None:
+        raise NotImplementedError("Telephony > Clear")
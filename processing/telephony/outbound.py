@@ -0,0 +1,124 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Optional
+
+from const import StreamingConfig
+from processing.metrics import Metrics
+
+
+logger = getLogger(__name__)
+
+_busy = Metrics.counter("outbound_ticks_skipped_total", "ticks a call sent nothing, its last frame still being sent")
+
+
+class OutboundStream:
+    """
+    The outbound audio of a single call.
+
+    Frames are queued by the text-to-speech side and sent one per tick by the
+    OutboundScheduler. The queue only holds a short lookahead, so a producer
+    that runs ahead of real time waits in `put` instead of piling audio up in
+    our socket buffers (and Vonage's), where it could no longer be cancelled.
+
+    A frame is sent in a task of its own, one at a time: while a slow client
+    has not taken the last one, its stream skips ticks (its audio falls
+    behind) and the other calls are paced as usual.
+    """
+
+    def __init__(self, send: Callable[[bytes], Awaitable[None]], lookahead: int) -> None:
+        self._send = send
+        self._frames: asyncio.Queue[bytes] = asyncio.Queue(maxsize=lookahead)
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._sending: Optional[asyncio.Task] = None
+
+    async def put(self, frame: bytes) -> None:
+        """ queue a frame, waiting while the lookahead is full """
+        self._empty.clear()
+        await self._frames.put(frame)
+
+    def clear(self) -> None:
+        """ drop every queued frame, e.g. when the caller barges in """
+        while not self._frames.empty():
+            self._frames.get_nowait()
+        self._empty.set()
+
+    async def drain(self) -> None:
+        """ wait until every queued frame has been sent """
+        await self._empty.wait()
+
+    def _tick(self) -> None:
+        """ start sending the next frame, unless the last one is still on its way """
+        if self._sending is not None and not self._sending.done():
+            _busy.inc()
+            return
+
+        try:
+            frame = self._frames.get_nowait()
+        except asyncio.QueueEmpty:
+            self._empty.set()
+            return
+
+        self._sending = asyncio.create_task(self._send_frame(frame))
+
+    async def _send_frame(self, frame: bytes) -> None:
+        try:
+            await self._send(frame)
+        except Exception as e:
+            logger.warning(f"Outbound frame failed: {e}")
+        finally:
+            if self._frames.empty():
+                self._empty.set()
+
+
+class OutboundScheduler:
+    """
+    Paces outbound audio for every call on the process from a single clock.
+
+    Each tick (StreamingConfig.BUFFER_DURATION, on the monotonic clock) sends
+    at most one frame per registered stream. One timer drives all calls, so
+    the cost of pacing does not grow with a sleeping task per call. Ticks
+    only start sends, they never wait on one, so one stalled websocket cannot
+    hold up the others. If the loop stalls, missed ticks are skipped rather
+    than made up with a burst.
+    """
+
+    def __init__(self, interval: float = StreamingConfig.BUFFER_DURATION) -> None:
+        self.interval = interval
+        self._streams: set[OutboundStream] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        # ticks that started more than one interval late
+        self.late_ticks = 0
+
+    def register(self, send: Callable[[bytes], Awaitable[None]],
+                 lookahead: int = StreamingConfig.OUTBOUND_LOOKAHEAD) -> OutboundStream:
+        """ add a call, `send` is called with one frame per tick """
+        stream = OutboundStream(send, lookahead)
+        self._streams.add(stream)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        return stream
+
+    def unregister(self, stream: OutboundStream) -> None:
+        stream.clear()
+        self._streams.discard(stream)
+
+    async def _run(self) -> None:
+        deadline = time.monotonic()
+
+        while self._streams:
+            for stream in self._streams:
+                stream._tick()
+
+            deadline += self.interval
+            now = time.monotonic()
+            if now - deadline > self.interval:
+                # we fell behind, skip the missed ticks instead of bursting
+                self.late_ticks += 1
+                deadline = now
+
+            await asyncio.sleep(max(0, deadline - now))
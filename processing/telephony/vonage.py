@@ -1,6 +1,6 @@
 import inspect
 import json
-from typing import Any, AsyncGenerator, Callable, Coroutine, Union
+from typing import Any, AsyncGenerator, Callable, Coroutine, Optional, Union
 from fastapi import Request, WebSocket
 from fastapi.responses import JSONResponse
 from fastapi.websockets import WebSocketState
@@ -11,6 +11,7 @@ from vonage.ncco_builder import ConnectEndpoints, Ncco
 from const import AppConfig, StreamingConfig
 from logging import getLogger
 
+from processing.codec import AudioFormat, call_format
 from processing.signals import SignalHandler
 
 from .abstract import Telephony
@@ -22,8 +23,14 @@ logger = getLogger(__name__)
 class VonageTel(Telephony):
     client: Client
 
+    # the only audio vonage websockets carry, other formats are converted to these
+    FORMATS = (AudioFormat("linear16", 8000), AudioFormat("linear16", 16000))
+
     @classmethod
     def create(cls) -> "VonageTel":
+        if call_format() not in cls.FORMATS:
+            raise ValueError(f"Vonage websockets carry {cls.FORMATS}, not {call_format()}, check StreamingConfig")
+
         self = cls()
 
         self.client = Client(
@@ -90,6 +97,26 @@ class VonageTel(Telephony):
         except IndexError:
             raise ValueError("No phone numbers available for this application")
 
+    async def call_id(self, request: Request) -> Optional[str]:
+        """
+        The uuid of the call being answered.
+
+        Args:
+            request (Request): The answer webhook (GET or POST).
+
+        Returns:
+            str: The call's uuid, or None if the request has none.
+        """
+        if uuid := request.query_params.get("uuid"):
+            return uuid
+
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+
+        return body.get("uuid") if isinstance(body, dict) else None
+
     async def answer(self, request: Request, ws_url: str) -> JSONResponse:
         """
         Answer a call.
@@ -115,6 +142,21 @@ class VonageTel(Telephony):
         ncco = Ncco.build_ncco(c)
         return JSONResponse(ncco)
 
+    async def busy(self, request: Request, message: str) -> JSONResponse:
+        """
+        Turn a call away.
+
+        Args:
+            request (Request): The incoming request.
+            message (str): What to say to the caller, before hanging up.
+
+        Returns:
+            Response: The response to send to the caller.
+        """
+        # the call hangs up when the ncco runs out
+        ncco = Ncco.build_ncco(Ncco.Talk(text=message))
+        return JSONResponse(ncco)
+
     async def websocket(self,
                         ws: WebSocket,
                         on_event: Callable[[str],
@@ -148,3 +190,13 @@ class VonageTel(Telephony):
 
         except Exception as e:
             logger.error(f"Error: {e}")
+
+    async def clear(self, ws: WebSocket) -> None:
+        """
+        Stop playback of any audio Vonage has buffered for the caller.
+
+        Args:
+            ws (WebSocket): The call's WebSocket.
+        """
+        if ws.client_state != WebSocketState.DISCONNECTED:
+            await ws.send_text(json.dumps({"action": "clear"}))
@@ -1,5 +1,17 @@
-from .pyht import PlayHTTTS
-from .openai import OpenAITTS
-from .elevenlabs import ElevenLabsTTS
+from importlib import import_module
 
-__all__ = ["PlayHTTTS", "OpenAITTS", "ElevenLabsTTS"]
+from .cache import CachedTTS, TTSCache
+from .hedged import HedgedTTS
+from .limited import LimitedTTS
+
+# providers are imported on first use, each one pulls in its vendor's sdk
+_PROVIDERS = {"PlayHTTTS": ".pyht", "OpenAITTS": ".openai", "ElevenLabsTTS": ".elevenlabs"}
+
+
+def __getattr__(name: str):
+    if name in _PROVIDERS:
+        return getattr(import_module(_PROVIDERS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["PlayHTTTS", "OpenAITTS", "ElevenLabsTTS", "CachedTTS", "HedgedTTS", "LimitedTTS", "TTSCache"]
@@ -1,26 +1,55 @@
-from typing import AsyncGenerator, AsyncIterable, AsyncIterator
+from typing import AsyncGenerator, AsyncIterable, AsyncIterator, Optional
 
 from const import StreamingConfig
+from processing import tracing
+from processing.codec import AudioFormat, Converter, call_format
+from processing.pool import ConnectionPool
+from .chunker import ChunkPolicy
+from .framebuffer import FrameBuffer, WavHeader
 
 
 class TextToSpeech:
+    # how streamed text is cut up before it is sent, see chunker.py
+    CHUNK_POLICY: ChunkPolicy = ChunkPolicy()
+
+    # connections opened ahead of time, for providers that keep any
+    pool: Optional[ConnectionPool] = None
+
     @classmethod
     async def create(cls) -> "TextToSpeech":
         raise NotImplementedError("TextToSpeech > Create")
 
+    @classmethod
+    def create_pool(cls, size: int, max_idle: float) -> Optional[ConnectionPool]:
+        """ providers with connections worth opening ahead of time override this """
+        return None
+
+    def output_format(self) -> AudioFormat:
+        """ the format the provider sends audio in, it is converted to the call's on the way out """
+        return call_format()
+
     async def _speak_return(self, it: AsyncIterator[bytes] | AsyncIterable[bytes]) -> AsyncGenerator[bytes, None]:
-        buffer = b""
-        skipped_headers = False
+        """ convert provider audio to the call's format, re-framed into StreamingConfig.CHUNK_SIZE frames """
+        converter = Converter(self.output_format())
+        frames = FrameBuffer(StreamingConfig.CHUNK_SIZE, skip_header=False)
+
+        # a wav header is not audio, it goes before anything is converted
+        header = WavHeader()
 
         async for chunk in it:
-            if not skipped_headers:
-                skipped_headers = True
-                continue
+            tracing.mark("first_audio")
+            if not header.done:
+                if (audio := header.strip(chunk)) is None:
+                    continue
+                chunk = bytes(audio)
+            for frame in frames.feed(converter.convert(chunk)):
+                yield frame
+
+        for frame in frames.feed(converter.flush()):
+            yield frame
 
-            buffer += chunk
-            while len(buffer) > StreamingConfig.CHUNK_SIZE:
-                yield buffer[:StreamingConfig.CHUNK_SIZE]
-                buffer = buffer[StreamingConfig.CHUNK_SIZE:]
+        if tail := frames.flush():
+            yield tail
 
         await self.close()
 
@@ -30,5 +59,13 @@ class TextToSpeech:
     async def speak_stream(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
         raise NotImplementedError("TextToSpeech > Speak Stream")
 
+    async def prepare(self) -> None:
+        """ open whatever the next utterance needs ahead of time, if anything """
+        pass
+
+    def cache_namespace(self) -> str:
+        """ everything besides the text that changes the audio: provider, voice, settings """
+        raise NotImplementedError("TextToSpeech > Cache Namespace")
+
     async def close(self):
         raise NotImplementedError("TextToSpeech > Close")
@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import inspect
+import mmap
+import os
+import re
+import tempfile
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from logging import getLogger
+from typing import AsyncGenerator, AsyncIterator, Callable, Optional, Sequence
+
+from const import StreamingConfig
+from processing import tracing
+from processing.metrics import Metrics
+from .abstract import TextToSpeech
+from .framebuffer import FrameBuffer
+
+
+logger = getLogger(__name__)
+
+Frames = Sequence[bytes]
+
+_lookups = {
+    result: Metrics.counter("tts_cache_lookups_total", "tts cache lookups, by the tier that answered", {"result": result})
+    for result in ("memory", "disk", "miss")
+}
+_evictions = {
+    tier: Metrics.counter("tts_cache_evictions_total", "tts cache entries evicted to stay within budget", {"tier": tier})
+    for tier in ("memory", "disk")
+}
+
+
+def phrase(namespace: str, text: str) -> str:
+    """
+    Everything that determines the audio of an utterance: the provider, voice
+    and settings, the frame format, and the text (the same words with
+    different spacing sound the same).
+    """
+    text = " ".join(text.split())
+    return f"{namespace}|{StreamingConfig.ENCODING}|{StreamingConfig.FREQUENCY}|{StreamingConfig.CHUNK_SIZE}|{text}"
+
+
+def cache_key(phrase: str) -> str:
+    """ content address of a phrase """
+    return hashlib.sha256(phrase.encode()).hexdigest()
+
+
+class MemoryTier:
+    """ an LRU of ready to send frames, bounded by total bytes """
+
+    def __init__(self, max_bytes: int, on_evict: Callable[[str], None]) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, Frames]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Frames]:
+        frames = self._entries.get(key)
+        if frames is not None:
+            self._entries.move_to_end(key)
+        return frames
+
+    def put(self, key: str, frames: Frames) -> None:
+        size = sum(len(frame) for frame in frames)
+        if size > self.max_bytes:
+            return
+
+        if (old := self._entries.pop(key, None)) is not None:
+            self.bytes -= sum(len(frame) for frame in old)
+
+        self._entries[key] = frames
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            evicted, frames = self._entries.popitem(last=False)
+            self.bytes -= sum(len(frame) for frame in frames)
+            _evictions["memory"].inc()
+            self.on_evict(evicted)
+
+
+class DiskTier:
+    """
+    One file per entry: the length of the phrase (4 bytes), the phrase, then
+    raw PCM frames. Entries are read back through mmap, so a hit costs a page
+    cache lookup rather than a read into a fresh buffer. Files are written to
+    a temporary name and renamed into place, so several workers can share
+    the directory. Least recently used files go once `max_bytes` is exceeded.
+    """
+
+    SUFFIX = ".pcm"
+
+    def __init__(self, path: str, max_bytes: int, on_evict: Callable[[str], None]) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+        os.makedirs(path, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def load(self) -> list[str]:
+        """ pick up what earlier runs left behind, oldest first, returning their phrases """
+        found = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(self.SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-len(self.SUFFIX)], stat.st_size))
+
+        phrases = []
+        for _, key, size in sorted(found):
+            try:
+                with open(self._file(key), "rb") as f:
+                    length = int.from_bytes(f.read(4), "little")
+                    phrases.append(f.read(length).decode())
+            except (OSError, UnicodeDecodeError):
+                continue
+
+            self._entries[key] = size
+            self.bytes += size
+
+        self._evict()
+        return phrases
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.bytes -= size
+            _evictions["disk"].inc()
+            self.on_evict(key)
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str) -> Optional[Frames]:
+        # not in our index can still be on disk, written by another worker
+        try:
+            with open(self._file(key), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 4 + int.from_bytes(mm[:4], "little")
+                size = StreamingConfig.CHUNK_SIZE
+                frames = [mm[i:i + size] for i in range(start, len(mm), size)]
+                total = len(mm)
+        except (FileNotFoundError, ValueError):
+            # never written, evicted by another worker, or empty
+            self.bytes -= self._entries.pop(key, 0)
+            return None
+
+        self.add(key, total)
+        return frames
+
+    def write(self, key: str, phrase: str, frames: Frames) -> int:
+        """ write an entry to disk, this blocks so run it off the event loop """
+        header = phrase.encode()
+
+        # a temporary file of its own, the same phrase can be written twice at once
+        fd, temp = tempfile.mkstemp(dir=self.path, prefix=key, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(len(header).to_bytes(4, "little"))
+                f.write(header)
+                for frame in frames:
+                    f.write(frame)
+            os.replace(temp, self._file(key))
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+        return 4 + len(header) + sum(len(frame) for frame in frames)
+
+    def add(self, key: str, size: int) -> None:
+        """ account for an entry on disk, and mark it most recently used """
+        self.bytes += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict()
+
+
+class TTSCache:
+    """
+    A memory tier in front of an (optional) disk tier.
+
+    Besides the audio, the cache keeps a sorted index of the phrases it
+    holds, so a streamed reply can tell after every token whether the text
+    so far could still turn out to be a cached sentence.
+    """
+
+    def __init__(self, memory_bytes: int, disk_path: Optional[str] = None, disk_bytes: int = 0) -> None:
+        self.memory = MemoryTier(memory_bytes, on_evict=self._memory_evicted)
+        self.disk = DiskTier(disk_path, disk_bytes, on_evict=self._forget) if disk_path else None
+
+        self._phrases: list[str] = []
+        self._keys: dict[str, str] = {}
+
+        if self.disk is not None:
+            for loaded in self.disk.load():
+                self._index(loaded)
+
+        Metrics.collector(self._collect)
+
+    def _collect(self) -> None:
+        for name, tier in (("memory", self.memory), ("disk", self.disk)):
+            if tier is not None:
+                Metrics.gauge("tts_cache_bytes", "bytes of audio held by the tts cache", {"tier": name}).set(tier.bytes)
+                Metrics.gauge("tts_cache_entries", "utterances held by the tts cache", {"tier": name}).set(len(tier))
+
+    def _index(self, phrase: str) -> None:
+        key = cache_key(phrase)
+        if key not in self._keys:
+            self._keys[key] = phrase
+            insort(self._phrases, phrase)
+
+    def _forget(self, key: str) -> None:
+        phrase = self._keys.pop(key, None)
+        if phrase is not None:
+            index = bisect_left(self._phrases, phrase)
+            if index < len(self._phrases) and self._phrases[index] == phrase:
+                del self._phrases[index]
+
+    def _memory_evicted(self, key: str) -> None:
+        if self.disk is None or key not in self.disk:
+            self._forget(key)
+
+    def could_start(self, prefix: str) -> bool:
+        """ is there a cached phrase that starts with `prefix`? """
+        index = bisect_left(self._phrases, prefix)
+        return index < len(self._phrases) and self._phrases[index].startswith(prefix)
+
+    def get(self, phrase: str) -> Optional[Frames]:
+        key = cache_key(phrase)
+        if (frames := self.memory.get(key)) is not None:
+            _lookups["memory"].inc()
+            return frames
+
+        if self.disk is not None and (frames := self.disk.get(key)) is not None:
+            _lookups["disk"].inc()
+            self._index(phrase)
+            self.memory.put(key, frames)
+            return frames
+
+        _lookups["miss"].inc()
+        return None
+
+    async def put(self, phrase: str, frames: Frames) -> None:
+        key = cache_key(phrase)
+        self.memory.put(key, frames)
+
+        if self.disk is not None:
+            try:
+                size = await asyncio.to_thread(self.disk.write, key, phrase, frames)
+                self.disk.add(key, size)
+            except OSError as e:
+                logger.warning(f"Could not write tts cache entry: {e}")
+
+        # too big for either tier, nothing to index
+        if key in self.memory or (self.disk is not None and key in self.disk):
+            self._index(phrase)
+
+
+# the end of a sentence, and any closing quotes or brackets
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(\s|$)")
+
+
+class CachedTTS(TextToSpeech):
+    """
+    Wraps a provider so repeated utterances are served from a TTSCache.
+
+    `speak` answers whole phrases from the cache, and caches what it had to
+    synthesize once it has played to the end.
+
+    `speak_stream` plays the leading sentences of a streamed reply from the
+    cache for as long as they are cached. Text is only held back while it
+    could still be the start of a cached sentence; as soon as it cannot, it
+    and the rest of the reply go to the provider's own streaming synthesis,
+    in one piece so the prosody is not cut up sentence by sentence. If that
+    remainder turns out to be a single sentence, its audio is cached. So is
+    a remainder that came in one piece, however long: a reply known in full
+    up front (a cached answer, see generate_response/cache.py) comes again.
+
+    Audio is only cached once the provider's stream has ended on its own.
+    Providers raise when theirs is cut short (a socket closed before the
+    final message, see elevenlabs.py), so a clipped utterance is never
+    replayed to later callers.
+    """
+
+    def __init__(self, tts: TextToSpeech, cache: TTSCache) -> None:
+        self.tts = tts
+        self.cache = cache
+        self.namespace = tts.cache_namespace()
+
+    def cache_namespace(self) -> str:
+        return self.namespace
+
+    async def prepare(self) -> None:
+        await self.tts.prepare()
+
+    async def _synthesize(self, stream) -> AsyncGenerator[bytes, None]:
+        """ provider audio in whole frames, some providers need awaiting first """
+        if inspect.isawaitable(stream):
+            stream = await stream
+
+        frames = FrameBuffer()
+        async for chunk in stream:
+            for frame in frames.feed(chunk):
+                yield frame
+
+        if tail := frames.flush():
+            yield tail
+
+    async def _store(self, key: str, audio: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+        """ pass audio through, caching it if the provider finished it and it played to the end """
+        frames = []
+        async for frame in audio:
+            frames.append(frame)
+            yield frame
+
+        if frames:
+            await self.cache.put(key, frames)
+
+    async def _replay(self, frames: Frames) -> AsyncGenerator[bytes, None]:
+        tracing.mark("first_audio")
+        for frame in frames:
+            yield frame
+
+    async def speak(self, text: str) -> AsyncGenerator[bytes, None]:
+        key = phrase(self.namespace, text)
+        if (frames := self.cache.get(key)) is not None:
+            return self._replay(frames)
+
+        return self._store(key, self._synthesize(self.tts.speak(text)))
+
+    async def speak_stream(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        return self._prefixed(text_buffer)
+
+    async def _prefixed(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        buffer = ""
+
+        async for text in text_buffer:
+            buffer += text
+
+            # play every whole sentence at the start of the buffer that is cached
+            while match := _SENTENCE_END.search(buffer):
+                frames = self.cache.get(phrase(self.namespace, buffer[:match.end()]))
+                if frames is None:
+                    break
+
+                async for frame in self._replay(frames):
+                    yield frame
+                buffer = buffer[match.end():].lstrip()
+
+            if buffer and not self.cache.could_start(phrase(self.namespace, buffer)):
+                break
+
+        else:
+            # the reply ended, maybe on a cached sentence without punctuation
+            if buffer.strip() and (frames := self.cache.get(phrase(self.namespace, buffer))) is not None:
+                async for frame in self._replay(frames):
+                    yield frame
+                return
+
+        if not buffer.strip():
+            return
+
+        # synthesize the rest, keeping the text to cache it if it is one sentence
+        spoken = buffer
+        streamed = False
+
+        async def remainder():
+            nonlocal spoken, streamed
+            yield buffer
+            async for rest in text_buffer:
+                spoken += rest
+                streamed = True
+                yield rest
+
+        frames = []
+        async for frame in self._synthesize(self.tts.speak_stream(remainder())):
+            frames.append(frame)
+            yield frame
+
+        if frames and (not streamed or len(_SENTENCE_END.findall(spoken.strip())) <= 1):
+            await self.cache.put(phrase(self.namespace, spoken), frames)
+
+    async def close(self):
+        await self.tts.close()
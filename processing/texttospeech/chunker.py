@@ -0,0 +1,131 @@
+import re
+from typing import AsyncGenerator, AsyncIterable, Optional
+
+
+# words whose trailing period does not end a sentence
+ABBREVIATIONS = frozenset({
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e",
+    "a.m", "p.m", "approx", "dept", "inc", "ltd", "mt", "ave",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+})
+
+# a sentence end: terminal punctuation and any closing quotes or brackets,
+# confirmed by the whitespace that follows it
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*(?=\s)")
+
+# a clause end: somewhere a speaker could take a breath
+_CLAUSE_END = re.compile(r"(?:[,;:]|\s[—–-])(?=\s)")
+
+_WORD_BEFORE = re.compile(r"([\w.]+)\.$")
+
+# a word end: whitespace after something that is not
+_WORD_END = re.compile(r"(?<=\S)\s")
+
+
+class ChunkPolicy:
+    """
+    How a provider wants its text cut up.
+
+    first_min       the first chunk goes out at the first sentence, clause or
+                    word end after this many characters, so audio starts as
+                    soon as the first words are known; until min_chars have
+                    gone out, the next ones make do with a clause end, so the
+                    audio keeps ahead of playback while the reply gets going
+    min_chars       later chunks wait for a sentence end after this many
+                    characters, so each one is spoken with whole-sentence prosody
+    max_chars       no chunk is longer than this; a long sentence is cut at its
+                    last clause end, or failing that its last space
+    """
+
+    def __init__(self, first_min: int = 5, min_chars: int = 40, max_chars: int = 200) -> None:
+        self.first_min = first_min
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+
+    def __repr__(self) -> str:
+        return f"ChunkPolicy(first_min={self.first_min}, min_chars={self.min_chars}, max_chars={self.max_chars})"
+
+
+def _is_sentence_end(text: str, match: re.Match) -> bool:
+    """ rule out the periods of abbreviations and initials """
+    if text[match.start()] != ".":
+        return True
+
+    word = _WORD_BEFORE.search(text, 0, match.start() + 1)
+    if word is None:
+        return True
+
+    word = word.group(1).lower()
+    if word in ABBREVIATIONS:
+        return False
+
+    # a single initial, as in "J. R. R. Tolkien"
+    return not (len(word) == 1 and word.isalpha())
+
+
+def find_cut(text: str, policy: ChunkPolicy, sent: int = 0) -> Optional[int]:
+    """ where to cut `text` into a chunk, `sent` characters into the reply, or None if it should wait for more """
+    minimum = policy.first_min if sent < policy.min_chars else policy.min_chars
+    limit = min(len(text), policy.max_chars)
+    start = minimum - 1 if minimum else 0
+
+    if not sent:
+        # the first boundary of any kind that makes a long enough chunk
+        sentence = next((m.end() for m in _SENTENCE_END.finditer(text, start, limit) if _is_sentence_end(text, m)), None)
+        clause = next((m.end() for m in _CLAUSE_END.finditer(text, start, limit)), None)
+        word = next((m.start() for m in _WORD_END.finditer(text, max(minimum, 1), limit)), None)
+        cut = min((c for c in (sentence, clause, word) if c is not None), default=None)
+        if cut is not None or len(text) <= policy.max_chars:
+            return cut
+
+    # the last sentence end that makes a long enough chunk
+    cut = None
+    for match in _SENTENCE_END.finditer(text, start, limit):
+        if _is_sentence_end(text, match):
+            cut = match.end()
+
+    if cut is None and sent < policy.min_chars:
+        # early on, a clause will do
+        cut = next((m.end() for m in _CLAUSE_END.finditer(text, start, limit)), None)
+
+    if cut is not None or len(text) <= policy.max_chars:
+        return cut
+
+    # too long to wait any longer
+    clauses = [match.end() for match in _CLAUSE_END.finditer(text, 0, limit)]
+    if clauses:
+        return clauses[-1]
+
+    space = text.rfind(" ", 0, limit)
+    return space if space > 0 else limit
+
+
+async def chunk_text(text_stream: AsyncIterable[str], policy: Optional[ChunkPolicy] = None) -> AsyncGenerator[str, None]:
+    """
+    Regroup streamed LLM tokens into chunks for a TTS provider, each ending
+    in a space.
+
+    Boundaries are only decided once the whitespace after them has arrived,
+    so "3.5", "Dr. Smith" and "$1,000" are never split. The text held back
+    never grows much past `policy.max_chars`, so the work per token is
+    bounded however long the reply gets.
+    """
+    policy = policy or ChunkPolicy()
+    buffer = ""
+    sent = 0
+
+    async for text in text_stream:
+        buffer += text
+
+        # a boundary needs the whitespace after it
+        if len(buffer) <= policy.max_chars and not any(c.isspace() for c in text):
+            continue
+
+        while (cut := find_cut(buffer, policy, sent)) is not None:
+            chunk, buffer = buffer[:cut].strip(), buffer[cut:].lstrip()
+            if chunk:
+                yield chunk + " "
+                sent += len(chunk) + 1
+
+    if chunk := buffer.strip():
+        yield chunk + " "
@@ -1,87 +1,250 @@
 import asyncio
 import base64
-from email.mime import base
 import json
-from typing import AsyncGenerator, Generator, Iterator
-from elevenlabs import generate
+import time
+from logging import getLogger
+from typing import AsyncGenerator, Optional
+from elevenlabs import VoiceSettings
 from elevenlabs.client import AsyncElevenLabs
 import websockets
 
-from const import AppConfig, StreamingConfig
+from const import AppConfig
+from processing import tracing
+from processing.codec import AudioFormat, Converter, call_format, closest
+from processing.pool import ConnectionPool
 from .abstract import TextToSpeech
+from .chunker import ChunkPolicy, chunk_text
+
+
+logger = getLogger(__name__)
 
 
 class ElevenLabsTTS(TextToSpeech):
     client: AsyncElevenLabs
 
+    # how many audio messages may be waiting for the caller before we stop
+    # reading from the ElevenLabs websocket
+    QUEUE_SIZE: int = 64
+
+    # every chunk is sent with try_trigger_generation, so a short first chunk
+    # starts the audio, and sentence sized chunks after that sound natural
+    CHUNK_POLICY: ChunkPolicy = ChunkPolicy(first_min=5, min_chars=40, max_chars=200)
+
+    # used for both the http and the websocket api, so they sound the same
+    VOICE_SETTINGS: dict[str, float] = {"stability": 0.5, "similarity_boost": 0.8}
+
+    # the output formats both apis offer, the one closest to the call's is used
+    OUTPUT_FORMATS: dict[str, AudioFormat] = {
+        "ulaw_8000": AudioFormat("mulaw", 8000),
+        "pcm_16000": AudioFormat("linear16", 16000),
+        "pcm_22050": AudioFormat("linear16", 22050),
+        "pcm_24000": AudioFormat("linear16", 24000),
+        "pcm_44100": AudioFormat("linear16", 44100),
+    }
+
+    # the websocket api, None for AppConfig.ELEVENLABS_URL (or the real one)
+    URL: Optional[str] = None
+
+    # seconds from the first LLM token to the first audio byte, for the
+    # last utterance spoken by this instance
+    first_audio_latency: Optional[float] = None
+
+    # the http client is shared by every call on this process, and input
+    # stream websockets are pre-opened by the pool (when one is configured)
+    _shared_client: Optional[AsyncElevenLabs] = None
+    pool: Optional[ConnectionPool[websockets.WebSocketClientProtocol]] = None
+
+    @classmethod
+    def get_client(cls) -> AsyncElevenLabs:
+        """ return the process wide http client, creating it on first use """
+        if cls._shared_client is None:
+            cls._shared_client = AsyncElevenLabs(api_key=AppConfig.ELEVENLABS_API_KEY)
+        return cls._shared_client
+
+    @classmethod
+    def output_format_name(cls) -> str:
+        return closest(cls.OUTPUT_FORMATS, call_format())
+
+    @classmethod
+    async def connect(cls) -> websockets.WebSocketClientProtocol:
+        """ open an input stream websocket, ready to receive text """
+        uri = (
+            f"{cls.URL or AppConfig.ELEVENLABS_URL or 'wss://api.elevenlabs.io'}"
+            f"/v1/text-to-speech/{AppConfig.ELEVENLABS_VOICE_ID}/stream-input"
+            f"?output_format={cls.output_format_name()}"
+        )
+
+        websocket = await websockets.connect(uri)
+        await websocket.send(json.dumps({
+            "text": " ",
+            "voice_settings": cls.VOICE_SETTINGS,
+            "xi_api_key": AppConfig.ELEVENLABS_API_KEY,
+        }))
+        return websocket
+
+    @classmethod
+    def create_pool(cls, size: int, max_idle: float) -> ConnectionPool[websockets.WebSocketClientProtocol]:
+        """
+        Keep `size` input stream websockets open ahead of time. Each socket
+        speaks a single utterance, so they are taken from the pool and never
+        returned. ElevenLabs closes a socket after 20s without text, so
+        `max_idle` should stay below that.
+        """
+        async def close(websocket: websockets.WebSocketClientProtocol):
+            await websocket.close()
+
+        cls.pool = ConnectionPool(
+            "elevenlabs",
+            connect=cls.connect,
+            close=close,
+            size=size,
+            max_idle=max_idle,
+            health_check=lambda websocket: websocket.open,
+        )
+        return cls.pool
+
     @classmethod
     def create(cls) -> "ElevenLabsTTS":
         self = cls()
-        self.client = AsyncElevenLabs(api_key=AppConfig.ELEVENLABS_API_KEY)
+        self.client = cls.get_client()
+
+        # an input stream opened ahead of time by `prepare`, for the next utterance
+        self._websocket: Optional[websockets.WebSocketClientProtocol] = None
         return self
 
-    async def speak(self, text: str) -> AsyncGenerator[bytes, None]:
+    async def _open(self) -> websockets.WebSocketClientProtocol:
+        if self.pool is not None:
+            return await self.pool.acquire()
+        return await self.connect()
+
+    async def prepare(self) -> None:
+        if self._websocket is None:
+            self._websocket = await self._open()
 
-        assert StreamingConfig.SAMPLE_RATE == 16000, "ElevenLabs only supports 16kHz sample rate"
+    def output_format(self) -> AudioFormat:
+        return self.OUTPUT_FORMATS[self.output_format_name()]
 
+    def cache_namespace(self) -> str:
+        settings = json.dumps(self.VOICE_SETTINGS, sort_keys=True)
+        return f"elevenlabs:{AppConfig.ELEVENLABS_VOICE_ID}:{self.output_format_name()}:{settings}"
+
+    async def speak(self, text: str) -> AsyncGenerator[bytes, None]:
         res = self.client.text_to_speech.convert_as_stream(
             voice_id=AppConfig.ELEVENLABS_VOICE_ID,
             text=text,
-            output_format="pcm_16000",
+            output_format=self.output_format_name(),
+            voice_settings=VoiceSettings(**self.VOICE_SETTINGS),
         )
 
         return self._speak_return(res)
 
     async def speak_stream(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
-        async def text_chunker(chunks):
-            """Split text into chunks, ensuring to not break sentences."""
-            splitters = (".", ",", "?", "!", ";", ":", "—",
-                         "-", "(", ")", "[", "]", "}", " ")
-            buffer = ""
-
+        return self._duplex(text_buffer)
+
+    async def _duplex(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        """
+        Send text to ElevenLabs and stream the returned audio at the same time.
+
+        One task feeds text from the LLM into the websocket while another reads
+        audio off it, the two linked by a bounded queue. This means the caller
+        hears the start of the answer while the rest is still being generated.
+        """
+        self.first_audio_latency = None
+        first_token_at: Optional[float] = None
+        error: Optional[BaseException] = None
+        queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        converter = Converter(self.output_format())
+
+        def wake():
+            """ make sure the consumer sees the end of the stream, even if the queue is full """
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+        async def timed(chunks: AsyncGenerator[str, None]):
+            nonlocal first_token_at
             async for text in chunks:
-                if buffer.endswith(splitters):
-                    yield buffer + " "
-                    buffer = text
-                elif text.startswith(splitters):
-                    yield buffer + text[0] + " "
-                    buffer = text[1:]
-                else:
-                    buffer += text
-
-            if buffer:
-                yield buffer + " "
-
-        """Send text to ElevenLabs API and stream the returned audio."""
-        uri = f"wss://api.elevenlabs.io/v1/text-to-speech/{AppConfig.ELEVENLABS_VOICE_ID}/stream-input"
-
-        async with websockets.connect(uri) as websocket:
-            await websocket.send(json.dumps({
-                "text": " ",
-                "voice_settings": {"stability": 0.5, "similarity_boost": 0.8},
-                "xi_api_key": AppConfig.ELEVENLABS_API_KEY,
-            }))
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                yield text
+
+        websocket, self._websocket = self._websocket, None
+        if websocket is None or not websocket.open:
+            websocket = await self._open()
+
+        try:
+            async def send():
+                """Feed the LLM stream into the websocket as it arrives."""
+                async for text in chunk_text(timed(text_buffer), self.CHUNK_POLICY):
+                    await websocket.send(json.dumps({"text": text, "try_trigger_generation": True}))
+
+                await websocket.send(json.dumps({"text": ""}))
 
             async def listen():
-                """Listen to the websocket for audio data and stream it."""
+                """
+                Listen to the websocket for audio data and queue it. A socket
+                that closes before isFinal has cut the audio short, which is
+                an error: the utterance must not pass for a whole one (and
+                be cached, see cache.py).
+                """
                 try:
-                    while message := await websocket.recv():
+                    async for message in websocket:
                         data = json.loads(message)
 
                         if data.get("audio"):
-                            yield base64.b64decode(data["audio"])
+                            await queue.put(base64.b64decode(data["audio"]))
 
                         elif data.get('isFinal'):
                             break
-                except websockets.exceptions.ConnectionClosed:
-                    print("Connection Closed with ElevenLabs")
+                    else:
+                        raise ConnectionError("ElevenLabs closed the stream before the end of the audio")
+                except websockets.exceptions.ConnectionClosed as e:
+                    logger.warning("Connection Closed with ElevenLabs")
+                    raise ConnectionError("ElevenLabs closed the stream before the end of the audio") from e
+
+                await queue.put(None)
+
+            def on_done(task: asyncio.Task):
+                """ if either side fails, stop the other one and wake the consumer """
+                nonlocal error
+                if task.cancelled() or task.exception() is None:
+                    return
+
+                error = error or task.exception()
+                sender.cancel()
+                receiver.cancel()
+                wake()
+
+            sender = asyncio.create_task(send())
+            receiver = asyncio.create_task(listen())
+            sender.add_done_callback(on_done)
+            receiver.add_done_callback(on_done)
+
+            try:
+                while (audio := await queue.get()) is not None:
+                    tracing.mark("first_audio")
+                    if self.first_audio_latency is None and first_token_at is not None:
+                        self.first_audio_latency = time.monotonic() - first_token_at
+                        logger.info(f"ElevenLabs first audio {self.first_audio_latency * 1000:.0f}ms after first token")
+
+                    yield converter.convert(audio)
+
+                if error is not None:
+                    raise error
 
-            async for text in text_chunker(text_buffer):
-                await websocket.send(json.dumps({"text": text, "try_trigger_generation": True}))
+                if tail := converter.flush():
+                    yield tail
 
-            await websocket.send(json.dumps({"text": ""}))
+            finally:
+                sender.cancel()
+                receiver.cancel()
+                await asyncio.gather(sender, receiver, return_exceptions=True)
 
-        return listen()
+        finally:
+            await websocket.close()
 
     async def close(self):
-        pass
+        # a prepared stream that was never used (the reply came from the cache)
+        if self._websocket is not None:
+            await self._websocket.close()
+            self._websocket = None
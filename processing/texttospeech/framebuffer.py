@@ -0,0 +1,150 @@
+from logging import getLogger
+from typing import Iterator, Optional
+
+from const import StreamingConfig
+from processing.codec import SILENCE
+
+
+logger = getLogger(__name__)
+
+
+class WavHeader:
+    """
+    Strips a WAV (RIFF) header off the start of a stream, up to the start of
+    its `data` chunk, even when the header is split over several chunks or
+    shares a chunk with the first audio. A stream without one passes through.
+    """
+
+    # a WAV header bigger than this is not a header we understand
+    MAX_HEADER_SIZE: int = 64 * 1024
+
+    def __init__(self) -> None:
+        self._header: Optional[bytearray] = bytearray()
+
+    @property
+    def done(self) -> bool:
+        """ whether we know where the audio starts """
+        return self._header is None
+
+    def strip(self, chunk: bytes | memoryview) -> Optional[memoryview]:
+        """
+        The audio in `chunk`, or None while more bytes are needed to find the
+        end of the header.
+        """
+        if self._header is None:
+            return memoryview(chunk)
+
+        header = self._header
+        header += chunk
+
+        # not a wav file, everything we have collected is audio
+        if header[:4] != b"RIFF"[:len(header)]:
+            self._header = None
+            return memoryview(bytes(header))
+
+        # RIFF <size> WAVE, then a list of <id> <size> <payload> chunks
+        offset = 12
+        while offset + 8 <= len(header):
+            chunk_id = bytes(header[offset:offset + 4])
+            chunk_size = int.from_bytes(header[offset + 4:offset + 8], "little")
+
+            if chunk_id == b"data":
+                self._header = None
+                return memoryview(bytes(header[offset + 8:]))
+
+            # chunks are word aligned
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+        if len(header) > self.MAX_HEADER_SIZE:
+            logger.warning("No data chunk found in WAV header, treating the stream as raw audio")
+            self._header = None
+            return memoryview(bytes(header))
+
+        return None
+
+
+class FrameBuffer:
+    """
+    Cuts an audio stream into fixed size frames.
+
+    The partial frame lives in a single preallocated bytearray, so incoming
+    chunks are copied at most once, straight into the frame they belong to,
+    and nothing is reallocated as the utterance grows. Whole frames inside a
+    chunk are sliced out of it directly.
+
+    With `skip_header`, a WAV header at the start of the stream is skipped
+    (see WavHeader). Raw PCM passes through. The last frame is padded out
+    with silence in `encoding` (the call's, by default).
+    """
+
+    def __init__(self, frame_size: Optional[int] = None, skip_header: bool = True,
+                 encoding: Optional[str] = None) -> None:
+        self.frame_size = frame_size or StreamingConfig.CHUNK_SIZE
+        self.skip_header = skip_header
+        self.silence = SILENCE[encoding or StreamingConfig.ENCODING]
+
+        self._frame = bytearray(self.frame_size)
+        self._view = memoryview(self._frame)
+        self.reset()
+
+    def reset(self) -> None:
+        """ forget any buffered audio, so the buffer can be reused for the next utterance """
+        self._filled = 0
+        self._header: Optional[WavHeader] = WavHeader() if self.skip_header else None
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        """ add a chunk of audio, yielding every frame that is now complete """
+        data: Optional[memoryview] = memoryview(chunk)
+
+        if self._header is not None:
+            data = self._header.strip(data)
+            if self._header.done:
+                self._header = None
+            if data is None:
+                return
+
+        size = self.frame_size
+        length = len(data)
+        position = 0
+
+        # first, top up the partial frame left over from the last chunk
+        if self._filled:
+            take = min(size - self._filled, length)
+            self._view[self._filled:self._filled + take] = data[:take]
+            self._filled += take
+            position = take
+
+            if self._filled < size:
+                return
+
+            self._filled = 0
+            yield bytes(self._frame)
+
+        # then, whole frames straight out of the chunk
+        while length - position >= size:
+            yield bytes(data[position:position + size])
+            position += size
+
+        # and keep the remainder for next time
+        remainder = length - position
+        if remainder:
+            self._view[:remainder] = data[position:]
+            self._filled = remainder
+
+    def flush(self, pad: bool = True) -> Optional[bytes]:
+        """
+        Return the trailing partial frame, if there is one.
+
+        With `pad`, the frame is padded with silence up to the full frame size,
+        since the telephony providers expect every frame to be the same length.
+        """
+        if not self._filled:
+            return None
+
+        tail = bytes(self._view[:self._filled])
+        self._filled = 0
+
+        if pad:
+            tail = tail.ljust(self.frame_size, self.silence)
+
+        return tail
@@ -0,0 +1,175 @@
+import asyncio
+import inspect
+from typing import AsyncGenerator, AsyncIterator, Callable, Optional
+
+from const import AppConfig
+from processing.hedging import Attempt, ProviderHealth, hedge, health, swapped
+from .abstract import TextToSpeech
+
+
+async def _aclose(audio: Optional[AsyncIterator[bytes]]) -> None:
+    if audio is not None and hasattr(audio, "aclose"):
+        await audio.aclose()  # type: ignore[attr-defined]
+
+
+class TextTee:
+    """
+    Lets several providers read the same stream of text, each from the start,
+    however far the others have got. The source is read by a task of its
+    own, so giving up one reader never cuts the stream short for the others.
+    """
+
+    def __init__(self, source: AsyncIterator[str]) -> None:
+        self.source = source
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+        # set once the first text is in, when a provider could start speaking
+        self.ready = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self.source:
+                self.chunks.append(chunk)
+                self.ready.set()
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.ready.set()
+            self._notify()
+
+    async def reader(self) -> AsyncGenerator[str, None]:
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                index += 1
+                yield self.chunks[index - 1]
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if hasattr(self.source, "aclose"):
+            await self.source.aclose()  # type: ignore[attr-defined]
+
+
+class HedgedTTS(TextToSpeech):
+    """
+    Speaks with `primary`, unless it has not sent any audio within its
+    budget (AppConfig.HEDGE_TTS_BUDGET, or its p95 if that is longer), in
+    which case `secondary` is started too and whichever speaks first is
+    used. A provider whose circuit breaker is open is skipped for the other.
+
+    Both providers read the same text (see TextTee), so the secondary can
+    start late and still say the whole reply.
+    """
+
+    def __init__(self, primary: TextToSpeech, secondary: TextToSpeech,
+                 primary_name: str, secondary_name: str) -> None:
+        self.primary = primary
+        self.secondary = secondary
+        self.health = {
+            id(primary): health("tts", primary_name),
+            id(secondary): health("tts", secondary_name),
+        }
+
+    def output_format(self):
+        return self.primary.output_format()
+
+    def cache_namespace(self) -> str:
+        return self.primary.cache_namespace()
+
+    async def prepare(self) -> None:
+        await self.primary.prepare()
+
+    def _order(self) -> tuple[TextToSpeech, TextToSpeech]:
+        """ primary first, unless its breaker is open and the secondary's is not """
+        primary, secondary = self.primary, self.secondary
+        if swapped(self.health[id(primary)], self.health[id(secondary)]):
+            return secondary, primary
+        return primary, secondary
+
+    def _attempt(self, tts: TextToSpeech, speak: Callable[[TextToSpeech], object],
+                 said: Callable[[], bool]) -> Attempt:
+        audio: Optional[AsyncIterator[bytes]] = None
+
+        async def run() -> tuple[Optional[AsyncIterator[bytes]], Optional[bytes]]:
+            nonlocal audio
+            stream = speak(tts)
+            if inspect.isawaitable(stream):
+                stream = await stream
+            audio = stream  # type: ignore[assignment]
+            assert audio is not None
+
+            first = await anext(audio, None)
+            if first is None and said():
+                # a provider that drops the connection may just end the stream
+                raise RuntimeError("no audio for the text")
+            return audio, first
+
+        async def discard() -> None:
+            # the provider itself is closed with this instance
+            await _aclose(audio)
+
+        return Attempt(self.health[id(tts)], run, discard)
+
+    async def _hedged(self, speak: Callable[[TextToSpeech], object], said: Callable[[], bool],
+                      tee: Optional[TextTee] = None) -> AsyncGenerator[bytes, None]:
+        """ `said` is whether there was any text to speak, after the fact """
+        primary, secondary = self._order()
+        first_choice = self._attempt(primary, speak, said)
+        budget = first_choice.health.budget(AppConfig.HEDGE_TTS_BUDGET, AppConfig.HEDGE_MAX_BUDGET)
+
+        audio: Optional[AsyncIterator[bytes]] = None
+        try:
+            winner = await hedge(first_choice, self._attempt(secondary, speak, said), budget, tee and tee.ready)
+            audio, first = winner.result
+            health: ProviderHealth = winner.health
+
+            if first is None:
+                return
+
+            try:
+                yield first
+                async for chunk in audio:
+                    yield chunk
+            except Exception as e:
+                # too late to switch, the caller has heard part of it
+                health.failure(f"failed mid utterance: {e!r}")
+                raise
+
+        finally:
+            await _aclose(audio)
+            if tee is not None:
+                await tee.close()
+
+    async def speak(self, text: str) -> AsyncGenerator[bytes, None]:
+        return self._hedged(lambda tts: tts.speak(text), lambda: bool(text.strip()))
+
+    async def speak_stream(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        tee = TextTee(text_buffer)
+        def said() -> bool:
+            return any(chunk.strip() for chunk in tee.chunks)
+
+        return self._hedged(lambda tts: tts.speak_stream(tee.reader()), said, tee)
+
+    async def close(self):
+        await asyncio.gather(self.primary.close(), self.secondary.close(), return_exceptions=True)
@@ -0,0 +1,34 @@
+from typing import AsyncGenerator
+
+from processing import admission
+from .abstract import TextToSpeech
+
+
+class LimitedTTS(TextToSpeech):
+    """
+    Holds a turn of the provider's limiter (see processing/admission.py)
+    from when an utterance starts synthesizing until its audio has all come
+    in. Wrapped inside the cache, so replies played from it never queue.
+    """
+
+    def __init__(self, tts: TextToSpeech, name: str) -> None:
+        self.tts = tts
+        self.name = name
+
+    def output_format(self):
+        return self.tts.output_format()
+
+    def cache_namespace(self) -> str:
+        return self.tts.cache_namespace()
+
+    async def prepare(self) -> None:
+        await self.tts.prepare()
+
+    async def speak(self, text: str) -> AsyncGenerator[bytes, None]:
+        return admission.limited("tts", self.name, self.tts.speak(text))
+
+    async def speak_stream(self, text_buffer: AsyncGenerator[str, None]) -> AsyncGenerator[bytes, None]:
+        return admission.limited("tts", self.name, self.tts.speak_stream(text_buffer))
+
+    async def close(self):
+        await self.tts.close()
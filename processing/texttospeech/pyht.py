@@ -3,13 +3,22 @@ from typing import AsyncGenerator, AsyncIterable
 import pyht
 
 from const import AppConfig, StreamingConfig
+from processing.codec import AudioFormat
 from .abstract import TextToSpeech
+from .chunker import ChunkPolicy, chunk_text
 
 
 class PlayHTTTS(TextToSpeech):
     client: pyht.AsyncClient
     options: pyht.TTSOptions
 
+    # each chunk is synthesized on its own, so they are kept to whole sentences
+    CHUNK_POLICY: ChunkPolicy = ChunkPolicy(first_min=5, min_chars=60, max_chars=250)
+
+    # the encodings the api can send (at any sample rate), anything else is
+    # sent as linear16 and converted
+    FORMATS = {"linear16": pyht.Format.FORMAT_RAW, "mulaw": pyht.Format.FORMAT_MULAW}
+
     @classmethod
     def create(cls) -> "PlayHTTTS":
         self = cls()
@@ -31,17 +40,22 @@ class PlayHTTTS(TextToSpeech):
             sample_rate=StreamingConfig.FREQUENCY,
 
             # the generated audio encoding, supports 'raw' | 'mp3' | 'wav' | 'ogg' | 'flac' | 'mulaw'
-            format=pyht.Format.FORMAT_WAV,
+            # (raw, rather than wav, so there is no header to play)
+            format=self.FORMATS.get(StreamingConfig.ENCODING, pyht.Format.FORMAT_RAW),
 
             # playback rate of generated speech
             speed=1,
         )
 
-        # this is what format=wav returns
-        # nchannels=1, sampwidth=2, framerate=8000, nframes=2147483647, comptype='NONE', compname='not compressed'
-
         return self
 
+    def output_format(self) -> AudioFormat:
+        encoding = StreamingConfig.ENCODING if StreamingConfig.ENCODING in self.FORMATS else "linear16"
+        return AudioFormat(encoding, StreamingConfig.FREQUENCY)
+
+    def cache_namespace(self) -> str:
+        return f"playht:PlayHT2.0-turbo:{self.options.voice}:{self.options.speed}:{self.options.format}"
+
     def speak(self, text: str) -> AsyncGenerator[bytes, None]:
         """ This streams text to the PlayHT API and returns the audio data. """
 
@@ -57,7 +71,7 @@ class PlayHTTTS(TextToSpeech):
         """ This streams text buffer to the PlayHT API and returns the audio data. """
 
         response = self.client.stream_tts_input(
-            text_stream=text_buffer,
+            text_stream=chunk_text(text_buffer, self.CHUNK_POLICY),
             voice_engine="PlayHT2.0-turbo",
             options=self.options
         )
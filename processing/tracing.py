@@ -0,0 +1,75 @@
+import random
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from const import AppConfig
+from processing.metrics import Metrics
+
+
+class TurnTrace:
+    """
+    Timestamps (time.monotonic) of the milestones of a single turn.
+
+    The spans, in order:
+        speech_end      the caller stopped talking
+        utterance_end   we decided the turn was over (UtteranceEnd or the local VAD)
+        first_token     the LLM produced its first token
+        first_audio     the TTS provider produced its first audio byte
+        first_frame     the first frame went out to the caller
+        last_frame      the last frame went out to the caller
+
+    When the turn finishes, every span it got to is observed as seconds
+    since speech_end, in the `turn_span_seconds` histogram, labelled with
+    how the turn ended:
+        done            the caller heard the whole reply
+        cancelled       the caller barged in (or hung up) part way through
+        failed          the model or text to speech raised
+    """
+
+    SPANS = ("speech_end", "utterance_end", "first_token", "first_audio", "first_frame", "last_frame")
+    OUTCOMES = ("done", "cancelled", "failed")
+
+    def __init__(self) -> None:
+        self.marks: dict[str, float] = {}
+
+    def mark(self, span: str, at: Optional[float] = None) -> None:
+        """ record a span, only the first time it happens """
+        if span not in self.marks:
+            self.marks[span] = time.monotonic() if at is None else at
+
+    def finish(self, outcome: str = "done") -> None:
+        start = self.marks.get("speech_end") or self.marks.get("utterance_end")
+        if start is None:
+            return
+
+        for span in self.SPANS[1:]:
+            if span in self.marks:
+                _span_histograms[(span, outcome)].observe(self.marks[span] - start)
+
+
+_span_histograms = {
+    (span, outcome): Metrics.histogram(
+        "turn_span_seconds", "seconds from the end of caller speech to each turn milestone",
+        {"span": span, "outcome": outcome}
+    )
+    for span in TurnTrace.SPANS[1:]
+    for outcome in TurnTrace.OUTCOMES
+}
+
+# the trace of the turn the current task is working on, if it is sampled
+current_turn: ContextVar[Optional[TurnTrace]] = ContextVar("current_turn", default=None)
+
+
+def start_turn() -> Optional[TurnTrace]:
+    """ a new trace, or None if this turn is not sampled (AppConfig.TRACE_SAMPLE_RATE) """
+    if AppConfig.TRACE_SAMPLE_RATE < 1 and random.random() >= AppConfig.TRACE_SAMPLE_RATE:
+        return None
+    return TurnTrace()
+
+
+def mark(span: str) -> None:
+    """ record a span on the current turn, a no-op if it is not being traced """
+    trace = current_turn.get()
+    if trace is not None:
+        trace.mark(span)